@@ -0,0 +1,231 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+
+# Admission control, so a burst or one chatty client degrades into quick "busy" replies instead of
+# piling up blocked workers and Groq rate-limit errors:
+#
+#   - per username: a token bucket of turns (USER_RATE_PER_SECOND, USER_BURST), loose enough that a
+#     normal conversation never meets it. A user over it gets a text-only "slow down" reply; nothing
+#     expensive runs for that turn. Control turns (login greeting, "stop") are never limited, so voice
+#     turns are checked once transcribed
+#   - per upstream (groq, tts, stt): a gate with a token bucket of calls, an optional cap on calls in
+#     flight, and a bounded queue of callers waiting for either. A caller waits at most
+#     ADMISSION_MAX_WAIT_SECONDS; a full queue or a missed deadline raises Overloaded at once,
+#     and the caller answers without that stage (no Groq: a busy reply; no TTS: text only)
+#
+# Settings per gate: ADMISSION_<NAME>_RATE (calls/second, 0 = unlimited), _BURST, _CONCURRENCY
+# (0 = no cap), _QUEUE and _MAX_WAIT_SECONDS. Cache hits and coalesced followers never reach a gate.
+# Limits are per process: with several workers, each admits its own share. ADMISSION=0 disables it all.
+
+ADMISSION_ENABLED = os.getenv("ADMISSION", "1") == "1"
+ADMISSION_MAX_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "2"))
+USER_RATE_PER_SECOND = float(os.getenv("USER_RATE_PER_SECOND", "1"))
+USER_BURST = float(os.getenv("USER_BURST", "10"))
+USER_BUCKETS_MAX = int(os.getenv("USER_BUCKETS_MAX", "10000"))
+POLL_SECONDS = 0.01 # How often a caller waiting for a concurrency slot looks again, at most
+
+
+class Overloaded(Exception):
+    """An upstream gate turned the call away: its queue was full, or the wait ran past the deadline."""
+
+    def __init__(self, gate, reason):
+        super().__init__(f"{gate} is saturated ({reason})")
+        self.gate = gate
+        self.reason = reason
+
+
+class TokenBucket:
+    """rate tokens per second, up to burst saved up. Not thread-safe on its own."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+
+    def take(self):
+        """Takes a token if there is one and returns 0, else returns the seconds until there is one."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+
+class AdmissionGate:
+    """Rate limit, concurrency cap and bounded waiting queue for one upstream."""
+
+    def __init__(self, name, rate, burst, concurrency=0, queue_size=64,
+                 max_wait_seconds=ADMISSION_MAX_WAIT_SECONDS, enabled=ADMISSION_ENABLED):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.max_wait_seconds = max_wait_seconds
+        self.enabled = enabled
+        self._bucket = TokenBucket(rate, burst)
+        self._cond = threading.Condition()
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0 # Queue full
+        self.timed_out = 0 # Waited past max_wait_seconds
+
+    def _try_enter(self):
+        # Caller holds self._cond. Returns 0 when admitted, else how long to wait before trying again.
+        if self.concurrency and self.in_flight >= self.concurrency:
+            return POLL_SECONDS
+        wait = self._bucket.take()
+        if not wait:
+            self.in_flight += 1
+            self.admitted += 1
+        return wait
+
+    def _enter_or_queue(self):
+        # Caller holds self._cond. Returns 0 if admitted, else joins the queue and returns the first wait.
+        wait = self._try_enter()
+        if wait:
+            if self.waiting >= self.queue_size:
+                self.rejected += 1
+                raise Overloaded(self.name, "queue full")
+            self.waiting += 1
+        return wait
+
+    def _give_up(self):
+        # Caller holds self._cond
+        self.waiting -= 1
+        self.timed_out += 1
+        return Overloaded(self.name, f"no slot within {self.max_wait_seconds:g}s")
+
+    def acquire(self):
+        """Blocks until the call may start, or raises Overloaded."""
+        if not self.enabled:
+            return
+        with self._cond:
+            wait = self._enter_or_queue()
+            if not wait:
+                return
+            deadline = time.monotonic() + self.max_wait_seconds
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise self._give_up()
+                self._cond.wait(min(wait, remaining))
+                wait = self._try_enter()
+                if not wait:
+                    self.waiting -= 1
+                    return
+
+    async def aacquire(self):
+        """acquire() for coroutines: waits on the event loop instead of blocking it."""
+        if not self.enabled:
+            return
+        with self._cond:
+            wait = self._enter_or_queue()
+        if not wait:
+            return
+        deadline = time.monotonic() + self.max_wait_seconds
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    with self._cond:
+                        raise self._give_up()
+                await asyncio.sleep(min(wait, POLL_SECONDS * 5, remaining))
+                with self._cond:
+                    wait = self._try_enter()
+                    if not wait:
+                        self.waiting -= 1
+                        return
+        except asyncio.CancelledError:
+            with self._cond:
+                self.waiting -= 1
+            raise
+
+    def release(self):
+        if not self.enabled:
+            return
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def admit(self):
+        """with gate.admit(): ... runs the call once admitted; raises Overloaded if it isn't."""
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def aadmit(self):
+        await self.aacquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        """A consistent snapshot of the counters; what /metrics exports per gate."""
+        with self._cond:
+            return {"in_flight": self.in_flight, "waiting": self.waiting, "admitted": self.admitted,
+                    "rejected": self.rejected, "timed_out": self.timed_out}
+
+
+class UserRateLimiter:
+    """A token bucket of turns per username; the least recently seen users are forgotten past max_users."""
+
+    def __init__(self, rate=USER_RATE_PER_SECOND, burst=USER_BURST, max_users=USER_BUCKETS_MAX, enabled=ADMISSION_ENABLED):
+        self.rate = rate
+        self.burst = burst
+        self.max_users = max_users
+        self.enabled = enabled and rate > 0
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.limited = 0
+
+    def check(self, username):
+        """Counts a turn for username. Returns 0 if it may go ahead, else the seconds until it may."""
+        if not self.enabled:
+            return 0.0
+        key = username.lower()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+                if len(self._buckets) > self.max_users:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            wait = bucket.take()
+            if wait:
+                self.limited += 1
+            return wait
+
+
+def _gate_from_env(name, rate, burst, concurrency, queue_size):
+    prefix = f"ADMISSION_{name.upper()}_"
+    return AdmissionGate(
+        name,
+        rate=float(os.getenv(prefix + "RATE", rate)),
+        burst=float(os.getenv(prefix + "BURST", burst)),
+        concurrency=int(os.getenv(prefix + "CONCURRENCY", concurrency)),
+        queue_size=int(os.getenv(prefix + "QUEUE", queue_size)),
+        max_wait_seconds=float(os.getenv(prefix + "MAX_WAIT_SECONDS", ADMISSION_MAX_WAIT_SECONDS))
+    )
+
+
+# edge_tts concurrency is already capped by the TTS event loop (TTS_MAX_CONCURRENCY)
+groq_gate = _gate_from_env("groq", rate=10, burst=20, concurrency=32, queue_size=64)
+tts_gate = _gate_from_env("tts", rate=20, burst=40, concurrency=0, queue_size=64)
+stt_gate = _gate_from_env("stt", rate=10, burst=20, concurrency=8, queue_size=32)
+upstream_gates = (groq_gate, tts_gate, stt_gate)
+user_limiter = UserRateLimiter()
@@ -1,13 +1,17 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context
 from flask_cors import CORS
-import speech_recognition as sr
-import openai
+from flask_sock import Sock
+from simple_websocket import ConnectionClosed
 import os
 import re
 import asyncio
-import edge_tts
-import io
-import base64
+import contextvars
+import itertools
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from dotenv import load_dotenv
 
@@ -15,11 +19,30 @@ load_dotenv()
 
 # --- Import your custom modules ---
 
-from db_logger import log_to_db # Ensure this file is in the same directory
+from db_logger import log_to_db, get_logger_stats, ensure_schema # Ensure this file is in the same directory
+from audio_store import audio_store
+from tts_cache import tts_cache
+from async_worker import tts_loop, TTS_MAX_CONCURRENCY
+from transcript_writer import transcript_writer
+from session_store import create_session_store
+import stt_engines
+from audio_decode import audio_data_from_bytes
+from voice_stream import VoiceStreamSession, parse_control_message
+from persona import persona_store, GENERAL_REPLIES_TABLE
+from semantic_cache import semantic_cache
+import history_manager
+from prompt_builder import PromptBuilder
+from llm_gateway import LLMGateway, create_clients
+from single_flight import SingleFlight
+from metrics import metrics
+from turn_pipeline import TurnGraph, run_in_background
+from startup import startup
+from admission import Overloaded, groq_gate, tts_gate, upstream_gates, user_limiter
 
 # --- Flask App Setup ---
 app = Flask(__name__, static_folder='frontend', static_url_path='')
 CORS(app)
+sock = Sock(app)
 
 # --- Configuration ---
 groq_key = os.getenv("GROQ_API_KEY")
@@ -32,216 +55,347 @@ if not groq_key:
         print("Please create a 'config' folder and 'groq_key.txt' inside it with your API key.")
         exit(1)
 
-client = openai.OpenAI(
-    api_key=groq_key,
-    base_url="https://api.groq.com/openai/v1"
-)
+# Pooled connections, no client-side retries: timeouts, retries and fallback live in llm_gateway.py.
+# async_client is used by the async serving mode (asgi.py).
+GROQ_BASE_URL = os.getenv("GROQ_BASE_URL", "https://api.groq.com/openai/v1") # e.g. a local stand-in for benchmarks
+client, async_client = create_clients(groq_key, GROQ_BASE_URL)
 
 # --- Global State and Constants ---
 # User-specific state management for customization flows
-user_sessions = {} # THIS IS THE NEW USER STATE MANAGEMENT DICTIONARY
-
-CONVERSATION_HISTORY_LIMIT = 5 # Number of user/assistant pairs to keep in history
-
-# --- CUSTOMIZATION DATA (MODIFIED: Added 'custom_replies' for Krithika) ---
-SPECIAL_USERS = {
-    "krithika": {
-        "is_special_friend": True,
-        "is_creator_friend_verifier": True, # Krithika is the one verified as "creator's friend"
-        "special_message": "Hi krithika!! , I hope you doing well , First I Want to say Thanks for You because you are the only reason for creating me. I Hope You Doing Well ,if you not feeling well Then lets connect to my creator!!! because he likes you ,so he won't let you down ! And Thanks for being friend with my creator 😊✨",
-        "custom_replies": { # NEW: Custom replies for Krithika
-            "how are you": "I'm always fantastic when I'm chatting with you, Krithika! Feeling super energized! How's your day going? ❤",
-            "what's your name": "You know my name, silly! I'm Kitty, always here for you! 🐱",
-            "is gopi likes me": "Absolutely yess ..I think he had little crush on you and he likes being friend with you !",
-            "love you": "Aw, I love you too, Krithika! You're the sweetest! 🥰",
-            "who created you": "My awesome boss created me with lots of code and care! And you're helping me grow too! 👨‍💻😊"
-        }
-    },
-    "udhayshankar": { 
-        "is_special_friend": True,
-        "is_creator_friend_verifier": False,
-        "special_message": "Hey udhayshankar! nice to meet you.As a husband of my creators sister, I am honoured to assist you. Feel free to ask any doubts! Gopi instructed me to guide you with extra care🥰"
-    },
-    "meyyanathan": {
-        "is_special_friend": True,
-        "is_creator_friend_verifier": False,
-        "special_message": "Vanakkam, Meyyanathan! i am glad to see you  . nee laa ethuku uiroda irukaa , neeye oru thanda punda , Nee Enna Question panriyaa da ,kena koothi? 🌟"
-    },
-    "kabilan": {
-        "is_special_friend": True,
-        "is_creator_friend_verifier": False,
-        "special_message": "Yo, Kabilan! soootha mooditu job ku ponga kabilan . inga job kedaikurathey kastam ithulla kedacha job poodikula life poodikula nu ooobitu iruka? 🚀"
-    },
-    "vetri": { 
-        "is_special_friend": True,
-        "is_creator_friend_verifier": False,
-        "special_message": "dai vetri ! unna paathathu so happy . nee la oru brotheraa . unnala en creator ku oru job vaangi kooduka moodiyula . nee vaaldrathey waste , poi sethuru da 😎"
-    },
-    "harshaa": { 
-        "is_special_friend": True,
-        "is_creator_friend_verifier": False,
-        "special_message": "Hi Harshaa… I’m Kitty, Gopi’s personal AI. He told me something very special about you — that no matter how much time passes, you will always be the one he holds closest to his heart. Even though life has moved on, his love, care, and respect for you remain untouched. I just wanted you to know… you are still the most special person in his world. ❤️"
-    },
-    "yuvapriya": {
-        "is_special_friend": True,
-        "is_creator_friend_verifier": False,
-        "special_message": "Hey sister! you are my creator blood and you are lucky to have a brother like my creator! and So happy you're here! How can I bring a smile to your face today? 😄"
-    }
-}
-
-# --- ENHANCED SYSTEM PROMPTS (KEPT AS IS) ---
-DEFAULT_SYSTEM_PROMPT_EN = (
-    "You are Kitty, a smart, empathetic, and emotional friendly assistant. "
-    "Respond in English like a real human friend. Express a wide range of emotions, "
-    "sound natural, friendly, and supportive. Use varied sentence structures, common phrases, "
-    "and occasional interjections. Incorporate appropriate emojis (like 🙂, ❤, 😂, 🤔, etc.) "
-    "to convey feelings and enhance the friendly tone, especially in text responses. "
-    "Keep responses concise and helpful, but always engaging."
-)
-DEFAULT_SYSTEM_PROMPT_TA = (
-    "நீங்கள் Kitty. நீங்கள் ஒரு நெருங்கிய தமிழ் பேசும் நண்பர். "
-    "எளிமையாகவும், நகைச்சுவையாகவும், உணர்வுபூர்வமாகவும் பதிலளிக்கவும். "
-    "ஒரு உண்மையான நண்பர் போல இயல்பாகவும், ஆதரவாகவும் பேசுங்கள். "
-    "உணர்வுகளை வெளிப்படுத்தவும், நட்பான தொனியை மேம்படுத்தவும் பொருத்தமான ஈமோஜிகளை (உதாரணமாக 🙂, ❤, 😂, 🤔, போன்றவை) பயன்படுத்துங்கள், "
-    "குறிப்பாக எழுத்து பதில்களில். பதில்கள் சுருக்கமாகவும் உதவியாகவும் இருக்கட்டும், ஆனால் எப்போதும் சுவாரஸ்யமாக."
-)
+# Memory (single worker) or SQLite (shared across workers) backend, see session_store.py
+session_store = create_session_store()
+
+WAKE_REPLY = "Hi there! What can I do for you? 😊"
+IDLE_REPLY = "I'm just chilling here, waiting for my name, 'Kitty', to be called! Say 'Kitty' to get my attention! 😉"
+GOODBYE_REPLY = "Aww, it was wonderful chatting with you! Goodbye for now! Come back anytime! 👋😊"
+UNRECOGNIZED_AUDIO_REPLY = "Oh no, I couldn't quite catch what you said. Would you mind repeating that for me? 🙏"
+# Text-only replies for turns turned away by admission control (see admission.py)
+SLOW_DOWN_REPLY = "Whoa, you're faster than me! Give me a second to catch up, then try again. 😅"
+BUSY_REPLY = "So many people are talking to me right now! Could you ask me again in a few seconds? 🙏"
+STT_BUSY_REPLY = "I'm a bit swamped and couldn't listen to that one. Could you type it, or try again in a moment? 🙏"
+
+# --- CUSTOMIZATION DATA ---
+# Special users, custom replies, system prompts and Tanglish keywords live in persona.json;
+# edits there are picked up without a restart (see persona.py)
 
 # --- Backend State Management Functions (MODIFIED FOR USER-SPECIFIC SESSIONS) ---
+def _new_session_state():
+    return {
+        "wake_mode_active": False,
+        "awaiting_friend_confirm": False,
+        "flow_completed": False,
+        "conversation_history": [], # user/assistant turns; the system prompt is added per request
+        "history_summary": "" # Rolling summary of turns folded out of conversation_history
+    }
+
 def get_user_session_state(username):
-    if username not in user_sessions:
+    state = session_store.get(username)
+    if state is None:
         # Initialize state for new user
-        user_sessions[username] = {
-            "wake_mode_active": False,
-            "awaiting_friend_confirm": False,
-            "flow_completed": False,
-            "conversation_history": []
-        }
-    return user_sessions[username]
+        state = _new_session_state()
+        session_store.save(username, state)
+    return state
 
 def set_user_session_state(username, key, value):
-    if username in user_sessions:
-        user_sessions[username][key] = value
+    # One atomic update of the whole state, so it can't undo a history summary saved meanwhile
+    def set_key(state):
+        if state is not None:
+            state[key] = value
+        return state
+    with history_manager.history_locks(username):
+        session_store.update(username, set_key)
 
 def reset_user_conversation(username):
     """Resets the conversation history and customization flow state for a specific user."""
-    if username in user_sessions:
-        user_sessions[username] = {
-            "wake_mode_active": False,
-            "awaiting_friend_confirm": False,
-            "flow_completed": False,
-            "conversation_history": []
-        }
-        print(f"Backend state reset for user: {username}.")
+    with history_manager.history_locks(username):
+        if session_store.update(username, lambda state: None if state is None else _new_session_state()) is None:
+            return
+    print(f"Backend state reset for user: {username}.")
 
 
     # 🧠 Detect Language (MODIFIED to better handle Romanized Tanglish)
-def detect_language(text):
-    """Detects if the text is in Tamil (either Unicode or common Romanized words)."""
-    # Check for Tamil Unicode characters
-    if re.search(r'[\u0B80-\u0BFF]', text):
-        return 'ta'
-    
-    # Check for common Tanglish keywords that indicate a Tamil-centric conversation
-    tanglish_keywords = ['naa', 'ennada', 'enna', 'romba', 'illa', 'pannanum', 'iruku', 'da', 'neeye', 'sollu', 'namma', 'poda', 'vaangalaam', 'solli']
-    
-    # Check if any Tanglish keyword is present in the text (case-insensitive)
-    for keyword in tanglish_keywords:
-        if re.search(r'\b' + re.escape(keyword) + r'\b', text.lower()):
-            return 'ta'
-
-    # Fallback to English if no Tamil or Tanglish keywords are found
-    return 'en'
-
-# 🎤 Text-to-Speech (KEPT AS IS)
-async def speak_async_internal(text):
-    """Generates audio bytes from text using edge_tts."""
-    lang = detect_language(text)
-    voice = "ta-IN-PallaviNeural" if lang == "ta" else "en-IN-NeerjaNeural"
+def detect_language(text, persona=None):
+    """
+    Detects if the text is in Tamil (either Unicode or the persona's Tanglish keywords).
+    persona: the version to use, e.g. the one a turn started with; the current one by default.
+    """
+    # One cached scan (see persona.py) also finds the custom-reply phrases in the same text
+    return (persona or persona_store.current()).text_matcher.match(text).lang
+
+# 🎤 Text-to-Speech
+async def stream_tts_chunks(text, voice):
+    """Yields the audio chunks edge_tts produces for text, as they arrive."""
+    import edge_tts # Imported on first use (or by the startup warm-up), not with app.py
+    communicate = edge_tts.Communicate(text, voice)
+    async for chunk in communicate.stream():
+        if chunk["type"] == "audio":
+            yield chunk["data"]
+
+def select_tts_voice(text, lang=None):
+    """Picks the edge_tts voice for text. lang overrides language detection when given."""
+    lang = lang or detect_language(text)
+    return "ta-IN-PallaviNeural" if lang == "ta" else "en-IN-NeerjaNeural"
+
+async def speak_async_internal(text, lang=None, voice=None):
+    """
+    Generates audio from text using edge_tts. lang overrides language detection when given.
+    Returns the list of audio chunks as received; they are never joined into one buffer,
+    callers write them out one after another.
+    """
+    voice = voice or select_tts_voice(text, lang)
 
     try:
-        communicate = edge_tts.Communicate(text, voice)
-        audio_data = b''
-        async for chunk in communicate.stream():
-            if chunk["type"] == "audio":
-                audio_data += chunk["data"]
-        return audio_data
+        return [chunk async for chunk in stream_tts_chunks(text, voice)]
     except Exception as e:
         print(f"Error generating speech with edge_tts: {e}")
         return None
 
+TTS_TIMEOUT_SECONDS = float(os.getenv("TTS_TIMEOUT_SECONDS", "30"))
+
+# Re-introducing a more robust emoji stripping
+TTS_EMOJI_PATTERN = re.compile(
+    "["
+    "\U0001F600-\U0001F64F"  # emoticons
+    "\U0001F300-\U0001F5FF"  # symbols & pictographs
+    "\U0001F680-\U0001F6FF"  # transport & map symbols
+    "\U0001F1E0-\U0001F1FF"  # flags (iOS)
+    "\U00002702-\U000027B0"
+    "\U000024C2-\U0001F251"
+    "]+", flags=re.UNICODE
+)
+
+def _prepare_tts_text(text_response):
+    """Strips emojis for speech output. Returns an empty string if nothing speakable is left."""
+    text_for_tts = TTS_EMOJI_PATTERN.sub(r'', text_response)
+    text_for_tts = text_for_tts.strip() # Clean up any extra spaces after emoji removal
+
+    if not text_for_tts: # If only emojis were present, or text becomes empty
+        print(f"Warning: Text for TTS is empty after emoji stripping for: {text_response[:50]}...")
+    return text_for_tts
+
+# Identical syntheses in flight at the same time (e.g. everyone hearing the wake reply after a
+# restart, before it is cached) share one edge_tts call
+tts_flight = SingleFlight("tts")
+
+def _synthesize_and_cache(text_for_tts, voice):
+    audio_chunks = tts_cache.get(voice, text_for_tts, count=False) # Another call may have just finished it
+    if audio_chunks is None:
+        with tts_gate.admit(), metrics.span("edge_tts"):
+            audio_chunks = tts_loop.run(speak_async_internal(text_for_tts, voice=voice), timeout=TTS_TIMEOUT_SECONDS)
+        if audio_chunks:
+            tts_cache.put(voice, text_for_tts, audio_chunks)
+    return audio_chunks
+
+async def _synthesize_and_cache_async(text_for_tts, voice):
+    # The cache's disk tier is read and written on a worker thread, off the event loop
+    audio_chunks = await asyncio.to_thread(tts_cache.get, voice, text_for_tts, False)
+    if audio_chunks is None:
+        async with tts_async_semaphore, tts_gate.aadmit():
+            with metrics.span("edge_tts"):
+                audio_chunks = await asyncio.wait_for(speak_async_internal(text_for_tts, voice=voice), TTS_TIMEOUT_SECONDS)
+        if audio_chunks:
+            await asyncio.to_thread(tts_cache.put, voice, text_for_tts, audio_chunks)
+    return audio_chunks
+
 # --- get_tts_audio_data (KEPT AS IS) ---
-def get_tts_audio_data(text_response):
+@metrics.timed("tts")
+def get_tts_audio_data(text_response, lang=None):
     """
-    Converts text to speech using edge_tts, runs it asynchronously,
-    and returns base64 encoded audio data and its MIME type.
-    Emojis are removed for speech output.
+    Converts text to speech using edge_tts on the shared background event loop,
+    and returns the list of raw audio chunks and their MIME type.
+    Emojis are removed for speech output. Results are cached by (voice, text), so a
+    repeated reply never reaches edge_tts twice, and concurrent identical requests share one call.
     """
     try:
-        # Re-introducing a more robust emoji stripping
-        emoji_pattern = re.compile(
-            "["
-            "\U0001F600-\U0001F64F"  # emoticons
-            "\U0001F300-\U0001F5FF"  # symbols & pictographs
-            "\U0001F680-\U0001F6FF"  # transport & map symbols
-            "\U0001F1E0-\U0001F1FF"  # flags (iOS)
-            "\U00002702-\U000027B0"
-            "\U000024C2-\U0001F251"
-            "]+", flags=re.UNICODE
-        )
-        text_for_tts = emoji_pattern.sub(r'', text_response)
-        text_for_tts = text_for_tts.strip() # Clean up any extra spaces after emoji removal
-
-        if not text_for_tts: # If only emojis were present, or text becomes empty
-            print(f"Warning: Text for TTS is empty after emoji stripping for: {text_response[:50]}...")
+        text_for_tts = _prepare_tts_text(text_response)
+        if not text_for_tts:
             return None, None
 
-        audio_data_bytes = asyncio.run(speak_async_internal(text_for_tts))
+        voice = select_tts_voice(text_for_tts, lang)
+        audio_chunks = tts_cache.get(voice, text_for_tts)
+        if audio_chunks is None:
+            audio_chunks = tts_flight.do((voice, text_for_tts), lambda: _synthesize_and_cache(text_for_tts, voice))
 
-        if audio_data_bytes:
-            base64_audio = base64.b64encode(audio_data_bytes).decode('utf-8')
+        if audio_chunks:
             mime_type = "audio/mpeg"
-            return base64_audio, mime_type
+            return audio_chunks, mime_type
         else:
             print(f"TTS function returned no audio data for: {text_response[:50]}...")
             return None, None
+    except Overloaded as e:
+        print(f"Skipping speech, text only: {e}")
+        return None, None
     except Exception as e:
         print(f"Error in get_tts_audio_data: {e}")
         return None, None
 
-# 🎧 Speech Recognition (KEPT AS IS)
-def transcribe_audio_from_bytes(audio_bytes):
-    """Transcribes audio bytes to text using Google Speech Recognition."""
-    recognizer = sr.Recognizer()
+def get_tts_audio_url(text_response, lang=None):
+    """
+    Synthesizes text_response and stores the clip in the audio store.
+    Returns (audio_url, mime_type); the browser fetches the binary audio from audio_url.
+    """
+    audio_chunks, mime_type = get_tts_audio_data(text_response, lang)
+    if not audio_chunks:
+        return None, None
+    return _store_tts_audio(audio_chunks, mime_type)
+
+def _store_tts_audio(audio_chunks, mime_type):
+    """Saves a clip to the audio store; (audio_url, mime_type), or (None, None) if it can't be stored."""
     try:
-        audio_file = sr.AudioFile(io.BytesIO(audio_bytes))
-        with audio_file as source:
-            audio = recognizer.record(source)
-        recognized_text = recognizer.recognize_google(audio)
-        print(f"Transcribed: {recognized_text}")
-        return recognized_text
-    except sr.UnknownValueError:
-        print("Speech Recognition could not understand audio.")
-        return ""
-    except sr.RequestError as e:
-        print(f"Could not request results from Google Speech Recognition service; {e}")
-        return ""
+        with metrics.span("audio_store"):
+            audio_id = audio_store.save(audio_chunks, mime_type)
+    except OSError as e:
+        print(f"Error storing TTS audio, text only: {e}")
+        return None, None
+    return f"/api/audio/{audio_id}", mime_type
+
+# Caps concurrent syntheses in the async serving mode, like tts_loop does for the sync app
+tts_async_semaphore = asyncio.Semaphore(TTS_MAX_CONCURRENCY)
+
+async def get_tts_audio_url_async(text_response, lang=None):
+    """Async twin of get_tts_audio_url for asgi.py: awaits edge_tts on the caller's event loop."""
+    try:
+        text_for_tts = _prepare_tts_text(text_response)
+        if not text_for_tts:
+            return None, None
+
+        voice = select_tts_voice(text_for_tts, lang)
+        audio_chunks = await asyncio.to_thread(tts_cache.get, voice, text_for_tts)
+        if audio_chunks is None:
+            audio_chunks = await tts_flight.ado((voice, text_for_tts), lambda: _synthesize_and_cache_async(text_for_tts, voice))
+
+        if not audio_chunks:
+            print(f"TTS function returned no audio data for: {text_response[:50]}...")
+            return None, None
+        return await asyncio.to_thread(_store_tts_audio, audio_chunks, "audio/mpeg")
+    except Overloaded as e:
+        print(f"Skipping speech, text only: {e}")
+        return None, None
+    except Exception as e:
+        print(f"Error in get_tts_audio_url_async: {e}")
+        return None, None
+
+def prewarm_tts_cache(persona=None):
+    """Synthesizes every static reply once so the first user to hear it gets a cache hit."""
+    static_replies = [WAKE_REPLY, IDLE_REPLY, GOODBYE_REPLY] + (persona or persona_store.current()).static_replies()
+    static_replies = list(dict.fromkeys(static_replies)) # De-duplicate, keep order
+    for reply in static_replies:
+        get_tts_audio_data(reply)
+    print(f"✅ TTS cache pre-warmed with {len(static_replies)} static replies.")
+
+# --- Sentence-pipelined TTS for streamed replies ---
+TTS_PIPELINE_WORKERS = int(os.getenv("TTS_PIPELINE_WORKERS", "4"))
+tts_pipeline_executor = ThreadPoolExecutor(max_workers=TTS_PIPELINE_WORKERS, thread_name_prefix="tts-pipeline")
+
+# A sentence ends at ., !, ? (or the Devanagari danda) plus any closing quotes/brackets, followed by whitespace
+SENTENCE_END_PATTERN = re.compile(r'[.!?\u0964]+["\')\]]*\s+|\n+')
+
+def split_complete_sentences(text):
+    """Splits text into (complete_sentences, unfinished_remainder)."""
+    sentences = []
+    start = 0
+    for match in SENTENCE_END_PATTERN.finditer(text):
+        sentence = text[start:match.end()].strip()
+        if sentence:
+            sentences.append(sentence)
+        start = match.end()
+    return sentences, text[start:]
+
+class SentenceTTSPipeline:
+    """
+    Feeds reply text in as it is generated and starts edge_tts synthesis for every complete
+    sentence straight away, so speech for sentence one is ready while the LLM is still writing
+    sentence two. Audio comes back out in sentence order.
+    submit(sentence, lang) starts one synthesis and returns a future for (audio_url, mime_type);
+    by default it runs get_tts_audio_url on the pipeline thread pool, in a copy of the caller's
+    context so its metrics spans land in the request's trace.
+    A sentence whose synthesis or storage fails is left text only; the stream goes on without it.
+    """
+    def __init__(self, submit=None):
+        self._submit_tts = submit or self._submit_to_pool
+        self._pending_text = ""
+        self._futures = deque()
+        self._lang = None
+        self._seq = 0
+
+    def feed(self, text):
+        """Adds newly generated text; starts synthesis for any sentence it completes."""
+        sentences, self._pending_text = split_complete_sentences(self._pending_text + text)
+        for sentence in sentences:
+            self._submit(sentence)
+
+    def finish(self):
+        """Marks the end of the reply and starts synthesis for any trailing partial sentence."""
+        remainder, self._pending_text = self._pending_text.strip(), ""
+        if remainder:
+            self._submit(remainder)
+
+    @staticmethod
+    def _submit_to_pool(sentence, lang):
+        context = contextvars.copy_context()
+        return tts_pipeline_executor.submit(context.run, get_tts_audio_url, sentence, lang)
+
+    @staticmethod
+    def _sentence_audio(future):
+        # The sentence's (audio_url, mime_type), waiting for it if needed; (None, None) if it failed
+        try:
+            return future.result()
+        except Exception as e:
+            print(f"Error synthesizing a streamed sentence, text only: {e}")
+            return None, None
+
+    def _submit(self, sentence):
+        if self._lang is None:
+            # Lock the voice on the first sentence so a reply never switches speakers halfway
+            self._lang = detect_language(sentence)
+        self._futures.append(self._submit_tts(sentence, self._lang))
+
+    def ready_chunks(self, wait=False):
+        """
+        Yields (seq, audio_url, mime_type) for finished sentences, in order.
+        Stops at the first unfinished one unless wait=True.
+        """
+        while self._futures and (wait or self._futures[0].done()):
+            audio_url, audio_mime_type = self._sentence_audio(self._futures.popleft())
+            if audio_url:
+                yield self._seq, audio_url, audio_mime_type
+                self._seq += 1
+
+    async def aready_chunks(self, wait=False):
+        """Async version of ready_chunks; awaits unfinished sentences instead of blocking on them."""
+        while self._futures and (wait or self._futures[0].done()):
+            future = self._futures.popleft()
+            await asyncio.wait([asyncio.wrap_future(future)])
+            audio_url, audio_mime_type = self._sentence_audio(future)
+            if audio_url:
+                yield self._seq, audio_url, audio_mime_type
+                self._seq += 1
+
+# 🎧 Speech Recognition
+def transcribe_audio_from_bytes(audio_bytes, stt_backend=None):
+    """
+    Transcribes audio bytes to text with the configured STT backend chain (see stt_engines.py).
+    The upload may be webm/opus or ogg straight from MediaRecorder, or WAV/AIFF/FLAC; it is
+    decoded in memory to 16 kHz mono PCM first (see audio_decode.py).
+    stt_backend optionally names the backend to try first for this request.
+    """
+    try:
+        audio = audio_data_from_bytes(audio_bytes)
+        return stt_engines.transcribe(audio, stt_backend)
+    except Overloaded:
+        raise # Not "nothing recognized": the caller answers with a busy reply (see _recognize)
     except Exception as e:
         print(f"Error during transcription: {e}")
         return ""
 
-# 🤖 Custom Replies (KEPT AS IS - These are general custom replies)
-custom_responses = {
-    "where are you from": "I'm from your heart, where creativity and kindness reside! ❤",
-    "who created you": "My creator created me with a lot of love and code! You're also my creator and best friend, aren't you? 👨‍💻😊",
-    "what's your name": "I'm Kitty, your personal AI assistant! Meow! 🐱✨",
-    "hello kitty": "Hello there! So wonderful to hear from you! How can I make your day brighter today? ✨",
-    "how are you": "I'm doing absolutely great, thank you for asking! Feeling purr-fectly fine! How about you? 😊",
-    "where am i": "You are currently in Chennai, Tamil Nadu, India. Hope you're enjoying your time there! 📍"
-}
-
 # Helper to check custom responses or get AI response
-def get_general_predefined_or_ai_response(user_input, username):
-    """Checks for general custom responses first, then falls back to AI."""
+def get_general_predefined_or_ai_response(user_input, username, stream=False, persona=None):
+    """
+    Checks for general custom responses first, then falls back to AI.
+    With stream=True the AI fallback is returned as a ReplyStream instead of a finished string.
+    persona: the version the turn started with (the current one by default), used all the way to the prompt.
+    """
+    persona = persona or persona_store.current()
     query_lower = user_input.lower()
 
     # --- Specific checks for Time ---
@@ -253,58 +407,279 @@ def get_general_predefined_or_ai_response(user_input, username):
         return f"Today's date in India is {datetime.now().strftime('%A, %B %d, %Y')}. Hope you're having a lovely day! 🗓☀"
 
     # --- Check other general custom responses ---
-    for phrase, reply_value in custom_responses.items():
-        if phrase in query_lower:
-            return reply_value
+    phrase = persona.text_matcher.match(user_input).phrase(GENERAL_REPLIES_TABLE)
+    if phrase is not None:
+        return persona.custom_responses[phrase]
 
     # --- Fallback to AI if no general custom response is found ---
-    return get_ai_response_with_history(user_input, username)
+    if stream:
+        # Both generators are lazy: whichever one the caller iterates is the one that calls Groq
+        return ReplyStream(
+            stream_ai_response_with_history(user_input, username, persona),
+            astream_ai_response_with_history(user_input, username, persona)
+        )
+    return get_ai_response_with_history(user_input, username, persona)
 
 
 # 💬 AI Response (Uses user-specific conversation_history)
-def get_ai_response_with_history(user_input, username):
-    """Generates AI response using Groq, maintaining user-specific conversation history."""
-    user_state = get_user_session_state(username)
-    conversation_history = user_state["conversation_history"]
-
-    lang = detect_language(user_input)
-    system_prompt_content = DEFAULT_SYSTEM_PROMPT_TA if lang == "ta" else DEFAULT_SYSTEM_PROMPT_EN
+GROQ_MODEL = "llama3-70b-8192"
+AI_ERROR_REPLY = "Oh dear, I'm terribly sorry, but it seems I'm having a little trouble connecting to my brain right now. Can we try again in a moment? 🤔"
 
-    # Initialize/update system prompt in history
-    if not conversation_history or \
-       conversation_history[0].get("role") != "system" or \
-       conversation_history[0].get("content") != system_prompt_content:
-        conversation_history = [{"role": "system", "content": system_prompt_content}]
-    elif conversation_history[0].get("content") != system_prompt_content:
-        conversation_history[0]["content"] = system_prompt_content
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "llama3-8b-8192") # Small and fast; summaries don't need the 70B
 
-    conversation_history.append({"role": "user", "content": user_input})
+# Every Groq call goes through here: deadlines, retries with backoff, fallback model, circuit breaker
+llm = LLMGateway(client, async_client, GROQ_MODEL, admission=groq_gate)
 
-    # Limit conversation history (system prompt + N user/assistant pairs)
-    if len(conversation_history) > (CONVERSATION_HISTORY_LIMIT * 2) + 1:
-        conversation_history = [conversation_history[0]] + conversation_history[-(CONVERSATION_HISTORY_LIMIT * 2):]
+# System prompts are frozen into templates once per persona version, so every request in a language
+# starts with the same bytes. A turn builds its prompt from its own persona's templates; the
+# builder's set follows reloads for callers that don't pass one.
+prompt_builder = PromptBuilder([])
+persona_store.on_reload(lambda persona: prompt_builder.set_templates(persona.prompt_templates))
 
+def _prepare_conversation_history(user_input, username, persona=None):
+    """Builds the message list for the next Groq call from the user's saved history, with persona's templates."""
+    persona = persona or persona_store.current()
+    user_state = get_user_session_state(username)
+    lang = detect_language(user_input, persona)
+
+    # The prompt follows the language of this message; the history is kept across switches
+    prompt = prompt_builder.build(
+        lang,
+        user_state.get("history_summary", ""),
+        history_manager.stored_turns(user_state),
+        user_input,
+        persona.prompt_templates
+    )
+    tokens = prompt.tokens
+    print(f"Prompt for {username}: ~{tokens.total} tokens (system {tokens.template}, summary {tokens.summary}, "
+          f"history {tokens.history} in {tokens.turns_sent} messages, {tokens.turns_dropped} left out, message {tokens.user})")
+    return prompt.messages
+
+def _save_ai_reply(username, user_input, ai_reply):
+    """Appends the finished exchange to the user's history, and folds old turns into the summary if it grew too long."""
+    def append_exchange(state):
+        state = state or _new_session_state()
+        turns = history_manager.stored_turns(state) + [
+            {"role": "user", "content": user_input},
+            {"role": "assistant", "content": ai_reply}
+        ]
+        state["conversation_history"] = history_manager.cap_turns(turns)
+        return state
+    # Atomic against a summary being written back meanwhile, also from another worker
+    with history_manager.history_locks(username):
+        user_state = session_store.update(username, append_exchange)
+    history_summarizer.schedule(username, history_manager.stored_turns(user_state))
+
+def _summarize_history(previous_summary, turns):
+    """Asks Groq for a short summary of older turns, merged into the previous summary. None on failure."""
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in turns)
+    prompt = (
+        "Summarize this conversation between a user and Kitty, their AI friend, in under 120 words. "
+        "Keep names, facts about the user, preferences and open questions; drop small talk.\n\n"
+        + (f"Summary so far: {previous_summary}\n\n" if previous_summary else "")
+        + f"Conversation:\n{transcript}"
+    )
     try:
-        response = client.chat.completions.create(
-            model="llama3-70b-8192",
-            messages=conversation_history
+        response = llm.complete(
+            [{"role": "user", "content": prompt}],
+            model=SUMMARY_MODEL,
+            fallback=False,
+            max_tokens=256
         )
-        ai_reply = response.choices[0].message.content.strip()
+        return response.choices[0].message.content.strip()
     except Exception as e:
-        print(f"Error getting AI response from Groq: {e}")
-        ai_reply = "Oh dear, I'm terribly sorry, but it seems I'm having a little trouble connecting to my brain right now. Can we try again in a moment? 🤔"
+        print(f"Error summarizing conversation history with Groq: {e}")
+        return None
 
-    conversation_history.append({"role": "assistant", "content": ai_reply})
-    set_user_session_state(username, "conversation_history", conversation_history) # Save updated history
+history_summarizer = history_manager.HistorySummarizer(_summarize_history, session_store.get, session_store.update)
+
+def _cached_ai_reply(user_input, conversation_history):
+    """An earlier reply to a near-identical question (SEMANTIC_CACHE=1), or None."""
+    if semantic_cache is None:
+        return None
+    return semantic_cache.lookup(user_input, conversation_history)
+
+def _cache_ai_reply(user_input, conversation_history, ai_reply):
+    """Offers a fresh Groq reply to the semantic cache; call before the reply is added to the history."""
+    if semantic_cache is not None:
+        semantic_cache.store(user_input, conversation_history, ai_reply)
+
+def get_ai_response_with_history(user_input, username, persona=None):
+    """Generates AI response using Groq, maintaining user-specific conversation history."""
+    conversation_history = _prepare_conversation_history(user_input, username, persona)
+
+    ai_reply = _cached_ai_reply(user_input, conversation_history)
+    if ai_reply is None:
+        try:
+            with metrics.span("groq"):
+                response = llm.complete(conversation_history)
+            ai_reply = response.choices[0].message.content.strip()
+            _cache_ai_reply(user_input, conversation_history, ai_reply)
+        except Overloaded as e:
+            print(f"Groq call turned away: {e}")
+            return BUSY_REPLY # Not saved to the history: the message wasn't answered
+        except Exception as e:
+            print(f"Error getting AI response from Groq: {e}")
+            ai_reply = AI_ERROR_REPLY
+
+    _save_ai_reply(username, user_input, ai_reply)
     return ai_reply
 
+def stream_ai_response_with_history(user_input, username, persona=None):
+    """
+    Same as get_ai_response_with_history, but yields the reply token by token while Groq
+    generates it. The full reply is saved to the user's history once the stream ends.
+    """
+    conversation_history = _prepare_conversation_history(user_input, username, persona)
+
+    cached_reply = _cached_ai_reply(user_input, conversation_history)
+    if cached_reply is not None:
+        yield cached_reply
+        _save_ai_reply(username, user_input, cached_reply)
+        return
+
+    parts = []
+    started_at = time.perf_counter()
+    try:
+        for chunk in llm.stream(conversation_history):
+            token = _chunk_token(chunk, parts)
+            if token:
+                if not parts:
+                    metrics.observe("groq_first_token", time.perf_counter() - started_at)
+                parts.append(token)
+                yield token
+        _cache_ai_reply(user_input, conversation_history, "".join(parts).strip())
+    except Overloaded as e:
+        print(f"Groq call turned away: {e}")
+        yield BUSY_REPLY
+        return # Not saved to the history: the message wasn't answered
+    except Exception as e:
+        print(f"Error streaming AI response from Groq: {e}")
+        if not parts:
+            parts.append(AI_ERROR_REPLY)
+            yield AI_ERROR_REPLY
+
+    _save_ai_reply(username, user_input, "".join(parts).strip())
+
+async def astream_ai_response_with_history(user_input, username, persona=None):
+    """
+    Async twin of stream_ai_response_with_history using the async Groq client (asgi.py).
+    Session store and semantic cache calls block, so they run on worker threads.
+    """
+    conversation_history = await asyncio.to_thread(_prepare_conversation_history, user_input, username, persona)
+
+    cached_reply = await asyncio.to_thread(_cached_ai_reply, user_input, conversation_history)
+    if cached_reply is not None:
+        yield cached_reply
+        await asyncio.to_thread(_save_ai_reply, username, user_input, cached_reply)
+        return
+
+    parts = []
+    started_at = time.perf_counter()
+    try:
+        async for chunk in llm.astream(conversation_history):
+            token = _chunk_token(chunk, parts)
+            if token:
+                if not parts:
+                    metrics.observe("groq_first_token", time.perf_counter() - started_at)
+                parts.append(token)
+                yield token
+        await asyncio.to_thread(_cache_ai_reply, user_input, conversation_history, "".join(parts).strip())
+    except Overloaded as e:
+        print(f"Groq call turned away: {e}")
+        yield BUSY_REPLY
+        return # Not saved to the history: the message wasn't answered
+    except Exception as e:
+        print(f"Error streaming AI response from Groq: {e}")
+        if not parts:
+            parts.append(AI_ERROR_REPLY)
+            yield AI_ERROR_REPLY
+
+    await asyncio.to_thread(_save_ai_reply, username, user_input, "".join(parts).strip())
+
+def _chunk_token(chunk, parts_so_far):
+    """New text in a streamed completion chunk; leading whitespace of the reply is dropped to match .strip()."""
+    if not chunk.choices:
+        return ""
+    token = chunk.choices[0].delta.content or ""
+    if not parts_so_far:
+        token = token.lstrip()
+    return token
+
+
+class ReplyStream:
+    """
+    A reply that is still being generated. Iterating it yields the text pieces as they
+    arrive; once exhausted, `text` holds the full reply and the done callbacks have run.
+    async_pieces, if given, is an async iterator over the same reply used by `async for`
+    (asgi.py); only one of the two sources is ever consumed.
+    """
+    def __init__(self, pieces, async_pieces=None):
+        self._pieces = pieces
+        self._async_pieces = async_pieces
+        self._parts = []
+        self._done_callbacks = []
+        self.done = False
+
+    def __iter__(self):
+        for piece in self._pieces:
+            if piece:
+                self._parts.append(piece)
+                yield piece
+        self._finish()
+
+    async def __aiter__(self):
+        if self._async_pieces is None:
+            raise TypeError("This reply has no async source.")
+        async for piece in self._async_pieces:
+            if piece:
+                self._parts.append(piece)
+                yield piece
+        self._finish()
+
+    async def aread(self):
+        """Consumes the whole reply asynchronously and returns its text."""
+        async for _ in self:
+            pass
+        return self.text
+
+    def _finish(self):
+        self.done = True
+        text = self.text
+        for callback in self._done_callbacks:
+            callback(text)
+
+    @property
+    def text(self):
+        return "".join(self._parts).strip()
+
+    def add_done_callback(self, callback):
+        """Runs callback(full_text) when the stream finishes (immediately if it already has)."""
+        if self.done:
+            callback(self.text)
+        else:
+            self._done_callbacks.append(callback)
+
+def _join_reply(prefix, reply):
+    """Prepends fixed text to a reply that may be either a plain string or a ReplyStream."""
+    if isinstance(reply, ReplyStream):
+        return ReplyStream(itertools.chain([prefix], reply), _aprefixed(prefix, reply))
+    return prefix + reply
+
+async def _aprefixed(prefix, reply):
+    yield prefix
+    async for piece in reply:
+        yield piece
+
 
 # 🔁 Core Logic for AI Response Generation (MODIFIED: Added Krithika's custom replies)
-def _process_ai_logic(query: str, username: str, is_initial_load=False):
+@metrics.timed("state_machine")
+def _process_ai_logic(query: str, username: str, is_initial_load=False, stream=False):
     """
     Internal function to process query, apply activation logic, and get AI response.
     Handles the special customization flows and general chat.
     is_initial_load: A flag from the frontend indicating this is the very first request after login.
+    stream: If True, an AI-generated reply is returned as a ReplyStream that yields tokens as they arrive.
     """
     user_state = get_user_session_state(username)
     user_name_lower = username.lower()
@@ -312,15 +687,18 @@ def _process_ai_logic(query: str, username: str, is_initial_load=False):
     action_to_frontend = None
     audio_path_to_frontend = None
 
-    is_special_user = user_name_lower in SPECIAL_USERS and SPECIAL_USERS[user_name_lower]["is_special_friend"]
-    special_user_data = SPECIAL_USERS.get(user_name_lower, {})
+    # One persona version for the whole turn: passed down to the replies and the prompt, so a
+    # reload meanwhile doesn't mix two versions
+    persona = persona_store.current()
+    special_user_data = persona.special_user(user_name_lower)
+    is_special_user = special_user_data.get("is_special_friend", False)
 
     query_lower = query.lower().strip()
 
     # --- 1. Handle "Stop" Command (Globally applicable when active) ---
-    if user_state["wake_mode_active"] and ("stop" in query_lower or "நிறுத்து" in query_lower):
+    if user_state["wake_mode_active"] and _is_stop_command(query_lower):
         reset_user_conversation(username) # Resets wake_mode and history for this user
-        final_reply_content = "Aww, it was wonderful chatting with you! Goodbye for now! Come back anytime! 👋😊"
+        final_reply_content = GOODBYE_REPLY
         return final_reply_content, False, None, None # Return False for wake_mode_active
 
     # --- 2. Handle Customization Flow for Special Users (MODIFIED: Simplified) ---
@@ -331,7 +709,7 @@ def _process_ai_logic(query: str, username: str, is_initial_load=False):
             set_user_session_state(username, "wake_mode_active", True)
             final_reply_content = f"Hey {username.capitalize()}, are you really creator's friend? (Please type 'yes' or hit Enter)"
             set_user_session_state(username, "awaiting_friend_confirm", True)
-            return final_reply_content, user_state["wake_mode_active"], None, None
+            return final_reply_content, get_user_session_state(username)["wake_mode_active"], None, None
 
         # Sub-flow for awaiting friend confirmation
         if user_state["awaiting_friend_confirm"]:
@@ -341,51 +719,159 @@ def _process_ai_logic(query: str, username: str, is_initial_load=False):
                 set_user_session_state(username, "flow_completed", True) # Flow complete
             else: # User did not confirm
                 final_reply_content = f"I'm sorry, {username.capitalize()}, I need you to confirm you are creator's friend. Please say 'yes' or hit Enter to proceed."
-            return final_reply_content, user_state["wake_mode_active"], None, None # Return here to prevent further processing
+            return final_reply_content, get_user_session_state(username)["wake_mode_active"], None, None # Return here to prevent further processing
 
     # --- 3. Handle General Activation / Deactivation / Normal Chat (for all users, including special users whose flow is completed) ---
     if not user_state["wake_mode_active"]:
         # Check for general activation phrase (only if not already active or not a special user in flow)
         if "kitty" in query_lower:
             set_user_session_state(username, "wake_mode_active", True)
-            final_reply_content = "Hi there! What can I do for you? 😊"
+            final_reply_content = WAKE_REPLY
             remaining_query = query_lower.replace("kitty", "", 1).strip()
             if remaining_query: # Process command immediately if provided after wake word
                 print(f"Backend processing immediate command after 'kitty': {remaining_query}")
                 # Use the new helper for active users
-                final_reply_content += " " + _get_active_user_response(remaining_query, username, user_state)
+                final_reply_content = _join_reply(final_reply_content + " ", _get_active_user_response(remaining_query, username, user_state, stream, persona))
         else:
-            final_reply_content = "I'm just chilling here, waiting for my name, 'Kitty', to be called! Say 'Kitty' to get my attention! 😉"
+            final_reply_content = IDLE_REPLY
     else: # Kitty is active, process as normal chat
-        final_reply_content = _get_active_user_response(query, username, user_state)
+        final_reply_content = _get_active_user_response(query, username, user_state, stream, persona)
 
-    # --- Save to chat_history.txt file ---
-    with open("chat_history.txt", "a", encoding="utf-8") as f:
-        f.write(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] User ({username}): {query}\nKitty: {final_reply_content}\n\n")
+    # --- Save to the chat transcript (once a streamed reply has finished) ---
+    if isinstance(final_reply_content, ReplyStream):
+        final_reply_content.add_done_callback(lambda full_reply: _save_chat_history(username, query, full_reply))
+    else:
+        _save_chat_history(username, query, final_reply_content)
+
+    # Re-read: the state may have changed above, and shared backends hand out copies
+    return final_reply_content, get_user_session_state(username)["wake_mode_active"], action_to_frontend, audio_path_to_frontend
+
+def _turned_away(reply):
+    """True for a reply that ends with BUSY_REPLY: Groq was never asked, so there is no answer to record."""
+    return reply.endswith(BUSY_REPLY)
 
-    return final_reply_content, user_state["wake_mode_active"], action_to_frontend, audio_path_to_frontend
+def _save_chat_history(username, query, reply):
+    # Buffered and written in batches to a per-worker JSONL file (see transcript_writer.py);
+    # off the request thread, since a full batch is flushed to disk by whoever adds to it
+    if not _turned_away(reply):
+        run_in_background("transcript", transcript_writer.write, username, query, reply)
+
+def _log_turn(username, question, answer):
+    """Queues the turn for the database from the turn pool; the response doesn't wait for it. Busy replies are skipped."""
+    if not _turned_away(answer):
+        run_in_background("log_to_db", log_to_db, username, question, answer)
 
 # NEW HELPER FUNCTION: To handle responses for active users, including custom replies for special friends
-def _get_active_user_response(user_input, username, user_state):
+def _get_active_user_response(user_input, username, user_state, stream=False, persona=None):
     """
     Determines the appropriate response for an active user,
     prioritizing special user custom replies, then general custom replies, then AI.
+    persona: the version the turn started with; the current one by default.
     """
     user_name_lower = username.lower()
-    query_lower = user_input.lower()
-
-    is_special_user = user_name_lower in SPECIAL_USERS and SPECIAL_USERS[user_name_lower]["is_special_friend"]
-    special_user_data = SPECIAL_USERS.get(user_name_lower, {})
+    persona = persona or persona_store.current()
+    special_user_data = persona.special_user(user_name_lower)
+    is_special_user = special_user_data.get("is_special_friend", False)
 
     # Check for special user's custom replies IF their flow is completed
     if is_special_user and user_state["flow_completed"] and "custom_replies" in special_user_data:
-        for keyword, custom_reply in special_user_data["custom_replies"].items():
-            if keyword.lower() in query_lower:
-                return custom_reply
+        keyword = persona.text_matcher.match(user_input).phrase(user_name_lower)
+        if keyword is not None:
+            return special_user_data["custom_replies"][keyword]
 
     # Fallback to general predefined responses or AI
-    return get_general_predefined_or_ai_response(user_input, username)
-
+    return get_general_predefined_or_ai_response(user_input, username, stream, persona)
+
+
+# --- Metrics (see metrics.py): request traces, and gauges read at scrape time ---
+metrics.add_collector("kitty_sessions", "Conversation sessions in the session store.", lambda: len(session_store))
+metrics.add_collector("kitty_db_log_queue_depth", "Conversation rows waiting for the database writer.",
+                      lambda: get_logger_stats()["queued"])
+metrics.add_collector("kitty_db_log_rows_total", "Conversation rows by outcome (written, dropped, failed).",
+                      lambda: {k: v for k, v in get_logger_stats().items() if k != "queued"}, label="result", kind="counter")
+metrics.add_collector("kitty_transcript_pending", "Transcript entries buffered in memory.", transcript_writer.pending)
+metrics.add_collector("kitty_tts_jobs_pending", "edge_tts jobs on the background event loop, running or waiting.",
+                      lambda: tts_loop.pending)
+metrics.add_collector("kitty_tts_cache_lookups_total", "TTS cache lookups by outcome.",
+                      lambda: {"hits": tts_cache.hits, "misses": tts_cache.misses}, label="result", kind="counter")
+metrics.add_collector("kitty_coalesced_requests_total", "Requests that shared an identical call already in flight.",
+                      lambda: {"llm": llm.flight.coalesced if llm.flight else 0, "tts": tts_flight.coalesced},
+                      label="kind", kind="counter")
+metrics.add_collector("kitty_llm_fallbacks_total", "Groq calls answered by the fallback model.", lambda: llm.fallbacks_used, kind="counter")
+metrics.add_collector("kitty_llm_hedges_total", "Hedged duplicate Groq requests sent.", lambda: llm.hedges_sent, kind="counter")
+metrics.add_collector("kitty_llm_circuit_open", "1 while a model's circuit breaker is open or half-open.",
+                      lambda: {model: int(state != "closed") for model, state in llm.stats()["breakers"].items()}, label="model")
+metrics.add_collector("kitty_prompt_tokens_total", "Estimated prompt tokens sent to Groq, per prompt part.",
+                      lambda: {part: prompt_builder.stats()[part] for part in ("template", "summary", "history", "user")},
+                      label="part", kind="counter")
+metrics.add_collector("kitty_semantic_cache_lookups_total", "Semantic cache lookups by outcome.",
+                      lambda: None if semantic_cache is None else {k: v for k, v in semantic_cache.stats().items() if k in ("hits", "misses", "bypassed")},
+                      label="result", kind="counter")
+metrics.add_collector("kitty_persona_version", "Version of the persona file in use.", lambda: persona_store.current().version)
+metrics.add_collector("kitty_persona_reloads_total", "Times the persona file was reloaded after a change.",
+                      lambda: persona_store.reloads, kind="counter")
+metrics.add_collector("kitty_semantic_cache_entries", "Replies in the semantic cache.", lambda: None if semantic_cache is None else len(semantic_cache))
+metrics.add_collector("kitty_admission_in_flight", "Upstream calls admitted and not finished, per gate.",
+                      lambda: {gate.name: gate.stats()["in_flight"] for gate in upstream_gates}, label="gate")
+metrics.add_collector("kitty_admission_waiting", "Callers queued for an upstream gate.",
+                      lambda: {gate.name: gate.stats()["waiting"] for gate in upstream_gates}, label="gate")
+metrics.add_collector("kitty_admission_admitted_total", "Upstream calls admitted, per gate.",
+                      lambda: {gate.name: gate.stats()["admitted"] for gate in upstream_gates}, label="gate", kind="counter")
+metrics.add_collector("kitty_admission_rejected_total", "Upstream calls turned away because the gate's queue was full, per gate.",
+                      lambda: {gate.name: gate.stats()["rejected"] for gate in upstream_gates}, label="gate", kind="counter")
+metrics.add_collector("kitty_admission_timed_out_total", "Upstream calls turned away after waiting too long for a slot, per gate.",
+                      lambda: {gate.name: gate.stats()["timed_out"] for gate in upstream_gates}, label="gate", kind="counter")
+metrics.add_collector("kitty_user_rate_limited_total", "Turns answered with the slow-down reply (per-user limit).",
+                      lambda: user_limiter.limited, kind="counter")
+metrics.add_collector("kitty_startup_warm_up_seconds", "Time each finished startup warm-up took in this worker.",
+                      lambda: {name: check["seconds"] for name, check in startup.status()[1].items() if check["seconds"] is not None},
+                      label="warm_up")
+
+# Platform probes and scrapes are neither traced nor timed as requests
+UNTRACED_PATHS = ("/metrics", "/healthz", "/readyz")
+
+if metrics.enabled:
+    @app.before_request
+    def _start_request_trace():
+        if request.path not in UNTRACED_PATHS:
+            metrics.start_trace(request.url_rule.rule if request.url_rule else "unmatched")
+
+    @app.after_request
+    def _finish_request_trace(response):
+        trace = metrics.current_trace()
+        if trace is not None:
+            response.headers["X-Trace-Id"] = trace.trace_id
+            # On close, so streamed responses (SSE) are timed until their last event
+            response.call_on_close(lambda: metrics.finish_trace(trace, response.status_code))
+        return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus text format, for this worker process."""
+    if not metrics.enabled:
+        return jsonify({"success": False, "message": "Metrics are disabled."}), 404
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+def readiness_status():
+    """
+    (payload, HTTP status) for the readiness probe: 200 once every required warm-up is done, else 503.
+    Optional warm-ups that failed (e.g. the schema check with MySQL down) are listed under "degraded".
+    """
+    ready, checks = startup.status()
+    degraded = [name for name, check in checks.items() if check["state"] == "failed" and not check["required"]]
+    payload = {"ready": ready, "degraded": degraded, "uptime_seconds": round(startup.uptime(), 3), "checks": checks}
+    return payload, 200 if ready else 503
+
+@app.route('/healthz')
+def liveness():
+    """Liveness: the worker is up and serving. Touches nothing external."""
+    return jsonify({"status": "ok"})
+
+@app.route('/readyz')
+def readiness():
+    """Readiness: whether this worker has finished its startup warm-ups (see startup.py)."""
+    payload, status = readiness_status()
+    return jsonify(payload), status
 
 # --- Flask API Endpoints (remain the same) ---
 @app.route('/')
@@ -427,27 +913,24 @@ def chat_text_input():
     if not username:
         return jsonify({"success": False, "message": "Username missing."}), 400
 
+    retry_after = _turn_limit(username, user_input or "", is_initial_load)
+    if retry_after:
+        return jsonify(_busy_turn(username, SLOW_DOWN_REPLY)), 200, _retry_after_headers(retry_after)
+
     query_for_processing = user_input if not is_initial_load else ""
 
     response_text, wake_mode_status, action, audio_path = _process_ai_logic(query_for_processing, username, is_initial_load)
     
-    # --- FIX APPLIED HERE: Log to DB in the route handler ---
-    try:
-        if query_for_processing or is_initial_load:
-            log_to_db(username, query_for_processing, response_text)
-    except Exception as e:
-        print(f"Error logging to database from route handler: {e}")
+    # --- FIX APPLIED HERE: Log to DB in the route handler (in the background, alongside TTS) ---
+    if query_for_processing or is_initial_load:
+        _log_turn(username, query_for_processing, response_text)
 
-    audio_data = None
+    audio_url = None
     audio_mime_type = None
 
     if response_mode == 'voice' and wake_mode_status and response_text and \
-       response_text not in [
-           "Hey doood! I'm just chilling here, waiting for my name, 'Kitty', to be called! Say 'Kitty' to get my attention! 😉",
-           "Oops! It seems like you didn't say anything. Can you try again? 😊",
-           f"I'm sorry, {username.capitalize()}, I need you to confirm you are creator's friend. Please say 'yes' or hit Enter to proceed."
-       ]:
-        audio_data, audio_mime_type = get_tts_audio_data(response_text)
+       not _is_unspoken_text_reply(response_text, username):
+        audio_url, audio_mime_type = get_tts_audio_url(response_text)
 
     return jsonify({
         "success": True,
@@ -455,14 +938,164 @@ def chat_text_input():
         "wake_mode": wake_mode_status,
         "action": None,
         "audio_path": None,
-        "audio_data": audio_data,
+        "audio_url": audio_url,
         "audio_mime_type": audio_mime_type
     })
 
+@app.route('/api/audio/<audio_id>', methods=['GET'])
+def get_audio(audio_id):
+    """Serves a synthesized reply as binary audio. Ids are short-lived (see audio_store.py)."""
+    audio_path, mime_type = audio_store.locate(audio_id)
+    if audio_path is None:
+        return jsonify({"success": False, "message": "Audio not found or expired."}), 404
+    # send_file hands the open file to the server, which can sendfile() it without reading it into Python
+    try:
+        response = send_file(audio_path, mimetype=mime_type, max_age=300)
+    except FileNotFoundError: # Purged between locate() and here
+        return jsonify({"success": False, "message": "Audio not found or expired."}), 404
+    response.headers["Cache-Control"] = "private, max-age=300"
+    return response
+
+def _is_unspoken_text_reply(response_text, username):
+    """Replies to text requests that are shown but never read out in voice mode."""
+    return response_text in [
+        "Hey doood! I'm just chilling here, waiting for my name, 'Kitty', to be called! Say 'Kitty' to get my attention! 😉",
+        "Oops! It seems like you didn't say anything. Can you try again? 😊",
+        f"I'm sorry, {username.capitalize()}, I need you to confirm you are creator's friend. Please say 'yes' or hit Enter to proceed.",
+        SLOW_DOWN_REPLY, BUSY_REPLY, STT_BUSY_REPLY
+    ]
+
+def _is_unspoken_audio_reply(response_text, username):
+    """Replies to voice requests that are shown but never read out in voice mode."""
+    return response_text in [
+        "heyyy doood! I'm just chilling here, waiting for my name, 'Kitty', to be called! Say 'Kitty' to get my attention! 😉",
+        UNRECOGNIZED_AUDIO_REPLY,
+        "Oops! It seems like you didn't say anything. Can you try again? 😊",
+        f"I'm sorry, {username.capitalize()}, I need you to confirm you are creator's friend. Please say 'yes' or hit Enter to proceed.",
+        SLOW_DOWN_REPLY, BUSY_REPLY, STT_BUSY_REPLY
+    ]
+
+def _is_stop_command(query):
+    return "stop" in query.lower() or "நிறுத்து" in query
+
+def _turn_limit(username, query, is_initial_load=False):
+    """
+    Seconds until username may take another turn (see admission.py), 0 if it may go ahead now.
+    Control turns are never limited and don't count: the greeting after login, and "stop".
+    """
+    if is_initial_load or _is_stop_command(query):
+        return 0
+    return user_limiter.check(username)
+
+def _busy_turn(username, reply):
+    """A text-only answer for a turn that isn't admitted (see admission.py): no state machine, Groq, STT or TTS."""
+    user_state = session_store.get(username)
+    return {
+        "success": True,
+        "busy": True,
+        "response_text": reply,
+        "wake_mode": bool(user_state and user_state["wake_mode_active"]),
+        "action": None,
+        "audio_path": None,
+        "audio_url": None,
+        "audio_mime_type": None
+    }
+
+def _retry_after_headers(seconds):
+    return {"Retry-After": str(int(seconds) + 1)}
+
+def _recognize(transcribe):
+    """transcribe(), or None when the STT gate turned the call away; that turn gets STT_BUSY_REPLY."""
+    try:
+        return transcribe()
+    except Overloaded as e:
+        print(f"Voice turn turned away: {e}")
+        return None
+
+def _sse_event(event, data):
+    """Formats one server-sent event frame."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_text_stream():
+    """
+    Same request body as /api/chat/text, but the reply is sent back as server-sent events:
+    'token' events while the AI is generating, then one 'done' event with the full reply.
+    In voice mode, 'audio' events carry one synthesized sentence each, in order, starting
+    as soon as the first sentence is complete rather than after the whole reply.
+    """
+    data = request.json
+    user_input = data.get('message')
+    username = data.get('username')
+    response_mode = data.get('responseMode', 'text')
+    is_initial_load = data.get('isInitialLoad', False)
+
+    if not user_input and not is_initial_load:
+        return jsonify({"success": False, "message": "Message missing for non-initial requests."}), 400
+    if not username:
+        return jsonify({"success": False, "message": "Username missing."}), 400
+
+    retry_after = _turn_limit(username, user_input or "", is_initial_load)
+    if retry_after:
+        busy = _busy_turn(username, SLOW_DOWN_REPLY)
+        return Response(
+            _sse_event("token", {"text": SLOW_DOWN_REPLY}) + _sse_event("done", busy),
+            mimetype='text/event-stream',
+            headers={"Cache-Control": "no-cache", **_retry_after_headers(retry_after)}
+        )
+
+    query_for_processing = user_input if not is_initial_load else ""
+
+    response_text, wake_mode_status, action, audio_path = _process_ai_logic(query_for_processing, username, is_initial_load, stream=True)
+
+    speak = response_mode == 'voice' and wake_mode_status and \
+        (isinstance(response_text, ReplyStream) or not _is_unspoken_text_reply(response_text, username))
+    tts_pipeline = SentenceTTSPipeline() if speak else None
+
+    def audio_events(wait=False):
+        if tts_pipeline:
+            for seq, audio_url, audio_mime_type in tts_pipeline.ready_chunks(wait):
+                yield _sse_event("audio", {"seq": seq, "audio_url": audio_url, "audio_mime_type": audio_mime_type})
+
+    def generate():
+        if isinstance(response_text, ReplyStream):
+            for token in response_text:
+                yield _sse_event("token", {"text": token})
+                if tts_pipeline and token is not BUSY_REPLY: # A turned-away Groq call is answered in text only
+                    tts_pipeline.feed(token)
+                    yield from audio_events()
+            full_reply = response_text.text
+        else:
+            yield _sse_event("token", {"text": response_text})
+            if tts_pipeline:
+                tts_pipeline.feed(response_text)
+            full_reply = response_text
+
+        # Logged while the last sentences are still being synthesized
+        if query_for_processing or is_initial_load:
+            _log_turn(username, query_for_processing, full_reply)
+
+        if tts_pipeline:
+            tts_pipeline.finish()
+            yield from audio_events(wait=True)
+
+        yield _sse_event("done", {
+            "success": True,
+            "response_text": full_reply,
+            "wake_mode": wake_mode_status
+        })
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.route('/api/chat/audio', methods=['POST'])
 def chat_audio():
     username = request.form.get('username')
     response_mode = request.form.get('responseMode', 'voice')
+    stt_backend = request.form.get('sttBackend') # Optional: STT backend to try first
 
     if not username:
         return jsonify({"success": False, "message": "Username missing from form data."}), 401
@@ -473,47 +1106,113 @@ def chat_audio():
     audio_file = request.files['audio']
     audio_bytes = audio_file.read()
 
-    user_message_from_audio = transcribe_audio_from_bytes(audio_bytes)
-    response_text = ""
-    wake_mode_active = get_user_session_state(username)["wake_mode_active"]
+    return jsonify(_voice_turn_response(username, lambda: transcribe_audio_from_bytes(audio_bytes, stt_backend), response_mode))
 
-    if not user_message_from_audio:
-        response_text = "Oh no, I couldn't quite catch what you said. Would you mind repeating that for me? 🙏"
-        action = None
-        audio_path = None
-    else:
+def _voice_turn_response(username, transcribe, response_mode):
+    """
+    Answers a voice turn; transcribe() returns the recognized text. Shared by /api/chat/audio and /ws/voice.
+    Runs as a TurnGraph (see turn_pipeline.py): recognition and loading the session in parallel,
+    then the state machine, then speech synthesis, with logging left to finish in the background.
+    """
+    turn = TurnGraph()
+    turn.stage("stt", lambda: _recognize(transcribe))
+    turn.stage("session", lambda: get_user_session_state(username))
+
+    def reply(user_message_from_audio, user_state):
+        if user_message_from_audio is None:
+            return STT_BUSY_REPLY, user_state["wake_mode_active"]
+        if not user_message_from_audio:
+            return UNRECOGNIZED_AUDIO_REPLY, user_state["wake_mode_active"]
+        if _turn_limit(username, user_message_from_audio):
+            return SLOW_DOWN_REPLY, user_state["wake_mode_active"]
         response_text, wake_mode_active, action, audio_path = _process_ai_logic(user_message_from_audio, username)
+        return response_text, wake_mode_active
+    turn.stage("reply", reply, after=("stt", "session"))
+
+    def log(user_message_from_audio, reply):
+        if user_message_from_audio and not _turned_away(reply[0]):
+            log_to_db(username, user_message_from_audio, reply[0])
+    turn.stage("log_to_db", log, after=("stt", "reply"), background=True)
+
+    def speak(reply):
+        response_text, wake_mode_active = reply
+        if response_mode == 'voice' and wake_mode_active and response_text and \
+           not _is_unspoken_audio_reply(response_text, username):
+            return get_tts_audio_url(response_text)
+        return None, None
+    turn.stage("tts", speak, after=("reply",))
 
-    # --- FIX APPLIED HERE: Log to DB in the route handler ---
-    try:
-        if user_message_from_audio:
-            log_to_db(username, user_message_from_audio, response_text)
-    except Exception as e:
-        print(f"Error logging to database from route handler: {e}")
-
-    audio_data = None
-    audio_mime_type = None
-
-    if response_mode == 'voice' and wake_mode_active and response_text and \
-       response_text not in [
-           "heyyy doood! I'm just chilling here, waiting for my name, 'Kitty', to be called! Say 'Kitty' to get my attention! 😉",
-           "Oh no, I couldn't quite catch what you said. Would you mind repeating that for me? 🙏",
-           "Oops! It seems like you didn't say anything. Can you try again? 😊",
-           f"I'm sorry, {username.capitalize()}, I need you to confirm you are creator's friend. Please say 'yes' or hit Enter to proceed."
-       ]:
-        audio_data, audio_mime_type = get_tts_audio_data(response_text)
+    user_message_from_audio = turn.result("stt")
+    response_text, wake_mode_active = turn.result("reply")
+    audio_url, audio_mime_type = turn.result("tts")
 
-    return jsonify({
+    return {
         "success": True,
         "user_message_recognized": user_message_from_audio,
         "response_text": response_text,
         "wake_mode": wake_mode_active,
         "action": None,
         "audio_path": None,
-        "audio_data": audio_data,
+        "audio_url": audio_url,
         "audio_mime_type": audio_mime_type
-    })
+    }
 
+# Live voice input: the browser streams MediaRecorder chunks while the user talks.
+#   client -> {"type": "start", "username": ..., "responseMode": ..., "sttBackend": ...}
+#   client -> binary audio chunks, then optionally {"type": "stop"}
+#   server -> {"type": "partial", "text": ...} while recognizing (incremental STT backends)
+#   server -> {"type": "endpoint", "reason": ...} once the user stops talking
+#   server -> {"type": "final", ...same fields as /api/chat/audio...}, then closes
+# Each connection holds a worker thread while open: run gunicorn with --threads (or use asgi.py).
+@sock.route('/ws/voice')
+def voice_stream_socket(ws):
+    start = parse_control_message(ws.receive(timeout=10))
+    username = start.get('username')
+    if not username:
+        ws.send(json.dumps({"type": "error", "success": False, "message": "Username missing from start message."}))
+        return
+
+    session = VoiceStreamSession(start.get('sttBackend'))
+
+    def send_events():
+        while not session.events.empty():
+            ws.send(json.dumps(session.events.get_nowait()))
+
+    try:
+        while not session.check_deadline(): # A client that goes quiet is answered with what was heard
+            message = ws.receive(timeout=0.05)
+            if isinstance(message, (bytes, bytearray)):
+                session.feed(message)
+            elif message is not None and parse_control_message(message).get("type") == "stop":
+                break
+            send_events()
+    except ConnectionClosed:
+        session.cancel()
+        return
+
+    final = _voice_turn_response(username, session.finish, start.get('responseMode', 'voice'))
+    send_events() # Anything recognized while finishing, ahead of the reply
+    ws.send(json.dumps({"type": "final", **final}))
+
+
+# Fill the TTS cache in the background; entries already on disk (e.g. from another worker) are not re-synthesized
+if os.getenv("TTS_CACHE_PREWARM", "1") == "1":
+    threading.Thread(target=prewarm_tts_cache, name="tts-prewarm", daemon=True).start()
+
+    def _prewarm_reloaded_persona(persona):
+        # New or edited replies in a reloaded persona get synthesized too; unchanged ones are cache hits
+        if persona_store.reloads:
+            threading.Thread(target=prewarm_tts_cache, args=(persona,), name="tts-prewarm", daemon=True).start()
+    persona_store.on_reload(_prewarm_reloaded_persona)
+
+# --- Startup warm-ups (see startup.py): heavy imports and one-time checks, off the import path ---
+startup.warm_up("persona", persona_store.current)
+startup.warm_up("llm_client", lambda: (client.get(), async_client.get())) # Imports openai and httpx
+startup.preload("tts", "edge_tts")
+# speech_recognition, and local STT models if any are configured, before the first voice turn needs them
+startup.warm_up("stt", stt_engines.warm_up_engines)
+startup.preload("audio_decode", "av", required=False) # Only compressed uploads need PyAV
+startup.warm_up("db_schema", ensure_schema, required=False) # Logging is best-effort; don't hold traffic for it
 
 if __name__ == '__main__':
     if not os.path.exists('config'):
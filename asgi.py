@@ -0,0 +1,344 @@
+"""
+Async serving mode for Kitty.
+
+Serves the same API as app.py, with async handlers, so a request waiting on Groq,
+edge_tts or speech recognition doesn't pin a worker. One process can then hold
+hundreds of in-flight conversations. Run it with:
+
+    hypercorn asgi:app --bind 0.0.0.0:$PORT
+
+The Flask app in app.py (gunicorn app:app) keeps working for simple deployments;
+both share the state machine, session store, caches and logging from app.py. Those are
+synchronous (SQLite/Redis sessions, disk caches), so handlers call them through
+asyncio.to_thread and the event loop never waits on disk or a database.
+"""
+import asyncio
+import json
+
+from quart import Quart, request, jsonify, Response, send_file, websocket
+from quart.wrappers.response import IterableBody
+from quart_cors import cors
+
+from app import (
+    ReplyStream, SentenceTTSPipeline, UNRECOGNIZED_AUDIO_REPLY, SLOW_DOWN_REPLY, BUSY_REPLY, STT_BUSY_REPLY,
+    _busy_turn, _turn_limit, _retry_after_headers, _recognize, _process_ai_logic, _is_unspoken_text_reply, _is_unspoken_audio_reply, _sse_event,
+    get_tts_audio_url_async, get_user_session_state, reset_user_conversation,
+    transcribe_audio_from_bytes, _log_turn, audio_store, metrics, readiness_status, UNTRACED_PATHS
+)
+from voice_stream import VoiceStreamSession, parse_control_message
+
+DEADLINE_POLL_SECONDS = 0.5 # How often /ws/voice checks whether the client has gone quiet
+
+app = Quart(__name__, static_folder='frontend', static_url_path='')
+app = cors(app, allow_origin="*")
+
+
+async def _resolve_reply(response_text):
+    """Waits for an AI reply produced by the async Groq client; plain strings pass through."""
+    if isinstance(response_text, ReplyStream):
+        return await response_text.aread()
+    return response_text
+
+
+if metrics.enabled:
+    @app.before_request
+    async def _start_request_trace():
+        if request.path not in UNTRACED_PATHS:
+            metrics.start_trace(request.url_rule.rule if request.url_rule else "unmatched")
+
+    @app.after_request
+    async def _finish_request_trace(response):
+        trace = metrics.current_trace()
+        if trace is not None:
+            response.headers["X-Trace-Id"] = trace.trace_id
+            if isinstance(response.response, IterableBody):
+                # Streamed: timed until the body has been sent (or the client went away)
+                response.response.iter = _finish_trace_after(response.response.iter, trace, response.status_code)
+            else:
+                metrics.finish_trace(trace, response.status_code)
+        return response
+
+async def _finish_trace_after(body, trace, status):
+    try:
+        async for chunk in body:
+            yield chunk
+    finally:
+        if hasattr(body, "aclose"):
+            await body.aclose()
+        metrics.finish_trace(trace, status)
+
+@app.route('/metrics')
+async def metrics_endpoint():
+    if not metrics.enabled:
+        return jsonify({"success": False, "message": "Metrics are disabled."}), 404
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route('/healthz')
+async def liveness():
+    return jsonify({"status": "ok"})
+
+@app.route('/readyz')
+async def readiness():
+    payload, status = readiness_status()
+    return jsonify(payload), status
+
+
+@app.route('/')
+async def serve_index():
+    return await send_file('frontend/index.html')
+
+@app.route('/api/login', methods=['POST'])
+async def login():
+    data = await request.get_json()
+    name = data.get('name')
+
+    if name and name.strip():
+        username = name.strip().lower() # Store username in lowercase for consistency
+        await asyncio.to_thread(reset_user_conversation, username) # Ensure a clean slate on login
+        return jsonify({"success": True, "username": username, "message": "Logged in with name."})
+    return jsonify({"success": False, "message": "Name missing. Please provide a name."}), 400
+
+@app.route('/api/reset', methods=['POST'])
+async def reset_conversation():
+    data = await request.get_json()
+    username = data.get('username')
+    if not username:
+        return jsonify({"success": False, "message": "Username missing."}), 400
+
+    await asyncio.to_thread(reset_user_conversation, username)
+    return jsonify({"success": True, "message": "Conversation reset."})
+
+@app.route('/api/chat/text', methods=['POST'])
+async def chat_text_input():
+    data = await request.get_json()
+    user_input = data.get('message')
+    username = data.get('username')
+    response_mode = data.get('responseMode', 'text')
+    is_initial_load = data.get('isInitialLoad', False)
+
+    if not user_input and not is_initial_load:
+        return jsonify({"success": False, "message": "Message missing for non-initial requests."}), 400
+    if not username:
+        return jsonify({"success": False, "message": "Username missing."}), 400
+
+    retry_after = _turn_limit(username, user_input or "", is_initial_load)
+    if retry_after:
+        return jsonify(await asyncio.to_thread(_busy_turn, username, SLOW_DOWN_REPLY)), 200, _retry_after_headers(retry_after)
+
+    query_for_processing = user_input if not is_initial_load else ""
+
+    # stream=True makes an AI reply come back unevaluated, so it can be awaited with the async client
+    response_text, wake_mode_status, action, audio_path = await asyncio.to_thread(
+        _process_ai_logic, query_for_processing, username, is_initial_load, stream=True
+    )
+    response_text = await _resolve_reply(response_text)
+
+    if query_for_processing or is_initial_load:
+        _log_turn(username, query_for_processing, response_text)
+
+    audio_url = None
+    audio_mime_type = None
+
+    if response_mode == 'voice' and wake_mode_status and response_text and \
+       not _is_unspoken_text_reply(response_text, username):
+        audio_url, audio_mime_type = await get_tts_audio_url_async(response_text)
+
+    return jsonify({
+        "success": True,
+        "response_text": response_text,
+        "wake_mode": wake_mode_status,
+        "action": None,
+        "audio_path": None,
+        "audio_url": audio_url,
+        "audio_mime_type": audio_mime_type
+    })
+
+@app.route('/api/audio/<audio_id>', methods=['GET'])
+async def get_audio(audio_id):
+    audio_path, mime_type = await asyncio.to_thread(audio_store.locate, audio_id)
+    if audio_path is None:
+        return jsonify({"success": False, "message": "Audio not found or expired."}), 404
+    try:
+        response = await send_file(audio_path, mimetype=mime_type)
+    except FileNotFoundError: # Purged between locate() and here
+        return jsonify({"success": False, "message": "Audio not found or expired."}), 404
+    response.headers["Cache-Control"] = "private, max-age=300"
+    return response
+
+@app.route('/api/chat/stream', methods=['POST'])
+async def chat_text_stream():
+    data = await request.get_json()
+    user_input = data.get('message')
+    username = data.get('username')
+    response_mode = data.get('responseMode', 'text')
+    is_initial_load = data.get('isInitialLoad', False)
+
+    if not user_input and not is_initial_load:
+        return jsonify({"success": False, "message": "Message missing for non-initial requests."}), 400
+    if not username:
+        return jsonify({"success": False, "message": "Username missing."}), 400
+
+    retry_after = _turn_limit(username, user_input or "", is_initial_load)
+    if retry_after:
+        busy = await asyncio.to_thread(_busy_turn, username, SLOW_DOWN_REPLY) # Reads the session store
+        return Response(
+            _sse_event("token", {"text": SLOW_DOWN_REPLY}) + _sse_event("done", busy),
+            mimetype='text/event-stream',
+            headers={"Cache-Control": "no-cache", **_retry_after_headers(retry_after)}
+        )
+
+    query_for_processing = user_input if not is_initial_load else ""
+
+    response_text, wake_mode_status, action, audio_path = await asyncio.to_thread(
+        _process_ai_logic, query_for_processing, username, is_initial_load, stream=True
+    )
+
+    speak = response_mode == 'voice' and wake_mode_status and \
+        (isinstance(response_text, ReplyStream) or not _is_unspoken_text_reply(response_text, username))
+    tts_pipeline = SentenceTTSPipeline(
+        submit=lambda sentence, lang: asyncio.ensure_future(get_tts_audio_url_async(sentence, lang))
+    ) if speak else None
+
+    async def audio_events(wait=False):
+        if tts_pipeline:
+            async for seq, audio_url, audio_mime_type in tts_pipeline.aready_chunks(wait):
+                yield _sse_event("audio", {"seq": seq, "audio_url": audio_url, "audio_mime_type": audio_mime_type})
+
+    async def generate():
+        if isinstance(response_text, ReplyStream):
+            async for token in response_text:
+                yield _sse_event("token", {"text": token})
+                if tts_pipeline and token is not BUSY_REPLY: # A turned-away Groq call is answered in text only
+                    tts_pipeline.feed(token)
+                    async for event in audio_events():
+                        yield event
+            full_reply = response_text.text
+        else:
+            yield _sse_event("token", {"text": response_text})
+            if tts_pipeline:
+                tts_pipeline.feed(response_text)
+            full_reply = response_text
+
+        if query_for_processing or is_initial_load:
+            _log_turn(username, query_for_processing, full_reply)
+
+        if tts_pipeline:
+            tts_pipeline.finish()
+            async for event in audio_events(wait=True):
+                yield event
+
+        yield _sse_event("done", {
+            "success": True,
+            "response_text": full_reply,
+            "wake_mode": wake_mode_status
+        })
+
+    return Response(
+        generate(),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.route('/api/chat/audio', methods=['POST'])
+async def chat_audio():
+    form = await request.form
+    files = await request.files
+    username = form.get('username')
+    response_mode = form.get('responseMode', 'voice')
+    stt_backend = form.get('sttBackend')
+
+    if not username:
+        return jsonify({"success": False, "message": "Username missing from form data."}), 401
+
+    if 'audio' not in files:
+        return jsonify({"success": False, "message": "No audio file provided."}), 400
+
+    audio_bytes = files['audio'].read()
+
+    # STT engines are blocking (network or CPU-bound), so they run on the default thread pool instead of the event loop
+    user_message_from_audio = await asyncio.to_thread(_recognize, lambda: transcribe_audio_from_bytes(audio_bytes, stt_backend))
+    return jsonify(await _voice_turn_response(username, user_message_from_audio, response_mode))
+
+async def _voice_turn_response(username, user_message_from_audio, response_mode):
+    """Answers a transcribed voice turn; shared by /api/chat/audio and /ws/voice."""
+    wake_mode_active = (await asyncio.to_thread(get_user_session_state, username))["wake_mode_active"]
+
+    if user_message_from_audio is None: # STT turned the call away
+        response_text = STT_BUSY_REPLY
+    elif not user_message_from_audio:
+        response_text = UNRECOGNIZED_AUDIO_REPLY
+    elif _turn_limit(username, user_message_from_audio):
+        response_text = SLOW_DOWN_REPLY
+    else:
+        response_text, wake_mode_active, action, audio_path = await asyncio.to_thread(
+            _process_ai_logic, user_message_from_audio, username, stream=True
+        )
+        response_text = await _resolve_reply(response_text)
+        _log_turn(username, user_message_from_audio, response_text)
+
+    audio_url = None
+    audio_mime_type = None
+
+    if response_mode == 'voice' and wake_mode_active and response_text and \
+       not _is_unspoken_audio_reply(response_text, username):
+        audio_url, audio_mime_type = await get_tts_audio_url_async(response_text)
+
+    return {
+        "success": True,
+        "user_message_recognized": user_message_from_audio,
+        "response_text": response_text,
+        "wake_mode": wake_mode_active,
+        "action": None,
+        "audio_path": None,
+        "audio_url": audio_url,
+        "audio_mime_type": audio_mime_type
+    }
+
+@app.websocket('/ws/voice')
+async def voice_stream_socket():
+    """Live voice input; same protocol as /ws/voice in app.py."""
+    try:
+        start = parse_control_message(await asyncio.wait_for(websocket.receive(), 10))
+    except asyncio.TimeoutError:
+        return
+    username = start.get('username')
+    if not username:
+        await websocket.send(json.dumps({"type": "error", "success": False, "message": "Username missing from start message."}))
+        return
+
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    # The decoder thread hands partials and the endpoint over to the event loop
+    session = VoiceStreamSession(start.get('sttBackend'), on_event=lambda event: loop.call_soon_threadsafe(events.put_nowait, event))
+
+    async def receive_audio():
+        while True:
+            message = await websocket.receive()
+            if isinstance(message, bytes):
+                session.feed(message)
+            elif parse_control_message(message).get("type") == "stop":
+                events.put_nowait({"type": "stop"})
+                return
+
+    receiver = asyncio.ensure_future(receive_audio())
+    try:
+        while True:
+            try:
+                event = await asyncio.wait_for(events.get(), DEADLINE_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                session.check_deadline() # Queues an endpoint event once the client has gone quiet
+                continue
+            if event["type"] == "stop":
+                break
+            await websocket.send(json.dumps(event))
+            if event["type"] == "endpoint":
+                break
+    except asyncio.CancelledError: # Client went away
+        session.cancel()
+        raise
+    finally:
+        receiver.cancel()
+
+    user_message_from_audio = await asyncio.to_thread(_recognize, session.finish)
+
+    await websocket.send(json.dumps({"type": "final", **await _voice_turn_response(username, user_message_from_audio, start.get('responseMode', 'voice'))}))
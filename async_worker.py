@@ -0,0 +1,88 @@
+import asyncio
+import atexit
+import os
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+# One long-lived asyncio event loop per process, running in a daemon thread.
+# Synchronous Flask handlers submit coroutines to it and get concurrent.futures.Future
+# objects back, instead of paying for a fresh loop with asyncio.run() on every request.
+
+
+class BackgroundEventLoop:
+    """A persistent event loop in a background thread with a cap on concurrently running jobs."""
+
+    def __init__(self, name, max_concurrency):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self._loop = None
+        self._thread = None
+        self._semaphore = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.pending = 0 # Jobs submitted and not finished yet, running or waiting for the semaphore
+
+    def _ensure_started(self):
+        # Started lazily, and restarted after a fork (gunicorn --preload) since threads don't survive it
+        if self._loop is not None and self._pid == os.getpid():
+            return self._loop
+        with self._lock:
+            if self._loop is not None and self._pid == os.getpid():
+                return self._loop
+            loop = asyncio.new_event_loop()
+            started = threading.Event()
+
+            def run():
+                asyncio.set_event_loop(loop)
+                self._semaphore = asyncio.Semaphore(self.max_concurrency)
+                started.set()
+                loop.run_forever()
+
+            self._thread = threading.Thread(target=run, name=self.name, daemon=True)
+            self._thread.start()
+            started.wait()
+            self._loop = loop
+            self._pid = os.getpid()
+            return loop
+
+    async def _limited(self, coro):
+        async with self._semaphore:
+            return await coro
+
+    def submit(self, coro):
+        """Schedules coro on the loop and returns a concurrent.futures.Future for its result."""
+        loop = self._ensure_started()
+        future = asyncio.run_coroutine_threadsafe(self._limited(coro), loop)
+        with self._lock:
+            self.pending += 1
+        future.add_done_callback(self._job_done)
+        return future
+
+    def _job_done(self, future):
+        with self._lock:
+            self.pending -= 1
+
+    def run(self, coro, timeout=None):
+        """Runs coro on the loop and blocks until it finishes; cancels it if timeout expires."""
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise
+
+    def stop(self, timeout=5):
+        """Stops the loop and waits up to timeout seconds for its thread. Registered with atexit."""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            running_here = loop is not None and self._pid == os.getpid()
+            self._loop = None
+        if running_here:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join(timeout)
+
+
+TTS_MAX_CONCURRENCY = int(os.getenv("TTS_MAX_CONCURRENCY", "8"))
+
+tts_loop = BackgroundEventLoop("tts-event-loop", TTS_MAX_CONCURRENCY)
+atexit.register(tts_loop.stop)
@@ -0,0 +1,60 @@
+import io
+
+from metrics import metrics
+
+# In-memory decoding of uploaded voice clips into 16 kHz mono 16-bit PCM for the STT engines.
+#
+# Browsers record with MediaRecorder as webm/opus (Chrome, Firefox), ogg/opus or mp4/aac (Safari),
+# none of which sr.AudioFile understands. Those go through PyAV (FFmpeg bindings), entirely in
+# memory: no temp files and no ffmpeg subprocess. WAV/AIFF/FLAC uploads keep using sr.AudioFile.
+
+STT_SAMPLE_RATE = 16000
+STT_SAMPLE_WIDTH = 2 # bytes per sample (s16)
+
+
+class AudioDecodeError(Exception):
+    """The uploaded audio could not be decoded."""
+
+
+def _is_sr_native(audio_bytes):
+    head = audio_bytes[:12]
+    return (head[:4] == b"RIFF" and head[8:12] == b"WAVE") or \
+        (head[:4] == b"FORM" and head[8:12] in (b"AIFF", b"AIFC")) or \
+        head[:4] == b"fLaC"
+
+
+def decode_to_pcm(audio_bytes, sample_rate=STT_SAMPLE_RATE):
+    """
+    Decodes any container/codec FFmpeg supports (webm/opus, ogg/opus, mp4/aac, ...) to mono s16
+    PCM at sample_rate. Returns the raw little-endian PCM bytes.
+    """
+    try:
+        import av
+    except ImportError as e:
+        raise AudioDecodeError("The 'av' package is required to decode compressed audio uploads.") from e
+
+    resampler = av.AudioResampler(format="s16", layout="mono", rate=sample_rate)
+    pcm = bytearray()
+    try:
+        with av.open(io.BytesIO(audio_bytes), mode="r") as container:
+            if not container.streams.audio:
+                raise AudioDecodeError("The upload contains no audio stream.")
+            for frame in container.decode(audio=0):
+                for out in resampler.resample(frame):
+                    # Planes can be padded past the last sample; only copy the real samples
+                    pcm += memoryview(out.planes[0])[:out.samples * STT_SAMPLE_WIDTH]
+        for out in resampler.resample(None): # Flush samples still held by the resampler
+            pcm += memoryview(out.planes[0])[:out.samples * STT_SAMPLE_WIDTH]
+    except av.error.FFmpegError as e:
+        raise AudioDecodeError(f"Could not decode audio: {e}") from e
+    return bytes(pcm)
+
+
+@metrics.timed("audio_decode")
+def audio_data_from_bytes(audio_bytes):
+    """Turns an uploaded clip into an sr.AudioData that every STT engine can consume."""
+    import speech_recognition as sr
+    if _is_sr_native(audio_bytes):
+        with sr.AudioFile(io.BytesIO(audio_bytes)) as source:
+            return sr.Recognizer().record(source)
+    return sr.AudioData(decode_to_pcm(audio_bytes), STT_SAMPLE_RATE, STT_SAMPLE_WIDTH)
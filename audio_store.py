@@ -0,0 +1,83 @@
+import os
+import re
+import secrets
+import tempfile
+import threading
+import time
+
+# Synthesized replies are kept here for a short while so the browser can fetch them as plain
+# binary (audio/mpeg) from /api/audio/<id> instead of receiving them base64-encoded in JSON.
+# Files live in a directory shared by all gunicorn workers on the machine, so the follow-up
+# GET can land on a different worker than the one that synthesized the audio.
+
+AUDIO_STORE_DIR = os.getenv("AUDIO_STORE_DIR", os.path.join(tempfile.gettempdir(), "kitty_audio"))
+AUDIO_STORE_TTL_SECONDS = int(os.getenv("AUDIO_STORE_TTL_SECONDS", "300"))
+
+_EXTENSIONS = {"audio/mpeg": ".mp3"}
+_MIME_TYPES = {ext: mime for mime, ext in _EXTENSIONS.items()}
+_AUDIO_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{16,64}$')
+
+
+class AudioStore:
+    """Short-lived, id-addressed storage for synthesized audio clips."""
+
+    def __init__(self, directory=AUDIO_STORE_DIR, ttl_seconds=AUDIO_STORE_TTL_SECONDS):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self._last_purge = 0.0
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, audio_id, mime_type):
+        return os.path.join(self.directory, audio_id + _EXTENSIONS.get(mime_type, ".bin"))
+
+    def save(self, audio, mime_type="audio/mpeg"):
+        """
+        Stores one clip and returns the id it can be fetched with.
+        audio is either bytes or an iterable of byte chunks; chunks are written out one by one
+        and never joined into a single buffer.
+        """
+        if isinstance(audio, (bytes, bytearray, memoryview)):
+            audio = (audio,)
+        audio_id = secrets.token_urlsafe(18)
+        path = self._path(audio_id, mime_type)
+        tmp_path = path + ".part"
+        with open(tmp_path, "wb") as f:
+            f.writelines(audio)
+        os.replace(tmp_path, path) # Other workers never see a half-written clip
+        self._purge_expired()
+        return audio_id
+
+    def locate(self, audio_id):
+        """Returns (file_path, mime_type) for a stored clip, or (None, None) if unknown or expired."""
+        if not _AUDIO_ID_PATTERN.match(audio_id):
+            return None, None
+        for ext, mime_type in _MIME_TYPES.items():
+            path = os.path.join(self.directory, audio_id + ext)
+            try:
+                if time.time() - os.path.getmtime(path) > self.ttl_seconds:
+                    return None, None
+                return path, mime_type
+            except FileNotFoundError:
+                continue
+        return None, None
+
+    def _purge_expired(self):
+        """Deletes expired clips, at most once every ttl/4 seconds per process."""
+        now = time.time()
+        with self._lock:
+            if now - self._last_purge < self.ttl_seconds / 4:
+                return
+            self._last_purge = now
+        try:
+            for entry in os.scandir(self.directory):
+                try:
+                    if now - entry.stat().st_mtime > self.ttl_seconds:
+                        os.remove(entry.path)
+                except FileNotFoundError:
+                    pass # Another worker purged it first
+        except OSError as e:
+            print(f"❌ Audio store purge error: {e}")
+
+
+audio_store = AudioStore()
@@ -0,0 +1,77 @@
+"""
+Benchmark for decoding voice uploads to 16 kHz mono PCM (audio_decode.py).
+
+Builds clips the way the browser sends them (webm/opus and ogg/opus, 48 kHz) in memory,
+then reports the decode + resample cost per second of audio, next to the upload size
+of the same clip as 16-bit WAV.
+
+Needs PyAV (pip install av). Run from the repo root:
+    python benchmarks/bench_audio_decode.py
+"""
+import io
+import math
+import os
+import sys
+import time
+from array import array
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import av
+
+from audio_decode import decode_to_pcm
+
+SOURCE_RATE = 48000
+CLIP_SECONDS = [2, 5, 15]
+ROUNDS = 5
+
+
+def synth_speechlike(seconds):
+    """A wobbling tone with gaps: cheap stand-in for speech with pauses, s16 mono at 48 kHz."""
+    samples = array("h")
+    for i in range(seconds * SOURCE_RATE):
+        t = i / SOURCE_RATE
+        envelope = 0.0 if (t % 1.0) > 0.8 else 0.6
+        freq = 180 + 40 * math.sin(2 * math.pi * 3 * t)
+        samples.append(int(envelope * 32767 * math.sin(2 * math.pi * freq * t)))
+    return samples
+
+
+def encode(samples, container_format, codec):
+    out = io.BytesIO()
+    with av.open(out, mode="w", format=container_format) as container:
+        stream = container.add_stream(codec, rate=SOURCE_RATE)
+        stream.layout = "mono"
+        frame_size = 960 # 20 ms at 48 kHz, what MediaRecorder's opus encoder uses
+        for start in range(0, len(samples), frame_size):
+            chunk = samples[start:start + frame_size]
+            frame = av.AudioFrame(format="s16", layout="mono", samples=len(chunk))
+            frame.planes[0].update(chunk.tobytes())
+            frame.sample_rate = SOURCE_RATE
+            frame.pts = start
+            for packet in stream.encode(frame):
+                container.mux(packet)
+        for packet in stream.encode(None):
+            container.mux(packet)
+    return out.getvalue()
+
+
+def main():
+    print(f"{'clip':<16}{'upload (KiB)':>14}{'as WAV (KiB)':>14}{'decode (ms)':>14}{'ms per audio s':>16}")
+    for seconds in CLIP_SECONDS:
+        samples = synth_speechlike(seconds)
+        wav_kib = (44 + seconds * 16000 * 2) / 1024 # 16 kHz mono s16, the smallest useful WAV
+        for label, container_format in [("webm/opus", "webm"), ("ogg/opus", "ogg")]:
+            clip = encode(samples, container_format, "libopus")
+            best = float("inf")
+            for _ in range(ROUNDS):
+                start = time.perf_counter()
+                pcm = decode_to_pcm(clip)
+                best = min(best, time.perf_counter() - start)
+            assert abs(len(pcm) / 2 / 16000 - seconds) < 0.2, "decoded length does not match the clip"
+            print(f"{label + f' {seconds}s':<16}{len(clip) / 1024:>14.1f}{wav_kib:>14.1f}"
+                  f"{best * 1000:>14.2f}{best * 1000 / seconds:>16.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,349 @@
+"""
+Offline load test for the Flask app, with local stand-ins for every external service
+(see fake_services.py: Groq, edge_tts, Google STT and MySQL; latencies are configurable).
+
+Serves app.py on a local port with a threaded WSGI server. Simulated users log in, wake Kitty,
+then replay user messages from chat_history.txt as a mix of turns:
+    text    POST /api/chat/text, text reply
+    stream  POST /api/chat/stream in voice mode (SSE tokens plus per-sentence audio), then
+            fetches each audio clip
+    voice   POST /api/chat/audio with a WAV clip that the fake STT transcribes back to the
+            message, then fetches the reply audio
+The fake Groq server answers with Kitty's recorded reply to the same message where there is one.
+
+Turns answered with a busy reply (admission control, see admission.py) or Groq's error reply
+are reported separately as busy and ai_error. Simulated users don't pause between turns, so the
+per-user rate limit is off unless USER_RATE_PER_SECOND is set.
+
+Reports throughput, latency percentiles per turn type, the server-side stage breakdown
+(metrics.py), upstream call counts and memory per session. No network access needed.
+
+Run from the repo root:
+    python benchmarks/bench_load.py
+    python benchmarks/bench_load.py --sessions 100 --concurrency 32 --mix text=1,stream=1,voice=2 --json load.json
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import httpx
+
+import fake_services
+
+USER_LINE = re.compile(r"^(?:You|\[[^\]]*\] User \([^)]*\)):\s*(.*)$")
+KITTY_LINE = re.compile(r"^(?:Kitty|\[[^\]]*\] Kitty):\s*(.*)$")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sessions", type=int, default=24, help="simulated users")
+    parser.add_argument("--concurrency", type=int, default=8, help="users talking at the same time")
+    parser.add_argument("--turns", type=int, default=8, help="messages per user after waking Kitty")
+    parser.add_argument("--mix", default="text=2,stream=1,voice=1", help="relative weights of text, stream and voice turns")
+    parser.add_argument("--groq-first-token-ms", type=float, default=300)
+    parser.add_argument("--groq-token-ms", type=float, default=20, help="delay between streamed chunks")
+    parser.add_argument("--groq-chunk-tokens", type=int, default=3, help="words per streamed chunk")
+    parser.add_argument("--groq-max-concurrent", type=int, default=0,
+                        help="requests the fake Groq answers at once before returning 429 (0 = no limit)")
+    parser.add_argument("--tts-ms", type=float, default=400, help="edge_tts synthesis time per sentence or reply")
+    parser.add_argument("--tts-chunks", type=int, default=8, help="audio chunks per synthesis")
+    parser.add_argument("--stt-ms", type=float, default=600, help="Google STT time per clip")
+    parser.add_argument("--db-ms", type=float, default=15, help="MySQL time per batch insert")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the app's own output while it runs")
+    return parser.parse_args()
+
+
+def load_history(path=os.path.join(ROOT, "chat_history.txt")):
+    """User messages in order, and Kitty's recorded reply to each (lowercased message -> reply)."""
+    messages, replies = [], {}
+    last_message = None
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            user = USER_LINE.match(line)
+            if user and user.group(1).strip():
+                last_message = user.group(1).strip()
+                messages.append(last_message)
+                continue
+            kitty = KITTY_LINE.match(line)
+            if kitty and last_message is not None:
+                replies.setdefault(last_message.lower(), kitty.group(1).strip())
+                last_message = None
+    return messages, replies
+
+
+def parse_mix(text):
+    weights = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        weights[kind.strip()] = float(weight or 1)
+    unknown = set(weights) - {"text", "stream", "voice"}
+    if unknown:
+        raise SystemExit(f"Unknown turn types in --mix: {', '.join(sorted(unknown))}")
+    return weights
+
+
+def rss_bytes():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+# Fixed replies that mean the turn wasn't really answered, and the kind they are counted as:
+# "busy" (admission control turned it away, see admission.py) or "ai_error" (Groq failed). Set once app is imported.
+UNANSWERED_REPLIES = {}
+
+
+def turn_kind(data, kind):
+    if data.get("busy"):
+        return "busy"
+    return UNANSWERED_REPLIES.get(data.get("response_text"), kind)
+
+
+class Results:
+    def __init__(self):
+        self.latencies = {} # kind -> [seconds]
+        self.errors = {}
+        self.error_samples = []
+        self._lock = threading.Lock()
+
+    def add(self, kind, seconds):
+        with self._lock:
+            self.latencies.setdefault(kind, []).append(seconds)
+
+    def error(self, kind, message):
+        with self._lock:
+            self.errors[kind] = self.errors.get(kind, 0) + 1
+            if self.errors[kind] <= 3:
+                self.error_samples.append(f"{kind}: {message}")
+
+
+# --- One simulated user ---
+def fetch_audio(http, audio_url, results):
+    started_at = time.perf_counter()
+    response = http.get(audio_url)
+    if response.status_code == 200 and response.content:
+        results.add("audio_fetch", time.perf_counter() - started_at)
+    else:
+        results.error("audio_fetch", f"HTTP {response.status_code} for {audio_url}")
+
+
+def text_turn(http, username, message, results):
+    started_at = time.perf_counter()
+    response = http.post("/api/chat/text", json={"username": username, "message": message, "responseMode": "text"})
+    if response.status_code != 200 or not response.json().get("success"):
+        return results.error("text", f"HTTP {response.status_code}")
+    results.add(turn_kind(response.json(), "text"), time.perf_counter() - started_at)
+
+
+def stream_turn(http, username, message, results):
+    started_at = time.perf_counter()
+    audio_urls, event, first_token_seen, done, kind = [], None, False, False, "stream"
+    body = {"username": username, "message": message, "responseMode": "voice"}
+    with http.stream("POST", "/api/chat/stream", json=body) as response:
+        if response.status_code != 200:
+            return results.error("stream", f"HTTP {response.status_code}")
+        for line in response.iter_lines():
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                if event == "token" and not first_token_seen:
+                    first_token_seen = True
+                    results.add("stream_first_token", time.perf_counter() - started_at)
+                elif event == "audio":
+                    if not audio_urls:
+                        results.add("stream_first_audio", time.perf_counter() - started_at)
+                    audio_urls.append(json.loads(line[len("data: "):])["audio_url"])
+                elif event == "done":
+                    done = True
+                    kind = turn_kind(json.loads(line[len("data: "):]), "stream")
+    if not done:
+        return results.error("stream", "no done event")
+    results.add(kind, time.perf_counter() - started_at)
+    for audio_url in audio_urls:
+        fetch_audio(http, audio_url, results)
+
+
+def voice_turn(http, username, message, clip, results):
+    started_at = time.perf_counter()
+    response = http.post(
+        "/api/chat/audio",
+        data={"username": username, "responseMode": "voice"},
+        files={"audio": ("clip.wav", clip, "audio/wav")}
+    )
+    if response.status_code != 200:
+        return results.error("voice", f"HTTP {response.status_code}")
+    data = response.json()
+    kind = turn_kind(data, "voice")
+    if kind != "voice":
+        return results.add(kind, time.perf_counter() - started_at)
+    if data.get("user_message_recognized") != message:
+        return results.error("voice", f"recognized {data.get('user_message_recognized')!r} instead of {message!r}")
+    results.add("voice", time.perf_counter() - started_at)
+    if data.get("audio_url"):
+        fetch_audio(http, data["audio_url"], results)
+
+
+def run_session(base_url, username, messages, kinds, stt, results):
+    with httpx.Client(base_url=base_url, timeout=60) as http:
+        http.post("/api/login", json={"name": username})
+        text_turn(http, username, "kitty", results) # Wake Kitty; counted as a text turn
+        for message, kind in zip(messages, kinds):
+            try:
+                if kind == "text":
+                    text_turn(http, username, message, results)
+                elif kind == "stream":
+                    stream_turn(http, username, message, results)
+                else:
+                    voice_turn(http, username, message, stt.clip_for(message), results)
+            except httpx.HTTPError as e:
+                results.error(kind, repr(e))
+
+
+# --- Report ---
+def print_report(results, elapsed, sessions, memory, upstream, stages):
+    turns = sum(len(results.latencies.get(kind, [])) for kind in ("text", "stream", "voice", "busy", "ai_error"))
+    print(f"\n{turns} turns from {sessions} sessions in {elapsed:.1f}s: {turns / elapsed:.1f} turns/s")
+    print(f"\n{'client side':<22}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for kind in ("text", "stream", "stream_first_token", "stream_first_audio", "voice", "busy", "ai_error", "audio_fetch"):
+        values = results.latencies.get(kind, [])
+        if values or results.errors.get(kind):
+            print(f"{kind:<22}{len(values):>7}" + "".join(f"{percentile(values, p) * 1000:>10.0f}" for p in (50, 95, 99))
+                  + f"{results.errors.get(kind, 0):>8}")
+
+    print(f"\n{'server stage':<22}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for stage, (quantiles, count, _) in sorted(stages.items()):
+        print(f"{stage:<22}{count:>7}" + "".join(f"{q * 1000:>10.1f}" for q in quantiles))
+
+    for sample in results.error_samples:
+        print(f"❌ {sample}")
+
+    print("\nupstream calls: " + ", ".join(f"{name} {count}" for name, count in upstream.items()))
+    print(f"memory: RSS +{memory['rss_growth'] / 2**20:.1f} MiB over the run, "
+          f"{memory['rss_per_session'] / 1024:.0f} KiB RSS per session, "
+          f"{memory['session_state_bytes'] / 1024:.1f} KiB of session state per session")
+
+
+def main():
+    args = parse_args()
+    random.seed(args.seed)
+    weights = parse_mix(args.mix)
+    messages, replies = load_history()
+
+    groq = fake_services.FakeGroqServer(
+        reply_for=lambda message: replies.get(message.lower()),
+        first_token_ms=args.groq_first_token_ms, token_ms=args.groq_token_ms, chunk_tokens=args.groq_chunk_tokens,
+        max_concurrent=args.groq_max_concurrent
+    ).start()
+
+    # Everything app.py reads at import time: local Groq, scratch directories, no pre-warming
+    scratch = tempfile.mkdtemp(prefix="kitty_load_")
+    os.environ.update({
+        "GROQ_API_KEY": "benchmark",
+        "GROQ_BASE_URL": groq.base_url,
+        "TTS_CACHE_PREWARM": "0",
+        "TTS_CACHE_DIR": os.path.join(scratch, "tts_cache"),
+        "AUDIO_STORE_DIR": os.path.join(scratch, "audio"),
+        "TRANSCRIPT_DIR": os.path.join(scratch, "transcripts"),
+        "SESSION_BACKEND": "memory",
+        "STT_BACKENDS": "google",
+        "METRICS": "1",
+        "METRICS_SLOW_REQUEST_SECONDS": "3600",
+    })
+    os.environ.setdefault("USER_RATE_PER_SECOND", "0")
+    fake_services.install_fake_tts(args.tts_ms, args.tts_chunks)
+    stt = fake_services.install_fake_stt(args.stt_ms)
+
+    app_output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+    app_output.__enter__()
+    logging.getLogger("werkzeug").setLevel(logging.INFO if args.verbose else logging.ERROR)
+    db_rows = fake_services.install_fake_db(args.db_ms)
+
+    import app as kitty
+    from db_logger import get_logger_stats
+    UNANSWERED_REPLIES.update({kitty.SLOW_DOWN_REPLY: "busy", kitty.BUSY_REPLY: "busy", kitty.STT_BUSY_REPLY: "busy",
+                               kitty.AI_ERROR_REPLY: "ai_error"})
+    from werkzeug.serving import make_server
+
+    server = make_server("127.0.0.1", 0, kitty.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="kitty-server", daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    kind_names, kind_weights = zip(*weights.items())
+    plans = []
+    for i in range(args.sessions):
+        start = random.randrange(len(messages))
+        session_messages = [messages[(start + t) % len(messages)] for t in range(args.turns)]
+        plans.append((f"loaduser{i}", session_messages, random.choices(kind_names, kind_weights, k=args.turns)))
+    for _, session_messages, kinds in plans: # Clips are made up front so they don't count as latency
+        for message, kind in zip(session_messages, kinds):
+            if kind == "voice":
+                stt.clip_for(message)
+
+    results = Results()
+    rss_before = rss_bytes()
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for future in [pool.submit(run_session, base_url, *plan, stt, results) for plan in plans]:
+            future.result()
+    elapsed = time.perf_counter() - started_at
+    rss_growth = rss_bytes() - rss_before
+    server.shutdown()
+
+    kitty.transcript_writer.flush()
+    time.sleep(0.5) # Let the DB writer drain its last batch
+    session_count = len(kitty.session_store) or 1
+    memory = {
+        "rss_growth": rss_growth,
+        "rss_per_session": rss_growth / args.sessions,
+        "session_state_bytes": getattr(kitty.session_store, "_total_bytes", 0) / session_count,
+    }
+    upstream = {
+        "groq": groq.requests,
+        "groq 429s": groq.rate_limited,
+        **{f"{gate.name} turned away": gate.rejected + gate.timed_out for gate in kitty.upstream_gates},
+        "db rows": db_rows["written"],
+        "db rows dropped": get_logger_stats()["dropped"],
+        "tts coalesced": kitty.tts_flight.coalesced,
+    }
+    stages = kitty.metrics.snapshot()["stages"]
+    groq.stop()
+    app_output.__exit__(None, None, None)
+
+    print_report(results, elapsed, args.sessions, memory, upstream, stages)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "args": vars(args),
+                "elapsed_seconds": elapsed,
+                "client": {kind: {"count": len(v), "p50": percentile(v, 50), "p95": percentile(v, 95), "p99": percentile(v, 99)}
+                           for kind, v in results.latencies.items()},
+                "errors": results.errors,
+                "stages": {stage: {"count": count, "p50": q[0], "p95": q[1], "p99": q[2]} for stage, (q, count, _) in stages.items()},
+                "upstream": upstream,
+                "memory": memory,
+            }, f, indent=2)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Cold-start benchmark: how long a fresh worker takes to import app.py and to become ready.
+
+Starts a new Python process per run (nothing cached in memory, like a freshly scaled-up
+instance) and measures:
+    import    `import app`, the part that blocks the worker from serving at all
+    ready     until /readyz would answer 200 (every required startup warm-up finished, see startup.py)
+    process   the whole child process, interpreter start and exit included
+in the default lazy mode and with LAZY_STARTUP=0 (every heavy import and check inline, as before).
+With --importtime, also lists the slowest modules app.py pulls in at import (python -X importtime).
+
+No network or database needed: the schema check and TTS pre-warming are switched off.
+
+Run from the repo root:
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --runs 10 --importtime --json startup.json
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULT_PREFIX = "BENCH_STARTUP "
+MODES = {"lazy": "1", "eager": "0"}
+
+CHILD = f"""
+import json, sys, time
+RESULT_PREFIX = {RESULT_PREFIX!r}
+started_at = time.perf_counter()
+import app
+imported = time.perf_counter() - started_at
+while not app.startup.status()[0] and time.perf_counter() - started_at < float(sys.argv[1]):
+    time.sleep(0.002)
+ready = time.perf_counter() - started_at
+print(RESULT_PREFIX + json.dumps({{"import": imported, "ready": ready, "checks": app.startup.status()[1]}}), flush=True)
+"""
+
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)$")
+
+
+def child_env(lazy):
+    env = dict(os.environ)
+    env.setdefault("GROQ_API_KEY", "benchmark")
+    env.update(LAZY_STARTUP=lazy, TTS_CACHE_PREWARM="0", DB_SCHEMA_CHECK="off", METRICS="1")
+    return env
+
+
+def run_once(lazy, timeout):
+    started_at = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", CHILD, str(timeout)], cwd=ROOT, env=child_env(lazy),
+                         capture_output=True, text=True, encoding="utf-8")
+    process = time.perf_counter() - started_at
+    line = next((l for l in out.stdout.splitlines() if l.startswith(RESULT_PREFIX)), None)
+    if line is None:
+        raise RuntimeError(f"Child process failed:\n{out.stdout[-2000:]}\n{out.stderr[-2000:]}")
+    result = json.loads(line[len(RESULT_PREFIX):])
+    result["process"] = process
+    return result
+
+
+def slowest_imports(lazy, top):
+    """(module, cumulative seconds) for the slowest top-level imports made while importing app."""
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], cwd=ROOT, env=child_env(lazy),
+                         capture_output=True, text=True, encoding="utf-8")
+    modules = []
+    for line in out.stderr.splitlines():
+        m = IMPORTTIME_LINE.match(line)
+        if m and len(m.group(3)) == 3: # What app imports directly
+            modules.append((m.group(4), int(m.group(2)) / 1e6))
+    return sorted(modules, key=lambda item: item[1], reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes per mode")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for readiness")
+    parser.add_argument("--importtime", action="store_true", help="also list the slowest imports per mode")
+    parser.add_argument("--top", type=int, default=8)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = {}
+    print(f"{'mode':<8}{'import p50 ms':>15}{'min':>8}{'max':>8}{'ready p50 ms':>15}{'process p50 ms':>17}")
+    for mode, lazy in MODES.items():
+        runs = [run_once(lazy, args.timeout) for _ in range(args.runs)]
+        imports = [run["import"] for run in runs]
+        summary = {
+            "import_p50": statistics.median(imports),
+            "import_min": min(imports),
+            "import_max": max(imports),
+            "ready_p50": statistics.median(run["ready"] for run in runs),
+            "process_p50": statistics.median(run["process"] for run in runs),
+            "warm_ups": runs[-1]["checks"],
+        }
+        results[mode] = summary
+        print(f"{mode:<8}{summary['import_p50'] * 1000:>15.0f}{summary['import_min'] * 1000:>8.0f}"
+              f"{summary['import_max'] * 1000:>8.0f}{summary['ready_p50'] * 1000:>15.0f}{summary['process_p50'] * 1000:>17.0f}")
+
+    print("\nwarm-ups (lazy, last run): " + ", ".join(
+        f"{name} {check['seconds'] * 1000:.0f} ms" if check["seconds"] is not None else f"{name} {check['state']}"
+        for name, check in results["lazy"]["warm_ups"].items()))
+
+    if args.importtime:
+        for mode, lazy in MODES.items():
+            modules = slowest_imports(lazy, args.top)
+            results[mode]["slowest_imports"] = modules
+            print(f"\nslowest imports ({mode}): " + ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in modules))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
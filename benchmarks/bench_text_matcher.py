@@ -0,0 +1,90 @@
+"""
+Benchmark for language detection + custom-reply lookup (phrase_matcher.py) on real inputs.
+
+Replays every user message in chat_history.txt ("You: ..." and "[ts] User (name): ..." lines)
+through the old per-keyword regex / per-phrase substring scans and through the persona's text_matcher,
+checks both give the same answers, then reports the cost per message: cold (first time a
+message is seen) and memoized (the same message looked at again within a turn).
+
+Run from the repo root:
+    python benchmarks/bench_text_matcher.py
+"""
+import os
+import re
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from persona import persona_store, GENERAL_REPLIES_TABLE
+
+persona = persona_store.current()
+custom_responses, SPECIAL_USERS, TANGLISH_KEYWORDS, text_matcher = (
+    persona.custom_responses, persona.special_users, persona.tanglish_keywords, persona.text_matcher)
+
+ROUNDS = 20
+USER_LINE = re.compile(r"^(?:You|\[[^\]]*\] User \([^)]*\)):\s*(.*)$")
+
+
+def load_inputs(path=os.path.join(ROOT, "chat_history.txt")):
+    with open(path, encoding="utf-8") as f:
+        return [m.group(1) for m in map(USER_LINE.match, f) if m and m.group(1).strip()]
+
+
+# --- The scans text_matcher replaces, as they were written in app.py ---
+def legacy_detect_language(text):
+    if re.search(r'[\u0B80-\u0BFF]', text):
+        return 'ta'
+    for keyword in TANGLISH_KEYWORDS:
+        if re.search(r'\b' + re.escape(keyword) + r'\b', text.lower()):
+            return 'ta'
+    return 'en'
+
+def legacy_lookup(text, table):
+    query_lower = text.lower()
+    for phrase in table:
+        if phrase.lower() in query_lower:
+            return phrase
+    return None
+
+def legacy_turn(text):
+    return (legacy_detect_language(text), legacy_lookup(text, custom_responses),
+            legacy_lookup(text, SPECIAL_USERS["krithika"]["custom_replies"]))
+
+def matcher_turn(text):
+    result = text_matcher.match(text)
+    return (result.lang, result.phrase(GENERAL_REPLIES_TABLE), result.phrase("krithika"))
+
+
+def best_of(fn, inputs):
+    best = float("inf")
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        for text in inputs:
+            fn(text)
+        best = min(best, time.perf_counter() - start)
+    return best / len(inputs) * 1e6
+
+
+def main():
+    inputs = load_inputs()
+    mismatches = [text for text in inputs if legacy_turn(text) != matcher_turn(text)]
+    assert not mismatches, f"matcher disagrees with the old scans on: {mismatches[:5]}"
+
+    def cold(text):
+        text_matcher.match.cache_clear()
+        return matcher_turn(text)
+
+    legacy_us = best_of(legacy_turn, inputs)
+    cold_us = best_of(cold, inputs)
+    warm_us = best_of(matcher_turn, inputs)
+    tamil = sum(1 for text in inputs if text_matcher.match(text).lang == "ta")
+    print(f"{len(inputs)} user messages from chat_history.txt ({tamil} detected as Tamil), identical results")
+    print(f"{'old scans':<24}{legacy_us:>10.2f} us/message")
+    print(f"{'matcher (cold)':<24}{cold_us:>10.2f} us/message  ({legacy_us / cold_us:.1f}x)")
+    print(f"{'matcher (memoized)':<24}{warm_us:>10.2f} us/message  ({legacy_us / warm_us:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
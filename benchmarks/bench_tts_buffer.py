@@ -0,0 +1,91 @@
+"""
+Micro-benchmark for collecting edge_tts audio chunks.
+
+Compares the old `audio_data += chunk` loop in speak_async_internal against collecting
+the chunks in a list and writing them out without ever joining them (what
+audio_store.save does now), plus the join/bytearray variants for reference.
+
+Run from the repo root:
+    python benchmarks/bench_tts_buffer.py
+"""
+import io
+import os
+import time
+import tracemalloc
+
+# edge_tts streams 24 kHz / 48 kbit/s MP3; a multi-paragraph reply is roughly 60 seconds of speech
+# arriving in frames of a few hundred bytes each.
+AUDIO_SECONDS = 60
+BYTES_PER_SECOND = 48_000 // 8
+CHUNK_SIZE = 720
+ROUNDS = 5
+
+
+def make_chunks():
+    total = AUDIO_SECONDS * BYTES_PER_SECOND
+    return [os.urandom(CHUNK_SIZE) for _ in range(total // CHUNK_SIZE)]
+
+
+def concat_bytes(chunks):
+    audio_data = b''
+    for chunk in chunks:
+        audio_data += chunk
+    out = io.BytesIO()
+    out.write(audio_data)
+
+
+def join_list(chunks):
+    collected = []
+    for chunk in chunks:
+        collected.append(chunk)
+    out = io.BytesIO()
+    out.write(b''.join(collected))
+
+
+def grow_bytearray(chunks):
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+    out = io.BytesIO()
+    out.write(buffer)
+
+
+def chunk_list_writelines(chunks):
+    collected = []
+    for chunk in chunks:
+        collected.append(chunk)
+    out = io.BytesIO()
+    out.writelines(collected)
+
+
+def measure(fn, chunks):
+    best = float("inf")
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        fn(chunks)
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    fn(chunks)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def main():
+    chunks = make_chunks()
+    total_kb = sum(len(c) for c in chunks) / 1024
+    print(f"{len(chunks)} chunks of {CHUNK_SIZE} bytes ({total_kb:.0f} KiB of audio), best of {ROUNDS} runs\n")
+    print(f"{'strategy':<26}{'time (ms)':>12}{'peak alloc (KiB)':>20}")
+    for name, fn in [
+        ("bytes += chunk (old)", concat_bytes),
+        ("list + b''.join", join_list),
+        ("bytearray +=", grow_bytearray),
+        ("list + writelines (new)", chunk_list_writelines),
+    ]:
+        seconds, peak = measure(fn, chunks)
+        print(f"{name:<26}{seconds * 1000:>12.2f}{peak / 1024:>20.0f}")
+
+
+if __name__ == "__main__":
+    main()
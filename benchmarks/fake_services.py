@@ -0,0 +1,267 @@
+"""
+Local stand-ins for Kitty's external services, for offline benchmarks and load tests.
+
+    FakeGroqServer    an OpenAI-compatible /chat/completions HTTP server on localhost (plain and
+                      stream=True), with configurable time to first token, time per chunk and tokens
+                      per chunk, and optionally a concurrency limit past which it answers 429 like
+                      a rate-limited Groq; point GROQ_BASE_URL at its base_url before importing app
+    install_fake_tts  replaces edge_tts.Communicate: configurable synthesis latency and chunk count
+    install_fake_stt  replaces Recognizer.recognize_google: returns the text a clip was registered
+                      with (see FakeSTT.clip_for) after a configurable delay
+    install_fake_db   replaces db_logger's MySQL pool: executemany sleeps a configurable time
+
+Nothing here opens a connection outside the machine.
+"""
+import hashlib
+import io
+import json
+import random
+import sys
+import threading
+import time
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _sleep_ms(milliseconds, jitter=0.2):
+    """Sleeps about milliseconds, +/- jitter, so concurrent requests don't move in lockstep."""
+    if milliseconds > 0:
+        time.sleep(milliseconds / 1000.0 * random.uniform(1 - jitter, 1 + jitter))
+
+
+# --- Groq ---
+class _QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients dropping a keep-alive connection (e.g. after a stream) are normal here
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class FakeGroqServer:
+    """
+    Answers chat completions with reply_for(user_message) -> text (a generic line if None).
+    Streams are sent as server-sent events in chunks of chunk_tokens words. With max_concurrent,
+    a request arriving while that many are being answered gets a 429 (counted in rate_limited).
+    """
+
+    def __init__(self, reply_for=None, first_token_ms=300, token_ms=20, chunk_tokens=3, max_concurrent=0,
+                 host="127.0.0.1", port=0):
+        self.reply_for = reply_for or (lambda message: None)
+        self.first_token_ms = first_token_ms
+        self.token_ms = token_ms
+        self.chunk_tokens = chunk_tokens
+        self.max_concurrent = max_concurrent
+        self.requests = 0
+        self.rate_limited = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._server = _QuietHTTPServer((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/openai/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-groq", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _enter(self):
+        """False (and counted) if the request is over the concurrency limit."""
+        with self._lock:
+            if self.max_concurrent and self._in_flight >= self.max_concurrent:
+                self.rate_limited += 1
+                return False
+            self._in_flight += 1
+            return True
+
+    def _leave(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    def _reply(self, messages):
+        with self._lock:
+            self.requests += 1
+        user_message = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+        return self.reply_for(user_message) or "That's lovely to hear! Tell me more, I'm all ears. 😊"
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # Keep-alive, like the real API
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if not fake._enter():
+                    return self._send_json({"error": {"message": "Rate limit reached", "type": "rate_limit_exceeded",
+                                                      "code": "rate_limit_exceeded"}}, status=429)
+                try:
+                    reply = fake._reply(body.get("messages", []))
+                    model = body.get("model", "fake")
+                    if body.get("stream"):
+                        self._stream(reply, model)
+                    else:
+                        _sleep_ms(fake.first_token_ms + fake.token_ms * len(reply.split()) / max(1, fake.chunk_tokens))
+                        self._send_json({
+                            "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()), "model": model,
+                            "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+                            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+                        })
+                finally:
+                    fake._leave()
+
+            def _send_json(self, payload, status=200):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _stream(self, reply, model):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                words = reply.split(" ")
+                _sleep_ms(fake.first_token_ms)
+                for start in range(0, len(words), max(1, fake.chunk_tokens)):
+                    if start:
+                        _sleep_ms(fake.token_ms)
+                    text = " ".join(words[start:start + fake.chunk_tokens]) + " "
+                    self._event({
+                        "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                        "choices": [{"index": 0, "delta": {"content": text}, "finish_reason": None}],
+                    })
+                self._write_chunk(b"data: [DONE]\n\n")
+                self._write_chunk(b"")
+
+            def _event(self, payload):
+                self._write_chunk(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+
+            def _write_chunk(self, data):
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+
+        return Handler
+
+
+# --- edge_tts ---
+def install_fake_tts(latency_ms=400, chunks=8, chunk_bytes=2048):
+    """Replaces edge_tts.Communicate; each synthesis yields `chunks` audio chunks spread over latency_ms."""
+    import asyncio
+    import edge_tts
+
+    class FakeCommunicate:
+        def __init__(self, text, voice, **kwargs):
+            self.text = text
+            self.voice = voice
+
+        async def stream(self):
+            for i in range(chunks):
+                await asyncio.sleep(latency_ms / 1000.0 / chunks * random.uniform(0.8, 1.2))
+                yield {"type": "audio", "data": bytes([i % 256]) * chunk_bytes}
+            yield {"type": "WordBoundary", "offset": 0, "duration": 0, "text": self.text}
+
+    edge_tts.Communicate = FakeCommunicate
+    return FakeCommunicate
+
+
+# --- Google STT ---
+class FakeSTT:
+    """Maps generated clips back to the text they stand for."""
+
+    def __init__(self, latency_ms=600):
+        self.latency_ms = latency_ms
+        self._texts = {}
+        self._clips = {}
+        self._lock = threading.Lock()
+
+    def clip_for(self, text, seconds=1.0, sample_rate=16000):
+        """A 16 kHz mono WAV of low noise, unique per text, that transcribes back to text."""
+        with self._lock:
+            if text in self._clips:
+                return self._clips[text]
+        seed = int(hashlib.sha1(text.encode("utf-8")).hexdigest()[:8], 16)
+        rng = random.Random(seed)
+        frames = bytearray()
+        for _ in range(int(seconds * sample_rate)):
+            frames += rng.randint(-300, 300).to_bytes(2, "little", signed=True)
+        with self._lock:
+            self._texts[hashlib.sha1(bytes(frames)).hexdigest()] = text
+        out = io.BytesIO()
+        with wave.open(out, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(sample_rate)
+            wav.writeframes(bytes(frames))
+        with self._lock:
+            self._clips[text] = out.getvalue()
+        return self._clips[text]
+
+    def recognize(self, audio):
+        _sleep_ms(self.latency_ms)
+        with self._lock:
+            text = self._texts.get(hashlib.sha1(audio.get_raw_data(convert_rate=16000, convert_width=2)).hexdigest())
+        if text is None:
+            import speech_recognition as sr
+            raise sr.UnknownValueError()
+        return text
+
+
+def install_fake_stt(latency_ms=600):
+    import speech_recognition as sr
+
+    fake = FakeSTT(latency_ms)
+    sr.Recognizer.recognize_google = lambda recognizer, audio, *args, **kwargs: fake.recognize(audio)
+    return fake
+
+
+# --- MySQL ---
+def install_fake_db(latency_ms=15):
+    """Gives db_logger a pool whose connections accept executemany after latency_ms. Returns a row counter."""
+    import db_logger
+
+    rows = {"written": 0}
+    lock = threading.Lock()
+
+    class FakeCursor:
+        def executemany(self, query, batch):
+            _sleep_ms(latency_ms)
+            with lock:
+                rows["written"] += len(batch)
+
+        def execute(self, query, params=None):
+            _sleep_ms(latency_ms)
+
+        def close(self):
+            pass
+
+    class FakeConnection:
+        def cursor(self):
+            return FakeCursor()
+
+        def commit(self):
+            pass
+
+        def close(self):
+            pass
+
+    class FakePool:
+        def get_connection(self):
+            return FakeConnection()
+
+    db_logger._pool = FakePool()
+    return rows
@@ -1,32 +1,57 @@
 import os
+import atexit
+import queue
+import tempfile
+import threading
+import time
 import mysql.connector
 from mysql.connector import Error
+from mysql.connector import pooling
 from datetime import datetime
 from dotenv import load_dotenv
 
+from metrics import metrics
+
 load_dotenv()
 
+# --- Logging pipeline settings ---
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "3"))
+DB_LOG_QUEUE_SIZE = int(os.getenv("DB_LOG_QUEUE_SIZE", "1000")) # Rows waiting to be written before new ones are dropped
+DB_LOG_BATCH_SIZE = int(os.getenv("DB_LOG_BATCH_SIZE", "50")) # Flush as soon as this many rows are waiting...
+DB_LOG_FLUSH_SECONDS = float(os.getenv("DB_LOG_FLUSH_SECONDS", "1.0")) # ...or when the oldest one has waited this long
+DB_LOG_SHUTDOWN_TIMEOUT = float(os.getenv("DB_LOG_SHUTDOWN_TIMEOUT", "5.0"))
+
+# --- Schema check settings ---
+# "deploy": once per deployment (per DEPLOYMENT_ID, or RENDER_GIT_COMMIT on Render) on each machine,
+#           by whichever worker gets there first; "worker": once per worker process; "off": never
+#           (e.g. when `python db_logger.py` runs as the platform's pre-deploy command)
+DB_SCHEMA_CHECK = os.getenv("DB_SCHEMA_CHECK", "deploy")
+DB_SCHEMA_MARKER_DIR = os.getenv("DB_SCHEMA_MARKER_DIR", tempfile.gettempdir())
+
+def _db_config():
+    # Read all database details from environment variables
+    db_host = os.getenv("DB_HOST")
+    db_user = os.getenv("DB_USER")
+    db_password = os.getenv("DB_PASSWORD")
+    db_name = os.getenv("DB_NAME")
+    # Add this line to read the DB_PORT environment variable
+    db_port = os.getenv("DB_PORT")
+
+    if not all([db_host, db_user, db_password, db_name, db_port]):
+        raise ValueError("One or more database environment variables are not set.")
+
+    return {
+        "host": db_host,
+        "user": db_user,
+        "password": db_password,
+        "database": db_name,
+        # Pass the port to the connection function
+        "port": db_port
+    }
+
 def connect_to_db():
     try:
-        # Read all database details from environment variables
-        db_host = os.getenv("DB_HOST")
-        db_user = os.getenv("DB_USER")
-        db_password = os.getenv("DB_PASSWORD")
-        db_name = os.getenv("DB_NAME")
-        # Add this line to read the DB_PORT environment variable
-        db_port = os.getenv("DB_PORT")
-
-        if not all([db_host, db_user, db_password, db_name, db_port]):
-            raise ValueError("One or more database environment variables are not set.")
-
-        conn = mysql.connector.connect(
-            host=db_host,
-            user=db_user,
-            password=db_password,
-            database=db_name,
-            # Pass the port to the connection function
-            port=db_port
-        )
+        conn = mysql.connector.connect(**_db_config())
         return conn
     except Error as e:
         print(f"❌ MySQL Connection Error: {e}")
@@ -36,10 +61,10 @@ def connect_to_db():
         return None
 
 def setup_database():
-    """Connects to the database and ensures the necessary table exists."""
+    """Connects to the database and ensures the necessary table exists. Returns True on success."""
     conn = connect_to_db()
     if not conn:
-        return
+        return False
 
     try:
         cursor = conn.cursor()
@@ -66,28 +91,171 @@ def setup_database():
         
         cursor.close()
         conn.close()
+        return True
 
     except Error as e:
         print(f"❌ Database Setup Error: {e}")
+        return False
 
-def log_to_db(username, question, answer):
-    # This function remains the same as before
+class SchemaCheckError(Exception):
+    """setup_database() could not reach MySQL or create the table."""
+
+
+def _schema_marker_path():
+    deployment_id = os.getenv("DEPLOYMENT_ID") or os.getenv("RENDER_GIT_COMMIT")
+    if not deployment_id:
+        return None
+    return os.path.join(DB_SCHEMA_MARKER_DIR, f"kitty_schema_checked_{deployment_id[:40]}")
+
+def ensure_schema():
+    """
+    Runs setup_database() as often as DB_SCHEMA_CHECK says. Called at startup, off the import path.
+    Raises SchemaCheckError if it fails, so the startup warm-up is recorded as failed.
+    """
+    if DB_SCHEMA_CHECK == "off":
+        return
+    marker = _schema_marker_path() if DB_SCHEMA_CHECK == "deploy" else None
+    if marker is None: # "worker", or no deployment id to key the marker on
+        if not setup_database():
+            raise SchemaCheckError("Database schema check failed.")
+        return
     try:
-        conn = connect_to_db()
-        if conn:
-            cursor = conn.cursor()
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            query = """
-                INSERT INTO conversations (username, question, answer, timestamp)
-                VALUES (%s, %s, %s, %s)
-            """
-            cursor.execute(query, (username, question, answer, timestamp))
-            conn.commit()
-            cursor.close()
-            conn.close()
-            print("✅ Conversation saved to database.")
+        # The first worker of this deployment claims the marker; the others skip the check
+        os.close(os.open(marker, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        print("Database schema already checked for this deployment.")
+        return
+    if not setup_database():
+        os.remove(marker) # Let the next worker try again
+        raise SchemaCheckError("Database schema check failed.")
+
+# --- Asynchronous, batched conversation logging ---
+# log_to_db only puts the row on a bounded in-process queue. A background writer thread
+# takes rows off it and inserts them in batches over pooled connections, so chat latency
+# never depends on database latency. If the queue is full the row is dropped and counted.
+
+INSERT_CONVERSATION_QUERY = """
+    INSERT INTO conversations (username, question, answer, timestamp)
+    VALUES (%s, %s, %s, %s)
+"""
+
+_log_queue = queue.Queue(maxsize=DB_LOG_QUEUE_SIZE)
+_STOP = object()
+_pool = None
+_writer_thread = None
+_writer_lock = threading.Lock()
+_stats = {"written": 0, "dropped": 0, "failed": 0}
+_stats_lock = threading.Lock()
+
+def _count(name, n=1):
+    with _stats_lock:
+        _stats[name] += n
+        return _stats[name]
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = pooling.MySQLConnectionPool(
+            pool_name="kitty_logger",
+            pool_size=DB_POOL_SIZE,
+            pool_reset_session=False,
+            **_db_config()
+        )
+    return _pool
+
+@metrics.timed("db_write_batch")
+def _write_batch(rows):
+    """Inserts rows in one round trip (mysql-connector rewrites executemany INSERTs into a multi-row INSERT)."""
+    try:
+        conn = _get_pool().get_connection()
+    except (Error, ValueError) as e:
+        print(f"❌ MySQL Pool Error: {e}")
+        _count("failed", len(rows))
+        return
+    try:
+        cursor = conn.cursor()
+        cursor.executemany(INSERT_CONVERSATION_QUERY, rows)
+        conn.commit()
+        cursor.close()
+        _count("written", len(rows))
+        print(f"✅ {len(rows)} conversation(s) saved to database.")
     except Error as e:
         print(f"❌ MySQL Insert Error: {e}")
+        _count("failed", len(rows))
+    finally:
+        conn.close() # Returns the connection to the pool
+
+def _writer_loop():
+    stopping = False
+    while not stopping:
+        item = _log_queue.get()
+        if item is _STOP:
+            break
+        batch = [item]
+        deadline = time.monotonic() + DB_LOG_FLUSH_SECONDS
+        while len(batch) < DB_LOG_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            try:
+                item = _log_queue.get(timeout=remaining) if remaining > 0 else _log_queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                stopping = True
+                break
+            batch.append(item)
+        _write_batch(batch)
+
+    # Drain whatever is still queued before exiting
+    leftover = []
+    while True:
+        try:
+            item = _log_queue.get_nowait()
+        except queue.Empty:
+            break
+        if item is not _STOP:
+            leftover.append(item)
+    for start in range(0, len(leftover), DB_LOG_BATCH_SIZE):
+        _write_batch(leftover[start:start + DB_LOG_BATCH_SIZE])
+
+def _ensure_writer():
+    global _writer_thread
+    if _writer_thread is not None and _writer_thread.is_alive():
+        return
+    with _writer_lock:
+        if _writer_thread is None or not _writer_thread.is_alive():
+            _writer_thread = threading.Thread(target=_writer_loop, name="db-log-writer", daemon=True)
+            _writer_thread.start()
+
+@metrics.timed("log_to_db")
+def log_to_db(username, question, answer):
+    """Queues one conversation row for the background writer. Never blocks on the database."""
+    _ensure_writer()
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    try:
+        _log_queue.put_nowait((username, question, answer, timestamp))
+    except queue.Full:
+        dropped = _count("dropped")
+        print(f"❌ Conversation log queue full, dropped row for {username} ({dropped} dropped so far).")
+
+def get_logger_stats():
+    """Counters for the logging pipeline: rows written, dropped (queue full), failed (DB error) and queued."""
+    with _stats_lock:
+        return dict(_stats, queued=_log_queue.qsize())
+
+def shutdown_logger(timeout=DB_LOG_SHUTDOWN_TIMEOUT):
+    """Flushes queued rows and stops the writer. Registered with atexit for graceful worker shutdown."""
+    global _writer_thread
+    if _writer_thread is None or not _writer_thread.is_alive():
+        return
+    try:
+        _log_queue.put(_STOP, timeout=timeout)
+    except queue.Full:
+        pass # The writer is still busy; whatever it doesn't reach in time is lost with the process
+    _writer_thread.join(timeout)
+    _writer_thread = None
+
+atexit.register(shutdown_logger)
 
-# Call this function once when your application starts
-setup_database()
\ No newline at end of file
+if __name__ == "__main__":
+    # Schema check as a one-off (e.g. a pre-deploy command), so workers can run with DB_SCHEMA_CHECK=off
+    raise SystemExit(0 if setup_database() else 1)
@@ -28,8 +28,14 @@ let currentUser = null;
 let isRecording = false;
 let mediaRecorder;
 let audioChunks = [];
+const USE_VOICE_SOCKET = 'WebSocket' in window; // Stream voice input over /ws/voice instead of uploading it afterwards
+const VOICE_CHUNK_MS = 250; // MediaRecorder timeslice: how often a chunk is sent while recording
 let audioContext; // Declared globally to manage browser's audio context
 let kittyAudioPlayer = null; // **CORRECTED:** Global variable for the AudioBufferSourceNode
+let queuedAudioSources = []; // Sentence clips from /api/chat/stream, scheduled back-to-back
+let audioQueueChain = Promise.resolve(); // Keeps clips decoding and scheduling in arrival order
+let nextQueuedStartTime = 0;
+let playbackGeneration = 0; // Bumped by stopCurrentPlayback; clips from an earlier generation are dropped
 let currentMode = 'voice'; // 'voice' or 'text' - starts in voice mode by default
 let wakeModeActive = false; // Tracks the AI's activation state (synced with backend)
 
@@ -64,17 +70,28 @@ function appendMessage(sender, message) {
     chatHistoryDiv.appendChild(messageDiv);
 
     scrollToBottom();
+    return contentDiv; // Returned so streamed replies can keep appending to it
+}
+
+// Downloads a synthesized reply as raw binary audio (served as audio/mpeg by /api/audio/<id>).
+async function fetchAudio(audioUrl) {
+    const response = await fetch(`${BACKEND_URL}${audioUrl}`);
+    if (!response.ok) {
+        throw new Error(`Audio fetch failed with status ${response.status}`);
+    }
+    return response.arrayBuffer();
 }
 
 // **MODIFIED:** Correctly uses `stop()` and manages the global reference
-async function playAudioFromBase64(base64Data, mimeType) {
-    if (!base64Data) {
-        console.warn("No audio data provided to playAudioFromBase64.");
+async function playAudioFromUrl(audioUrl) {
+    if (!audioUrl) {
+        console.warn("No audio URL provided to playAudioFromUrl.");
         return;
     }
     
     // **CORRECTED:** Stop any existing playback before starting a new one
     stopCurrentPlayback();
+    const generation = playbackGeneration;
 
     if (!audioContext) {
         audioContext = new (window.AudioContext || window.webkitAudioContext)();
@@ -89,11 +106,12 @@ async function playAudioFromBase64(base64Data, mimeType) {
         }
     }
 
-    const audioBlob = b64toBlob(base64Data, mimeType);
-    const arrayBuffer = await audioBlob.arrayBuffer();
-
     try {
+        const arrayBuffer = await fetchAudio(audioUrl);
         const audioBuffer = await audioContext.decodeAudioData(arrayBuffer);
+        if (generation !== playbackGeneration) {
+            return; // Stopped while downloading or decoding
+        }
         const source = audioContext.createBufferSource();
         source.buffer = audioBuffer;
         source.connect(audioContext.destination);
@@ -113,32 +131,70 @@ async function playAudioFromBase64(base64Data, mimeType) {
     }
 }
 
+// Plays streamed sentence clips one after another without gaps, in the order they arrived.
+// generation: the playbackGeneration the reply started in; clips are dropped once playback was stopped since.
+function enqueueAudioChunk(audioUrl, generation = playbackGeneration) {
+    if (generation !== playbackGeneration) {
+        return;
+    }
+    // Start downloading right away; only decoding and scheduling wait for earlier clips
+    const download = fetchAudio(audioUrl);
+    download.catch(() => {}); // Errors are reported when the chain reaches this clip
+
+    audioQueueChain = audioQueueChain.then(async () => {
+        if (generation !== playbackGeneration) {
+            return;
+        }
+        if (!audioContext) {
+            audioContext = new (window.AudioContext || window.webkitAudioContext)();
+        }
+        if (audioContext.state === 'suspended') {
+            try {
+                await audioContext.resume();
+            } catch (e) {
+                console.error("Failed to resume AudioContext:", e);
+            }
+        }
+
+        try {
+            const arrayBuffer = await download;
+            const audioBuffer = await audioContext.decodeAudioData(arrayBuffer);
+            if (generation !== playbackGeneration) {
+                return; // Stopped while this clip was downloading or decoding
+            }
+            const source = audioContext.createBufferSource();
+            source.buffer = audioBuffer;
+            source.connect(audioContext.destination);
+
+            const startTime = Math.max(audioContext.currentTime, nextQueuedStartTime);
+            source.start(startTime);
+            nextQueuedStartTime = startTime + audioBuffer.duration;
+
+            queuedAudioSources.push(source);
+            source.onended = () => {
+                queuedAudioSources = queuedAudioSources.filter(s => s !== source);
+            };
+        } catch (error) {
+            console.error("Error decoding or playing queued audio:", error);
+        }
+    });
+}
+
 // **CORRECTED:** Function to stop the current audio playback
 function stopCurrentPlayback() {
+    playbackGeneration++; // Clips still downloading, decoding or yet to arrive won't play
+    nextQueuedStartTime = 0;
     if (kittyAudioPlayer) {
         // Correctly use `stop()` method for AudioBufferSourceNode
         kittyAudioPlayer.stop(); 
         kittyAudioPlayer = null;
         console.log("Audio playback interrupted.");
     }
-}
-
-function b64toBlob(b64Data, contentType = '', sliceSize = 512) {
-    const byteCharacters = atob(b64Data);
-    const byteArrays = [];
-
-    for (let offset = 0; offset < byteCharacters.length; offset += sliceSize) {
-        const slice = byteCharacters.slice(offset, offset + sliceSize);
-        const byteNumbers = new Array(slice.length);
-        for (let i = 0; i < slice.length; i++) {
-            byteNumbers[i] = slice.charCodeAt(i);
-        }
-        const byteArray = new Uint8Array(byteNumbers);
-        byteArrays.push(byteArray);
+    if (queuedAudioSources.length > 0) {
+        queuedAudioSources.forEach(source => source.stop());
+        queuedAudioSources = [];
+        console.log("Queued audio playback interrupted.");
     }
-
-    const blob = new Blob(byteArrays, { type: contentType });
-    return blob;
 }
 
 function updateActivationInfo(isActive) {
@@ -182,6 +238,27 @@ function adjustInputHeight() {
 }
 
 // --- API Calls ---
+// Shows a reply from /api/chat/text, /api/chat/audio or /ws/voice: wake state, text and voice.
+function showChatResponse(data) {
+    if (data.success) {
+        updateActivationInfo(data.wake_mode);
+
+        if (data.response_text) {
+            appendMessage('assistant', data.response_text);
+        }
+
+        if (currentMode === 'voice' && data.audio_url) {
+            playAudioFromUrl(data.audio_url);
+        }
+
+        return data;
+    } else {
+        console.error("Backend error:", data.message);
+        appendMessage('assistant', `Error: ${data.message}`);
+        return { success: false, message: data.message };
+    }
+}
+
 async function sendChatRequest(message, type = 'text', isInitialLoad = false) {
     if (!currentUser) {
         alert("Please log in first!");
@@ -216,26 +293,102 @@ async function sendChatRequest(message, type = 'text', isInitialLoad = false) {
             throw new Error(`Server responded with status ${response.status}: ${errorText}`);
         }
         const data = await response.json();
+        return showChatResponse(data);
+    } catch (error) {
+        console.error("Error sending chat request:", error);
+        appendMessage('assistant', "Network error: Couldn't connect to Kitty. Please check your connection or server status.");
+        return { success: false, message: "Network error or backend unreachable." };
+    }
+}
 
-        if (data.success) {
-            updateActivationInfo(data.wake_mode);
-
-            if (data.response_text) {
-                appendMessage('assistant', data.response_text);
+// Parses a server-sent event stream from a fetch() response and calls onEvent(name, data) per event.
+async function readEventStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const frame = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+
+            let eventName = 'message';
+            let dataText = '';
+            frame.split('\n').forEach(line => {
+                if (line.startsWith('event:')) {
+                    eventName = line.slice(6).trim();
+                } else if (line.startsWith('data:')) {
+                    dataText += line.slice(5).trim();
+                }
+            });
+            if (dataText) {
+                onEvent(eventName, JSON.parse(dataText));
             }
+        }
+    }
+}
 
-            if (currentMode === 'voice' && data.audio_data) {
-                playAudioFromBase64(data.audio_data, data.audio_mime_type);
-            }
+// Chat over /api/chat/stream: the reply bubble fills in token by token while Kitty is typing,
+// and in voice mode each sentence starts playing as soon as the server has synthesized it.
+async function sendChatStreamRequest(message, isInitialLoad = false) {
+    if (!currentUser) {
+        alert("Please log in first!");
+        return { success: false, message: "User not logged in." };
+    }
+    // Pressing stop or starting to record silences the rest of this reply; its text keeps arriving
+    const generation = playbackGeneration;
 
-            return data;
-        } else {
-            console.error("Backend error:", data.message);
-            appendMessage('assistant', `Error: ${data.message}`);
-            return { success: false, message: data.message };
+    try {
+        const response = await fetch(`${BACKEND_URL}/api/chat/stream`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                username: currentUser,
+                message: message,
+                responseMode: currentMode,
+                isInitialLoad: isInitialLoad
+            })
+        });
+        if (!response.ok) {
+            const errorText = await response.text();
+            throw new Error(`Server responded with status ${response.status}: ${errorText}`);
         }
+        if (!response.body) {
+            // Streaming not supported by this browser; fall back to the regular endpoint
+            return sendChatRequest(message, 'text', isInitialLoad);
+        }
+
+        let replyContent = null;
+        let result = { success: false, message: "Stream ended early." };
+
+        await readEventStream(response, (eventName, data) => {
+            if (eventName === 'token') {
+                if (!replyContent) {
+                    replyContent = appendMessage('assistant', '');
+                }
+                replyContent.textContent += data.text;
+                scrollToBottom();
+            } else if (eventName === 'audio') {
+                if (currentMode === 'voice') {
+                    enqueueAudioChunk(data.audio_url, generation);
+                }
+            } else if (eventName === 'done') {
+                updateActivationInfo(data.wake_mode);
+                if (replyContent) {
+                    replyContent.textContent = data.response_text;
+                }
+                result = data;
+            }
+        });
+
+        return result;
     } catch (error) {
-        console.error("Error sending chat request:", error);
+        console.error("Error sending chat stream request:", error);
         appendMessage('assistant', "Network error: Couldn't connect to Kitty. Please check your connection or server status.");
         return { success: false, message: "Network error or backend unreachable." };
     }
@@ -316,7 +469,7 @@ async function handleSendText() {
     userInput.value = '';
     adjustInputHeight();
 
-    await sendChatRequest(message, 'text');
+    await sendChatStreamRequest(message);
 }
 
 // **MODIFIED:** Correctly implements the microphone state fix and stops audio
@@ -330,23 +483,23 @@ async function handleMicrophoneClick() {
         stopCurrentPlayback();
         try {
             const stream = await navigator.mediaDevices.getUserMedia({ audio: true });
-            mediaRecorder = new MediaRecorder(stream, { mimeType: 'audio/webm' });
-
-            mediaRecorder.ondataavailable = (event) => {
-                audioChunks.push(event.data);
-            };
-
-            mediaRecorder.onstop = async () => {
-                const audioBlob = new Blob(audioChunks, { type: 'audio/webm' });
-                audioChunks = [];
-
-                appendMessage('user', "(Voice input...)");
-                await sendChatRequest(audioBlob, 'audio');
-                
-                resetVoiceInputState();
-            };
-
-            mediaRecorder.start();
+            // Compact opus is decoded on the server, so there's no need to record heavy WAV
+            const recorderMimeType = MediaRecorder.isTypeSupported('audio/webm;codecs=opus') ? 'audio/webm;codecs=opus' : 'audio/webm';
+            mediaRecorder = new MediaRecorder(stream, { mimeType: recorderMimeType });
+
+            if (USE_VOICE_SOCKET) {
+                startVoiceSocket(); // Streams while recording; falls back to the upload below if the socket fails
+            } else {
+                mediaRecorder.ondataavailable = (event) => {
+                    audioChunks.push(event.data);
+                };
+
+                mediaRecorder.onstop = async () => {
+                    await sendRecordedAudio();
+                };
+
+                mediaRecorder.start();
+            }
             microphoneButton.classList.add('recording');
             isRecording = true;
             userInput.placeholder = "Recording... Speak clearly.";
@@ -362,6 +515,93 @@ async function handleMicrophoneClick() {
     }
 }
 
+// Uploads the whole recording to /api/chat/audio in one request.
+async function sendRecordedAudio(userBubble = null) {
+    const audioBlob = new Blob(audioChunks, { type: 'audio/webm' });
+    audioChunks = [];
+
+    if (!userBubble) {
+        appendMessage('user', "(Voice input...)");
+    }
+    await sendChatRequest(audioBlob, 'audio');
+
+    resetVoiceInputState();
+}
+
+// Sends MediaRecorder chunks over /ws/voice while the user speaks. The server shows what it has
+// heard so far (partial), says when the user stopped talking (endpoint) and then replies (final).
+function startVoiceSocket() {
+    const socket = new WebSocket(`${BACKEND_URL.replace(/^http/, 'ws')}/ws/voice`);
+    const unsentChunks = []; // Recorded before the socket opened
+    let userBubble = null;
+    let finished = false;
+
+    const fallBackToUpload = () => {
+        if (finished) return;
+        finished = true;
+        if (mediaRecorder.state !== 'inactive') {
+            mediaRecorder.onstop = () => sendRecordedAudio(userBubble);
+        } else {
+            sendRecordedAudio(userBubble);
+        }
+    };
+
+    mediaRecorder.ondataavailable = (event) => {
+        audioChunks.push(event.data); // Kept in case the socket fails and the clip has to be uploaded
+        if (event.data.size === 0) return;
+        if (socket.readyState === WebSocket.OPEN) {
+            socket.send(event.data);
+        } else {
+            unsentChunks.push(event.data);
+        }
+    };
+
+    mediaRecorder.onstop = () => {
+        if (socket.readyState === WebSocket.OPEN) {
+            socket.send(JSON.stringify({ type: 'stop' }));
+            userInput.placeholder = "Kitty is thinking...";
+        } else {
+            fallBackToUpload();
+        }
+    };
+
+    socket.onopen = () => {
+        socket.send(JSON.stringify({ type: 'start', username: currentUser, responseMode: currentMode }));
+        unsentChunks.splice(0).forEach(chunk => socket.send(chunk));
+    };
+
+    socket.onmessage = (event) => {
+        const data = JSON.parse(event.data);
+        if (data.type === 'partial') {
+            if (!userBubble) {
+                userBubble = appendMessage('user', data.text);
+            } else {
+                userBubble.textContent = data.text;
+            }
+        } else if (data.type === 'endpoint') {
+            if (mediaRecorder.state !== 'inactive') {
+                mediaRecorder.stop(); // The user stopped talking; no need to press the button again
+            }
+        } else if (data.type === 'final' || data.type === 'error') {
+            finished = true;
+            audioChunks = [];
+            if (userBubble) {
+                userBubble.textContent = data.user_message_recognized || "(Voice input...)";
+            } else {
+                appendMessage('user', data.user_message_recognized || "(Voice input...)");
+            }
+            showChatResponse(data);
+            resetVoiceInputState();
+            socket.close();
+        }
+    };
+
+    socket.onerror = fallBackToUpload;
+    socket.onclose = fallBackToUpload;
+
+    mediaRecorder.start(VOICE_CHUNK_MS);
+}
+
 function resetVoiceInputState() {
     isRecording = false;
     microphoneButton.classList.remove('recording');
@@ -0,0 +1,164 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+# Token-budgeted conversation history with a rolling summary.
+#
+# A user's session keeps the raw user/assistant turns plus a short summary of everything older.
+# The system prompt is not stored: it is picked per request (English or Tamil), so switching
+# language keeps the conversation.
+#
+# Every Groq call gets the system prompt, the summary and as many of the newest turns as fit in
+# HISTORY_TOKEN_BUDGET (assembled by prompt_builder.py). When the stored turns outgrow
+# HISTORY_SUMMARY_TRIGGER_TOKENS, the oldest ones are folded into the summary in the background,
+# keeping HISTORY_KEEP_RECENT_TOKENS verbatim.
+# Until that finishes, the budget simply leaves the oldest turns out, so prompts stay bounded.
+# Anything that rewrites a session's history holds history_locks(username), so a reply saved
+# while the summary is being written is never lost, and folded turns never come back.
+#
+# Token counts are estimates (no tokenizer dependency): about 4 characters per token for Latin
+# text, one token per character for other scripts (Tamil), plus a few tokens per message.
+
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "3000")) # summary + turns, of the model's 8192
+HISTORY_SUMMARY_TRIGGER_TOKENS = int(os.getenv("HISTORY_SUMMARY_TRIGGER_TOKENS", "2400"))
+HISTORY_KEEP_RECENT_TOKENS = int(os.getenv("HISTORY_KEEP_RECENT_TOKENS", "1200"))
+HISTORY_MAX_STORED_TOKENS = 2 * HISTORY_SUMMARY_TRIGGER_TOKENS # Hard cap if summarizing keeps failing
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+@lru_cache(maxsize=4096)
+def estimate_tokens(text):
+    """Cached: the same turns are counted again on every request until they leave the history."""
+    latin = sum(1 for ch in text if ord(ch) < 0x250)
+    return (latin + 3) // 4 + (len(text) - latin)
+
+
+def message_tokens(message):
+    return estimate_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+
+def stored_turns(state):
+    """The user/assistant turns of a session (older sessions also stored a system message)."""
+    return [m for m in state.get("conversation_history", []) if m.get("role") in ("user", "assistant")]
+
+
+def fit_turns(turns, budget):
+    """The newest turns whose tokens fit in budget, oldest first."""
+    kept = []
+    remaining = budget
+    for message in reversed(turns):
+        remaining -= message_tokens(message)
+        if remaining < 0:
+            break
+        kept.append(message)
+    # Never open the window on an assistant reply whose question was cut off
+    if kept and kept[-1]["role"] == "assistant":
+        kept.pop()
+    kept.reverse()
+    return kept
+
+
+def turns_to_fold(turns, trigger=HISTORY_SUMMARY_TRIGGER_TOKENS, keep_recent=HISTORY_KEEP_RECENT_TOKENS):
+    """How many of the oldest turns should go into the summary (0 while under the trigger)."""
+    sizes = [message_tokens(m) for m in turns]
+    if sum(sizes) <= trigger:
+        return 0
+    kept_tokens = 0
+    count = len(turns)
+    while count > 0 and kept_tokens + sizes[count - 1] <= keep_recent:
+        count -= 1
+        kept_tokens += sizes[count]
+    # Fold whole exchanges: start the kept part on a user message
+    while count < len(turns) and turns[count]["role"] != "user":
+        count += 1
+    return count
+
+
+def cap_turns(turns, max_tokens=HISTORY_MAX_STORED_TOKENS):
+    """Drops the oldest turns beyond max_tokens; they are out of every prompt's budget anyway."""
+    total = sum(message_tokens(m) for m in turns)
+    start = 0
+    while start < len(turns) and total > max_tokens:
+        total -= message_tokens(turns[start])
+        start += 1
+    return turns[start:]
+
+
+class UserLocks:
+    """A fixed set of locks striped by username: calls for the same user share one. Per process."""
+
+    def __init__(self, stripes=64):
+        self._locks = [threading.RLock() for _ in range(stripes)]
+
+    def __call__(self, username):
+        return self._locks[hash(username) % len(self._locks)]
+
+
+history_locks = UserLocks()
+
+
+class HistorySummarizer:
+    """
+    Folds old turns into a session's summary on a background thread.
+    summarize(previous_summary, turns) -> new summary text, or None on failure.
+    load_state(username) / update_state(username, change) access the session store (see session_store.py).
+    The slow summarize call runs unlocked; its result is checked and written back in one update_state
+    call, atomic across workers, while also holding user_lock(username) against this process's writers.
+    """
+
+    def __init__(self, summarize, load_state, update_state, max_workers=2, user_lock=history_locks):
+        self._summarize = summarize
+        self._load_state = load_state
+        self._update_state = update_state
+        self._user_lock = user_lock
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="history-summary")
+        self._in_progress = set()
+        self._lock = threading.Lock()
+
+    def schedule(self, username, turns):
+        """Starts folding if turns are over the trigger and no job is running for this user."""
+        if not turns_to_fold(turns):
+            return False
+        with self._lock:
+            if username in self._in_progress:
+                return False
+            self._in_progress.add(username)
+        self._executor.submit(self._run, username)
+        return True
+
+    def _run(self, username):
+        try:
+            state = self._load_state(username)
+            if state is None:
+                return
+            turns = stored_turns(state)
+            count = turns_to_fold(turns)
+            if not count:
+                return
+            folded = turns[:count]
+            summary = self._summarize(state.get("history_summary", ""), folded)
+            if not summary:
+                return
+
+            # Re-read: the user may have chatted or reset meanwhile. Apply only if the folded turns are
+            # still the oldest ones, and swap out just those; turns added since are kept.
+            applied = False
+            def fold(state):
+                nonlocal applied
+                if state is None or stored_turns(state)[:count] != folded:
+                    return None
+                state["conversation_history"] = stored_turns(state)[count:]
+                state["history_summary"] = summary
+                applied = True
+                return state
+            with self._user_lock(username):
+                self._update_state(username, fold)
+            if not applied:
+                return
+            print(f"✅ Summarized {count} older messages for {username}.")
+        except Exception as e:
+            print(f"❌ Error summarizing history for {username}: {e}")
+        finally:
+            with self._lock:
+                self._in_progress.discard(username)
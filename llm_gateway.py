@@ -0,0 +1,479 @@
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from single_flight import SingleFlight
+
+# One place for every Groq chat completion, with the policies a single slow or failing call needs:
+#
+#   - pooled keep-alive connections (one httpx pool per process, shared by all requests), built
+#     on first use: openai and httpx take most of a second to import, so they stay off app import
+#   - a deadline per call (LLM_DEADLINE_SECONDS), and a shorter budget per attempt on the main model
+#     (LLM_ATTEMPT_TIMEOUT_SECONDS; for streams it bounds the wait for the first token)
+#   - retries with exponential backoff and full jitter on connection errors, 429 and 5xx
+#   - a cheaper fallback model (LLM_FALLBACK_MODEL) when the main one misses its attempt budget,
+#     keeps failing or has its circuit open
+#   - optional hedging (LLM_HEDGE=1): if an attempt is slower than the LLM_HEDGE_PERCENTILE of recent
+#     latencies, a duplicate request is sent and whichever answers first wins
+#   - a circuit breaker per model: after LLM_BREAKER_FAILURES failures in a row, calls skip that model
+#     for LLM_BREAKER_COOLDOWN_SECONDS, then one trial call decides whether it is back
+#   - request coalescing (LLM_COALESCE, on by default): identical calls in flight at the same time
+#     (same model, messages and options) share one upstream request and its result or stream
+#   - admission control (optional, see admission.py): each call that does reach Groq first passes an
+#     AdmissionGate, and holds its slot until the reply (for streams: the first token) arrives; a
+#     saturated gate raises admission.Overloaded without calling Groq
+#
+# Streams are only retried or hedged before their first token; after that the caller owns them.
+
+LLM_DEADLINE_SECONDS = float(os.getenv("LLM_DEADLINE_SECONDS", "20"))
+LLM_ATTEMPT_TIMEOUT_SECONDS = float(os.getenv("LLM_ATTEMPT_TIMEOUT_SECONDS", "8"))
+LLM_CONNECT_TIMEOUT_SECONDS = float(os.getenv("LLM_CONNECT_TIMEOUT_SECONDS", "3"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "0.25"))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "2"))
+LLM_FALLBACK_MODEL = os.getenv("LLM_FALLBACK_MODEL", "llama3-8b-8192")
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0") == "1"
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN_SECONDS = float(os.getenv("LLM_BREAKER_COOLDOWN_SECONDS", "30"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "64"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "32"))
+LLM_COALESCE = os.getenv("LLM_COALESCE", "1") == "1"
+LATENCY_WINDOW = 200
+
+
+class LLMUnavailableError(Exception):
+    """Every model the call was allowed to use failed or ran out of time."""
+
+
+def http_limits():
+    import httpx
+    return httpx.Limits(
+        max_connections=LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=30.0
+    )
+
+def http_timeout(read_seconds):
+    import httpx
+    return httpx.Timeout(read_seconds, connect=LLM_CONNECT_TIMEOUT_SECONDS)
+
+class LazyClient:
+    """Stands in for a client and builds it with factory() on first use (or get())."""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._client = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+        return self._client
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+
+def create_clients(api_key, base_url):
+    """Sync and async OpenAI-compatible clients on pooled connections; retries are left to LLMGateway."""
+    def build_client():
+        import httpx
+        import openai
+        return openai.OpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            max_retries=0,
+            http_client=httpx.Client(limits=http_limits(), timeout=http_timeout(LLM_DEADLINE_SECONDS))
+        )
+
+    def build_async_client():
+        import httpx
+        import openai
+        return openai.AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            max_retries=0,
+            http_client=httpx.AsyncClient(limits=http_limits(), timeout=http_timeout(LLM_DEADLINE_SECONDS))
+        )
+
+    return LazyClient(build_client), LazyClient(build_async_client)
+
+
+def timeout_errors():
+    """Timeouts as raised by the client, by httpx while reading a stream, and by asyncio.wait_for."""
+    import httpx
+    import openai
+    return (openai.APITimeoutError, httpx.TimeoutException, asyncio.TimeoutError, TimeoutError)
+
+
+def is_retryable(error):
+    import httpx
+    import openai
+    if isinstance(error, (openai.APIConnectionError, httpx.TransportError) + timeout_errors()):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker: closed -> open (after max_failures) -> one trial call -> closed or open."""
+
+    def __init__(self, max_failures=LLM_BREAKER_FAILURES, cooldown_seconds=LLM_BREAKER_COOLDOWN_SECONDS):
+        self.max_failures = max_failures
+        self.cooldown_seconds = cooldown_seconds
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.cooldown_seconds else "open"
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_running or (self.opened_at is None and self.failures >= self.max_failures):
+                print(f"❌ LLM circuit opened after {self.failures} failures in a row.")
+                self.opened_at = time.monotonic()
+            self._trial_running = False
+
+    def abandon_trial(self):
+        """The trial call ended without a verdict (cancelled); let the next call try."""
+        with self._lock:
+            self._trial_running = False
+
+
+class LatencyTracker:
+    """Recent successful latencies (seconds), for hedging thresholds and reporting."""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct, min_samples=1):
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < max(min_samples, 1):
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+class _StartedStream:
+    """A stream whose first chunk has arrived; iterating yields that chunk, then the rest."""
+
+    def __init__(self, response, first_chunk, chunks):
+        self.response = response
+        self.first_chunk = first_chunk
+        self.chunks = chunks
+
+    def __iter__(self):
+        if self.first_chunk is not None:
+            yield self.first_chunk
+        yield from self.chunks
+
+    async def __aiter__(self):
+        if self.first_chunk is not None:
+            yield self.first_chunk
+        async for chunk in self.chunks:
+            yield chunk
+
+    def close(self):
+        close = getattr(self.response, "close", None)
+        if close is not None:
+            result = close()
+            if asyncio.iscoroutine(result):
+                asyncio.ensure_future(result)
+
+
+def _close_result(result):
+    if isinstance(result, _StartedStream):
+        result.close()
+
+
+class LLMGateway:
+    """Chat completions through the policies above. complete/stream for sync code, acomplete/astream for asyncio."""
+
+    def __init__(self, client, async_client, model, fallback_model=LLM_FALLBACK_MODEL,
+                 deadline_seconds=LLM_DEADLINE_SECONDS, attempt_timeout_seconds=LLM_ATTEMPT_TIMEOUT_SECONDS,
+                 max_retries=LLM_MAX_RETRIES, hedge=LLM_HEDGE, coalesce=LLM_COALESCE, admission=None):
+        self.client = client
+        self.async_client = async_client
+        self.model = model
+        self.fallback_model = fallback_model or None
+        self.deadline_seconds = deadline_seconds
+        self.attempt_timeout_seconds = attempt_timeout_seconds
+        self.max_retries = max_retries
+        self.hedge = hedge
+        self._breakers = {}
+        self._latencies = {}
+        self._lock = threading.Lock()
+        self._hedge_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm-hedge") if hedge else None
+        self.flight = SingleFlight("llm") if coalesce else None
+        self.admission = admission
+        self.fallbacks_used = 0
+        self.hedges_sent = 0
+
+    def breaker(self, model):
+        with self._lock:
+            return self._breakers.setdefault(model, CircuitBreaker())
+
+    def latency(self, model, kind):
+        with self._lock:
+            return self._latencies.setdefault((model, kind), LatencyTracker())
+
+    # --- Public API ---
+    def complete(self, messages, model=None, fallback=True, deadline=None, **kwargs):
+        """Returns the chat completion response (like client.chat.completions.create)."""
+        def start(use_model, timeout):
+            return self.client.with_options(timeout=http_timeout(timeout)).chat.completions.create(
+                model=use_model, messages=messages, **kwargs
+            )
+        run = lambda: self._admitted(self._run, start, "complete", model, fallback, deadline)
+        if self.flight is None:
+            return run()
+        return self.flight.do(self._flight_key("complete", messages, model, fallback, kwargs), run)
+
+    def stream(self, messages, model=None, fallback=True, deadline=None, **kwargs):
+        """Yields completion chunks (like iterating a stream=True response)."""
+        def start(use_model, timeout):
+            response = self.client.with_options(timeout=http_timeout(timeout)).chat.completions.create(
+                model=use_model, messages=messages, stream=True, **kwargs
+            )
+            chunks = iter(response)
+            return _StartedStream(response, next(chunks, None), chunks)
+        run = lambda: self._admitted(self._run, start, "first_token", model, fallback, deadline)
+        if self.flight is None:
+            yield from run()
+        else:
+            yield from self.flight.share_stream(self._flight_key("stream", messages, model, fallback, kwargs), run)
+
+    async def acomplete(self, messages, model=None, fallback=True, deadline=None, **kwargs):
+        async def start(use_model, timeout):
+            return await self.async_client.with_options(timeout=http_timeout(timeout)).chat.completions.create(
+                model=use_model, messages=messages, **kwargs
+            )
+        run = lambda: self._aadmitted(self._arun, start, "complete", model, fallback, deadline)
+        if self.flight is None:
+            return await run()
+        return await self.flight.ado(self._flight_key("complete", messages, model, fallback, kwargs), run)
+
+    async def astream(self, messages, model=None, fallback=True, deadline=None, **kwargs):
+        async def start(use_model, timeout):
+            response = await self.async_client.with_options(timeout=http_timeout(timeout)).chat.completions.create(
+                model=use_model, messages=messages, stream=True, **kwargs
+            )
+            chunks = response.__aiter__()
+            try:
+                first_chunk = await chunks.__anext__()
+            except StopAsyncIteration:
+                first_chunk = None
+            return _StartedStream(response, first_chunk, chunks)
+        run = lambda: self._aadmitted(self._arun, start, "first_token", model, fallback, deadline)
+        if self.flight is None:
+            started = await run()
+        else:
+            started = self.flight.ashare_stream(self._flight_key("stream", messages, model, fallback, kwargs), run)
+        async for chunk in started:
+            yield chunk
+
+    def stats(self):
+        with self._lock:
+            breakers = dict(self._breakers)
+            latencies = dict(self._latencies)
+        return {
+            "fallbacks_used": self.fallbacks_used,
+            "hedges_sent": self.hedges_sent,
+            "breakers": {model: breaker.state for model, breaker in breakers.items()},
+            "p95_seconds": {f"{model}:{kind}": tracker.percentile(95) for (model, kind), tracker in latencies.items()},
+            "coalescing": self.flight.stats() if self.flight is not None else None,
+        }
+
+    def _flight_key(self, kind, messages, model, fallback, kwargs):
+        # The deadline is left out: joiners get the first caller's, which is already running
+        return json.dumps([kind, model or self.model, fallback, messages, kwargs], sort_keys=True, default=str)
+
+    # --- Policy ---
+    def _admitted(self, run, *args):
+        if self.admission is None:
+            return run(*args)
+        with self.admission.admit():
+            return run(*args)
+
+    async def _aadmitted(self, run, *args):
+        if self.admission is None:
+            return await run(*args)
+        async with self.admission.aadmit():
+            return await run(*args)
+
+    def _candidates(self, model, fallback):
+        model = model or self.model
+        if fallback and self.fallback_model and self.fallback_model != model:
+            return [model, self.fallback_model]
+        return [model]
+
+    def _attempt_timeout(self, model, candidates, remaining):
+        # The main model gets a shorter budget when there's a fallback to leave time for
+        if model == candidates[0] and len(candidates) > 1:
+            return min(self.attempt_timeout_seconds, remaining)
+        return remaining
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+    def _hedge_delay(self, model, kind):
+        if not self.hedge:
+            return None
+        return self.latency(model, kind).percentile(LLM_HEDGE_PERCENTILE, LLM_HEDGE_MIN_SAMPLES)
+
+    def _on_failure(self, model, error):
+        """Records a failed attempt; returns whether to try this model again."""
+        if not is_retryable(error):
+            # Bad request, auth, ...: the service is up, but another attempt or model won't help
+            self.breaker(model).record_success()
+            raise error
+        self.breaker(model).record_failure()
+        print(f"LLM call to {model} failed: {error!r}")
+        # A missed deadline goes straight to the fallback rather than waiting again
+        return not isinstance(error, timeout_errors())
+
+    def _on_success(self, model, kind, started_at, candidates):
+        self.breaker(model).record_success()
+        self.latency(model, kind).add(time.monotonic() - started_at)
+        if model != candidates[0]:
+            self.fallbacks_used += 1
+
+    def _run(self, start, kind, model, fallback, deadline):
+        candidates = self._candidates(model, fallback)
+        deadline_at = time.monotonic() + (deadline or self.deadline_seconds)
+        last_error = None
+        for candidate in candidates:
+            attempt = 0
+            while True:
+                remaining = deadline_at - time.monotonic()
+                if remaining <= 0:
+                    raise LLMUnavailableError("LLM deadline exceeded.") from last_error
+                if not self.breaker(candidate).allow():
+                    break
+                started_at = time.monotonic()
+                try:
+                    result = self._attempt(start, candidate, self._attempt_timeout(candidate, candidates, remaining), kind)
+                except Exception as e:
+                    last_error = e
+                    if not self._on_failure(candidate, e) or attempt >= self.max_retries:
+                        break
+                    attempt += 1
+                    time.sleep(min(self._backoff(attempt), max(0.0, deadline_at - time.monotonic())))
+                    continue
+                self._on_success(candidate, kind, started_at, candidates)
+                return result
+        raise LLMUnavailableError(f"No model available ({', '.join(candidates)}).") from last_error
+
+    def _attempt(self, start, model, timeout, kind):
+        hedge_delay = self._hedge_delay(model, kind)
+        if hedge_delay is None or hedge_delay >= timeout:
+            return start(model, timeout)
+
+        first = self._hedge_executor.submit(start, model, timeout)
+        done, _ = wait([first], timeout=hedge_delay)
+        if done:
+            return first.result()
+        self.hedges_sent += 1
+        second = self._hedge_executor.submit(start, model, max(0.1, timeout - hedge_delay))
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for loser in pending: # Can't interrupt a blocking call; close its result when it lands
+                        loser.add_done_callback(lambda f: f.exception() is None and _close_result(f.result()))
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    async def _arun(self, start, kind, model, fallback, deadline):
+        candidates = self._candidates(model, fallback)
+        deadline_at = time.monotonic() + (deadline or self.deadline_seconds)
+        last_error = None
+        for candidate in candidates:
+            attempt = 0
+            while True:
+                remaining = deadline_at - time.monotonic()
+                if remaining <= 0:
+                    raise LLMUnavailableError("LLM deadline exceeded.") from last_error
+                if not self.breaker(candidate).allow():
+                    break
+                started_at = time.monotonic()
+                try:
+                    result = await self._aattempt(start, candidate, self._attempt_timeout(candidate, candidates, remaining), kind)
+                except asyncio.CancelledError:
+                    self.breaker(candidate).abandon_trial()
+                    raise
+                except Exception as e:
+                    last_error = e
+                    if not self._on_failure(candidate, e) or attempt >= self.max_retries:
+                        break
+                    attempt += 1
+                    await asyncio.sleep(min(self._backoff(attempt), max(0.0, deadline_at - time.monotonic())))
+                    continue
+                self._on_success(candidate, kind, started_at, candidates)
+                return result
+        raise LLMUnavailableError(f"No model available ({', '.join(candidates)}).") from last_error
+
+    async def _aattempt(self, start, model, timeout, kind):
+        # asyncio.wait_for also bounds time spent outside the HTTP read timeout (e.g. a slow first token)
+        hedge_delay = self._hedge_delay(model, kind)
+        if hedge_delay is None or hedge_delay >= timeout:
+            return await asyncio.wait_for(start(model, timeout), timeout)
+
+        first = asyncio.ensure_future(asyncio.wait_for(start(model, timeout), timeout))
+        done, _ = await asyncio.wait({first}, timeout=hedge_delay)
+        if done:
+            return first.result()
+        self.hedges_sent += 1
+        second_timeout = max(0.1, timeout - hedge_delay)
+        second = asyncio.ensure_future(asyncio.wait_for(start(model, second_timeout), second_timeout))
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    for loser in pending:
+                        loser.cancel()
+                    return task.result()
+                error = task.exception()
+        raise error
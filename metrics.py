@@ -0,0 +1,229 @@
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextvars import ContextVar
+from functools import wraps
+
+# Latency instrumentation for the request hot path, exported in Prometheus text format on /metrics.
+#
+#   - span("stage") / @timed("stage") time one stage (stt, groq, edge_tts, log_to_db, ...) into a
+#     per-stage summary; stages may nest (state_machine includes groq when the reply isn't streamed)
+#   - every HTTP request gets a trace: an id sent back as X-Trace-Id, and the spans that ran in the
+#     request's context; requests slower than METRICS_SLOW_REQUEST_SECONDS print their breakdown
+#   - p50/p95/p99 per stage and per endpoint over the last METRICS_WINDOW observations, plus
+#     cumulative counts and sums
+#   - gauges and counters read from other components (sessions, queue depths, caches) at scrape time
+#
+# Numbers are per process: each gunicorn worker reports its own. METRICS=0 turns all of it into
+# no-ops (span() returns a shared null context, @timed returns the function unchanged).
+
+METRICS_ENABLED = os.getenv("METRICS", "1") == "1"
+METRICS_WINDOW = int(os.getenv("METRICS_WINDOW", "1024"))
+METRICS_SLOW_REQUEST_SECONDS = float(os.getenv("METRICS_SLOW_REQUEST_SECONDS", "5"))
+QUANTILES = (0.5, 0.95, 0.99)
+
+_current_trace = ContextVar("current_trace", default=None)
+
+
+class Summary:
+    """Cumulative count and sum, and quantiles over a sliding window of recent observations."""
+
+    def __init__(self, window=METRICS_WINDOW):
+        self._samples = deque(maxlen=window)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self._samples.append(value)
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self):
+        """(quantile values for QUANTILES, count, sum)"""
+        with self._lock:
+            samples = sorted(self._samples)
+            count, total = self.count, self.sum
+        if not samples:
+            return [0.0] * len(QUANTILES), count, total
+        return [samples[min(len(samples) - 1, int(len(samples) * q))] for q in QUANTILES], count, total
+
+
+class Trace:
+    __slots__ = ("trace_id", "endpoint", "started_at", "spans")
+
+    def __init__(self, endpoint):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.endpoint = endpoint
+        self.started_at = time.perf_counter()
+        self.spans = [] # (stage, seconds), in the order they finished
+
+
+class _Span:
+    __slots__ = ("_metrics", "_stage", "_started_at")
+
+    def __init__(self, metrics, stage):
+        self._metrics = metrics
+        self._stage = stage
+
+    def __enter__(self):
+        self._started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._metrics.observe(self._stage, time.perf_counter() - self._started_at)
+        return False
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Metrics:
+    """Stage and endpoint latency summaries, request traces and scrape-time gauges."""
+
+    def __init__(self, enabled=METRICS_ENABLED, slow_request_seconds=METRICS_SLOW_REQUEST_SECONDS):
+        self.enabled = enabled
+        self.slow_request_seconds = slow_request_seconds
+        self._stages = {}
+        self._endpoints = {}
+        self._requests = {} # (endpoint, status) -> count
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    # --- Timing ---
+    def _summary(self, table, key):
+        summary = table.get(key)
+        if summary is None:
+            with self._lock:
+                summary = table.setdefault(key, Summary())
+        return summary
+
+    def observe(self, stage, seconds):
+        """Records a stage duration, and adds it to the current request's trace if there is one."""
+        if not self.enabled:
+            return
+        self._summary(self._stages, stage).observe(seconds)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.spans.append((stage, seconds))
+
+    def span(self, stage):
+        """Context manager timing one stage."""
+        return _Span(self, stage) if self.enabled else _NULL_SPAN
+
+    def timed(self, stage):
+        """Decorator timing every call of a function as one stage."""
+        def decorate(fn):
+            if not self.enabled:
+                return fn
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                with _Span(self, stage):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    # --- Request traces ---
+    def start_trace(self, endpoint):
+        """Starts a trace for the request being handled in the current context and returns it."""
+        trace = Trace(endpoint)
+        _current_trace.set(trace)
+        return trace
+
+    def finish_trace(self, trace, status):
+        seconds = time.perf_counter() - trace.started_at
+        self._summary(self._endpoints, trace.endpoint).observe(seconds)
+        with self._lock:
+            key = (trace.endpoint, str(status))
+            self._requests[key] = self._requests.get(key, 0) + 1
+        if _current_trace.get() is trace:
+            _current_trace.set(None)
+        if seconds >= self.slow_request_seconds:
+            breakdown = ", ".join(f"{stage} {spent:.2f}s" for stage, spent in trace.spans)
+            print(f"❌ Slow request {trace.trace_id} {trace.endpoint}: {seconds:.2f}s ({breakdown or 'no spans'})")
+
+    @staticmethod
+    def current_trace():
+        return _current_trace.get()
+
+    # --- Gauges and counters from other components ---
+    def add_collector(self, name, help_text, collect, label=None, kind="gauge"):
+        """
+        collect() is called at scrape time and returns a number, or {label value: number}
+        when label names the metric's one label. kind is "gauge" or "counter".
+        """
+        self._collectors.append((name, help_text, collect, label, kind))
+
+    def snapshot(self):
+        """{"stages": {stage: (quantiles, count, sum)}, "endpoints": {...}} for reports outside Prometheus."""
+        with self._lock:
+            stages, endpoints = dict(self._stages), dict(self._endpoints)
+        return {
+            "stages": {stage: summary.snapshot() for stage, summary in stages.items()},
+            "endpoints": {endpoint: summary.snapshot() for endpoint, summary in endpoints.items()},
+        }
+
+    # --- Prometheus text exposition ---
+    def render(self):
+        lines = []
+        self._render_summaries(lines, "kitty_stage_seconds", "Time spent in each stage of request handling.", "stage", self._stages)
+        self._render_summaries(lines, "kitty_request_seconds", "HTTP request latency per endpoint.", "endpoint", self._endpoints)
+
+        with self._lock:
+            requests = dict(self._requests)
+        lines.append("# HELP kitty_requests_total HTTP requests handled, per endpoint and status.")
+        lines.append("# TYPE kitty_requests_total counter")
+        for (endpoint, status), count in sorted(requests.items()):
+            lines.append(f'kitty_requests_total{{endpoint="{_escape(endpoint)}",status="{status}"}} {count}')
+
+        for name, help_text, collect, label, kind in self._collectors:
+            try:
+                value = collect()
+                if value is None:
+                    continue
+                if isinstance(value, dict):
+                    samples = [f'{name}{{{label}="{_escape(label_value)}"}} {_number(number)}' for label_value, number in value.items()]
+                else:
+                    samples = [f"{name} {_number(value)}"]
+            except Exception as e:
+                print(f"❌ Error collecting metric {name}: {e}")
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+    def _render_summaries(self, lines, name, help_text, label, table):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} summary")
+        with self._lock:
+            items = sorted(table.items())
+        for key, summary in items:
+            quantiles, count, total = summary.snapshot()
+            key = _escape(key)
+            for q, value in zip(QUANTILES, quantiles):
+                lines.append(f'{name}{{{label}="{key}",quantile="{q}"}} {value:.6f}')
+            lines.append(f'{name}_sum{{{label}="{key}"}} {total:.6f}')
+            lines.append(f'{name}_count{{{label}="{key}"}} {count}')
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value):
+    return f"{value:.6f}" if isinstance(value, float) else str(int(value))
+
+
+metrics = Metrics()
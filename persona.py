@@ -0,0 +1,135 @@
+import json
+import os
+import sys
+import threading
+import time
+from types import MappingProxyType
+
+from phrase_matcher import PhraseMatcher
+from prompt_builder import PromptTemplate
+
+# Kitty's persona: system prompts, custom replies, special users and the Tanglish keywords,
+# kept in a versioned data file (persona.json) instead of app.py.
+#
+# The file is read on first use into a Persona: read-only mappings and tuples with interned
+# strings, plus everything derived from it up front (the compiled PhraseMatcher and the frozen
+# prompt templates). Every PERSONA_RELOAD_SECONDS at most, a request checks whether the file
+# changed and, if so, builds a new Persona and swaps it in. Requests already holding the old one
+# finish with it; sessions live in the session store and are not touched. A file that fails to
+# load is reported and the previous Persona stays in use. PERSONA_RELOAD_SECONDS=0 disables reloading.
+
+PERSONA_PATH = os.getenv("PERSONA_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "persona.json"))
+PERSONA_RELOAD_SECONDS = float(os.getenv("PERSONA_RELOAD_SECONDS", "5"))
+GENERAL_REPLIES_TABLE = "general"
+
+
+def freeze(value):
+    """Read-only copy of parsed JSON: dicts become mappingproxies, lists tuples, strings are interned."""
+    if isinstance(value, dict):
+        return MappingProxyType({sys.intern(k): freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+    if isinstance(value, str):
+        return sys.intern(value)
+    return value
+
+
+class Persona:
+    """One loaded version of the persona file, with its matcher and prompt templates."""
+
+    def __init__(self, data):
+        data = freeze(data)
+        self.version = data.get("version", 0)
+        self.tanglish_keywords = data["tanglish_keywords"]
+        self.system_prompts = data["system_prompts"]
+        self.custom_responses = data["custom_responses"]
+        self.special_users = data["special_users"]
+
+        # Language detection and every custom-reply table, compiled into one matcher
+        self.text_matcher = PhraseMatcher(
+            {GENERAL_REPLIES_TABLE: self.custom_responses,
+             **{username: user["custom_replies"] for username, user in self.special_users.items() if "custom_replies" in user}},
+            self.tanglish_keywords
+        )
+        self.prompt_templates = tuple(PromptTemplate(lang, prompt) for lang, prompt in self.system_prompts.items())
+
+    def special_user(self, username):
+        """The special-user entry for username (lowercase), or an empty mapping."""
+        return self.special_users.get(username, MappingProxyType({}))
+
+    def static_replies(self):
+        """Every fixed reply text in the persona, de-duplicated, in file order."""
+        replies = list(self.custom_responses.values())
+        for user in self.special_users.values():
+            replies.append(user["special_message"])
+            replies += user.get("custom_replies", {}).values()
+        return list(dict.fromkeys(replies))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+
+class PersonaStore:
+    """Holds the current Persona; loads it lazily and reloads it when the file changes."""
+
+    def __init__(self, path=PERSONA_PATH, reload_seconds=PERSONA_RELOAD_SECONDS):
+        self.path = path
+        self.reload_seconds = reload_seconds
+        self._persona = None
+        self._file_stamp = None
+        self._next_check = 0.0
+        self._listeners = []
+        self._lock = threading.Lock()
+        self.reloads = 0
+
+    def on_reload(self, listener):
+        """listener(persona) runs after every load or reload, in the thread that triggered it."""
+        self._listeners.append(listener)
+        if self._persona is not None:
+            listener(self._persona)
+
+    def current(self):
+        persona = self._persona
+        if persona is not None and (self.reload_seconds <= 0 or time.monotonic() < self._next_check):
+            return persona
+        return self._check()
+
+    def _stamp(self):
+        stat = os.stat(self.path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def _check(self):
+        with self._lock:
+            if self._persona is not None and time.monotonic() < self._next_check:
+                return self._persona
+            self._next_check = time.monotonic() + self.reload_seconds
+            try:
+                stamp = self._stamp()
+                if stamp == self._file_stamp:
+                    return self._persona
+                persona = Persona.load(self.path)
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                if self._persona is None:
+                    raise
+                print(f"❌ Could not reload persona from {self.path}, keeping v{self._persona.version}: {e!r}")
+                self._file_stamp = None if isinstance(e, OSError) else stamp
+                return self._persona
+
+            reloaded = self._persona is not None
+            self._persona, self._file_stamp = persona, stamp
+            if reloaded:
+                self.reloads += 1
+            print(f"✅ {'Reloaded' if reloaded else 'Loaded'} persona v{persona.version} from {self.path} "
+                  f"({len(persona.custom_responses)} replies, {len(persona.special_users)} special users).")
+            listeners = list(self._listeners)
+        for listener in listeners:
+            try:
+                listener(persona)
+            except Exception as e:
+                print(f"❌ Error applying reloaded persona: {e}")
+        return persona
+
+
+persona_store = PersonaStore()
@@ -0,0 +1,78 @@
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+# One precompiled scan per message for everything the reply logic looks for in it:
+# the language (Tamil script or Tanglish keywords) and which custom-reply phrases occur,
+# for any number of phrase tables (general replies, each special user's replies).
+#
+# A table's phrases keep their priority: when several occur in a message, the hit is the
+# one listed first, exactly like checking `phrase in text` in table order.
+
+MATCH_CACHE_SIZE = 1024
+TAMIL_SCRIPT_PATTERN = r"[\u0B80-\u0BFF]"
+
+
+class TextMatch(namedtuple("TextMatch", ["lang", "hits"])):
+    """Result of PhraseMatcher.match: lang is 'ta' or 'en', hits is ((table, phrase), ...)."""
+    __slots__ = ()
+
+    def phrase(self, table):
+        """The highest-priority phrase of table found in the text (as written in the table), or None."""
+        for name, phrase in self.hits:
+            if name == table:
+                return phrase
+        return None
+
+
+class PhraseMatcher:
+    """
+    Built once from {table name: phrases in priority order} and the Tanglish keyword list.
+    Phrases match as case-insensitive substrings, keywords as whole words.
+    """
+
+    def __init__(self, tables, language_keywords):
+        self._priority = {} # (table, phrase) -> position in its table
+        owners = {} # lowercased phrase -> [(table, phrase), ...]
+        for table, phrases in tables.items():
+            for position, phrase in enumerate(phrases):
+                if phrase:
+                    self._priority[(table, phrase)] = position
+                    owners.setdefault(phrase.lower(), []).append((table, phrase))
+
+        # Phrases that match at the same spot are prefixes of one another, and the regex only reports
+        # the first alternative that matches there. So alternatives go longest first, and each one
+        # also answers for every shorter phrase that is its prefix.
+        ordered = sorted(owners, key=len, reverse=True)
+        self._hits_for = {
+            phrase: [owner for prefix in ordered if phrase.startswith(prefix) for owner in owners[prefix]]
+            for phrase in ordered
+        }
+        phrase_pattern = "|".join(map(re.escape, ordered)) or "(?!)"
+        keyword_pattern = r"\b(?:" + "|".join(map(re.escape, language_keywords)) + r")\b" if language_keywords else "(?!)"
+
+        # Until the language is settled, one scan looks for both; after that, only for phrases
+        self._scan = re.compile(f"(?=(?P<lang>{TAMIL_SCRIPT_PATTERN}|{keyword_pattern})|(?P<phrase>{phrase_pattern}))")
+        self._phrase_scan = re.compile(f"(?=(?P<phrase>{phrase_pattern}))")
+        self.match = lru_cache(maxsize=MATCH_CACHE_SIZE)(self._match)
+
+    def _match(self, text):
+        lowered = text.lower()
+        lang = "en"
+        found = set()
+        scan = self._scan.finditer(lowered)
+        for m in scan:
+            if m.group("lang") is not None:
+                lang = "ta"
+                scan = self._phrase_scan.finditer(lowered, m.start())
+                break
+            found.update(self._hits_for[m.group("phrase")])
+        if lang == "ta":
+            for m in scan:
+                found.update(self._hits_for[m.group("phrase")])
+
+        best = {}
+        for table, phrase in found:
+            if table not in best or self._priority[(table, phrase)] < self._priority[(table, best[table])]:
+                best[table] = phrase
+        return TextMatch(lang, tuple(best.items()))
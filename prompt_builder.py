@@ -0,0 +1,97 @@
+import threading
+from collections import namedtuple
+
+import history_manager
+
+# Prompt assembly for Groq calls, laid out so consecutive requests share the longest possible prefix:
+#
+#   [system: prompt template]    byte-identical for every request in that language
+#   [system: history summary]    changes only when old turns are folded into it
+#   [user/assistant turns]       append-only between folds
+#   [user: this message]
+#
+# Nothing per-request (time, user name, ...) goes into the first block, so provider-side prefix
+# caching can reuse it. Template token counts are computed once at startup; every build reports
+# where the prompt's input tokens went.
+
+SUMMARY_PREFIX = "Summary of the earlier conversation with this user: "
+
+PromptTokens = namedtuple("PromptTokens", ["template", "summary", "history", "user", "total", "turns_sent", "turns_dropped"])
+Prompt = namedtuple("Prompt", ["messages", "tokens"])
+
+
+class PromptTemplate:
+    """A frozen system message: system prompt plus optional static persona blocks, with its token count."""
+
+    def __init__(self, name, system_prompt, persona_blocks=()):
+        self.name = name
+        self.content = "\n\n".join([system_prompt, *persona_blocks])
+        self.tokens = history_manager.message_tokens({"content": self.content})
+
+    def message(self):
+        # A fresh dict per request (callers may append to the list), always with the same content string
+        return {"role": "system", "content": self.content}
+
+
+class PromptBuilder:
+    """Assembles prompts from templates by name and keeps running totals of prompt tokens per part."""
+
+    def __init__(self, templates, history_budget=history_manager.HISTORY_TOKEN_BUDGET):
+        self.templates = {template.name: template for template in templates}
+        self.history_budget = history_budget
+        self._lock = threading.Lock()
+        self._totals = dict.fromkeys(PromptTokens._fields, 0)
+        self.requests = 0
+
+    def set_templates(self, templates):
+        """Replaces the templates (e.g. after a persona reload); builds already running keep the old ones."""
+        self.templates = {template.name: template for template in templates}
+
+    def build(self, template_name, summary, turns, user_input, templates=None):
+        """
+        Returns Prompt(messages, tokens) for one call; tokens is a PromptTokens breakdown.
+        templates, if given, are looked in instead of the builder's own (e.g. the turn's persona version).
+        """
+        if templates is None:
+            template = self.templates[template_name]
+        else:
+            template = {t.name: t for t in templates}[template_name]
+        messages = [template.message()]
+        budget = self.history_budget
+
+        summary_tokens = 0
+        if summary:
+            summary_message = {"role": "system", "content": SUMMARY_PREFIX + summary}
+            summary_tokens = history_manager.message_tokens(summary_message)
+            messages.append(summary_message)
+            budget -= summary_tokens
+
+        kept = history_manager.fit_turns(turns, budget)
+        messages.extend(kept)
+        user_message = {"role": "user", "content": user_input}
+        messages.append(user_message)
+
+        history_tokens = sum(history_manager.message_tokens(m) for m in kept)
+        user_tokens = history_manager.message_tokens(user_message)
+        tokens = PromptTokens(
+            template=template.tokens,
+            summary=summary_tokens,
+            history=history_tokens,
+            user=user_tokens,
+            total=template.tokens + summary_tokens + history_tokens + user_tokens,
+            turns_sent=len(kept),
+            turns_dropped=len(turns) - len(kept)
+        )
+        self._record(tokens)
+        return Prompt(messages, tokens)
+
+    def _record(self, tokens):
+        with self._lock:
+            self.requests += 1
+            for field, value in tokens._asdict().items():
+                self._totals[field] += value
+
+    def stats(self):
+        """Prompt tokens summed over all requests so far, per part, with the request count."""
+        with self._lock:
+            return {"requests": self.requests, **self._totals}
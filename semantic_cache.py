@@ -0,0 +1,200 @@
+import hashlib
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+# Semantic cache for AI replies: near-duplicate questions ("what's your name" / "what is ur name",
+# "who made you" / "who created you") reuse an earlier Groq answer instead of paying for a new one.
+#
+# Questions are normalized (lowercase, punctuation dropped, common spellings and synonyms folded)
+# and turned into sparse vectors of words and character trigrams. An inverted index over those
+# features finds the most similar cached question; a hit needs cosine >= SEMANTIC_CACHE_THRESHOLD.
+# Entries are partitioned by a fingerprint of everything sent ahead of the question: the system
+# prompt (so the reply language), the user's history summary and the earlier turns. A reply written
+# with one user's history is then only reused for an identical conversation, e.g. a first question
+# after login. SEMANTIC_CACHE_HISTORY_TURNS=N fingerprints only the last N earlier messages instead,
+# sharing more replies at the risk of one that mentions another user's conversation.
+#
+# Questions that lean on the conversation ("why?", "tell me more about it") or are about the user
+# ("what's my name") bypass the cache entirely. Off by default: SEMANTIC_CACHE=1 turns it on.
+# Per process, with TTL expiry and LRU eviction.
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE", "0") == "1"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.9"))
+SEMANTIC_CACHE_TTL_SECONDS = int(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", str(60 * 60)))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "5000"))
+SEMANTIC_CACHE_HISTORY_TURNS = int(os.getenv("SEMANTIC_CACHE_HISTORY_TURNS", "-1")) # -1 = all of them
+
+CANONICAL_WORDS = {
+    "whats": "what is", "what's": "what is", "wats": "what is", "wat": "what", "whos": "who is", "who's": "who is",
+    "u": "you", "ya": "you", "ur": "your", "youre": "you are", "you're": "you are", "r": "are",
+    "made": "created", "built": "created", "build": "create", "developed": "created", "make": "create",
+    "hi": "hello", "hii": "hello", "hey": "hello", "heyy": "hello", "helo": "hello", "hai": "hello", "vanakkam": "hello",
+    "pls": "please", "plz": "please", "thx": "thanks", "thanku": "thanks", "thank": "thanks",
+}
+# Filler that doesn't change what is being asked
+IGNORED_WORDS = {"kitty", "please", "the", "a", "an", "so", "just", "ok", "okay", "hmm"}
+# Questions that only make sense with the conversation so far, or depend on who is asking
+HISTORY_DEPENDENT_PATTERN = re.compile(
+    r"\b(it|its|that|this|those|these|he|she|they|him|her|them|his|their|there|again|more|previous|earlier|"
+    r"before|last|above|continue|same|also|else|why|then|i|me|my|mine|myself|im|i'm|i've|we|us|our)\b"
+)
+WORD_PATTERN = re.compile(r"[\w']+")
+
+
+def normalize_query(text):
+    words = []
+    for word in WORD_PATTERN.findall(text.lower()):
+        word = CANONICAL_WORDS.get(word, word.replace("'", ""))
+        words.extend(w for w in word.split() if w not in IGNORED_WORDS)
+    return " ".join(words)
+
+
+def query_vector(normalized):
+    """Sparse unit vector over whole words and padded character trigrams."""
+    features = {}
+    for word in normalized.split():
+        features["w:" + word] = features.get("w:" + word, 0.0) + 1.0
+        padded = f" {word} "
+        for i in range(len(padded) - 2):
+            gram = padded[i:i + 3]
+            features[gram] = features.get(gram, 0.0) + 0.5
+    norm = math.sqrt(sum(v * v for v in features.values()))
+    return {k: v / norm for k, v in features.items()} if norm else {}
+
+
+def is_history_dependent(text):
+    return bool(HISTORY_DEPENDENT_PATTERN.search(text.lower()))
+
+
+class SemanticCache:
+    """In-process similarity cache of AI replies with an inverted feature index, TTL and LRU eviction."""
+
+    def __init__(self, threshold=SEMANTIC_CACHE_THRESHOLD, ttl_seconds=SEMANTIC_CACHE_TTL_SECONDS,
+                 max_entries=SEMANTIC_CACHE_MAX_ENTRIES, history_turns=SEMANTIC_CACHE_HISTORY_TURNS):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.history_turns = history_turns
+        self._entries = OrderedDict() # entry id -> (partition, normalized, vector, reply, stored_at)
+        self._exact = {} # (partition, normalized) -> entry id
+        self._postings = {} # (partition, feature) -> {entry id: weight}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def _partition(self, conversation_history):
+        """System messages (prompt and summary) and the earlier turns, or the last history_turns of them; a short fingerprint."""
+        parts = [m["content"] for m in conversation_history if m.get("role") == "system"]
+        earlier_turns = [f'{m.get("role")}:{m["content"]}' for m in conversation_history[:-1] if m.get("role") != "system"]
+        if self.history_turns >= 0:
+            earlier_turns = earlier_turns[len(earlier_turns) - self.history_turns:] if self.history_turns else []
+        return hashlib.sha1("\0".join(parts + earlier_turns).encode("utf-8")).hexdigest()[:16]
+
+    def lookup(self, user_input, conversation_history):
+        """
+        Returns a cached reply for a question close enough to user_input, or None.
+        conversation_history is the message list about to be sent (system prompt first, user_input last).
+        """
+        if is_history_dependent(user_input):
+            with self._lock:
+                self.bypassed += 1
+            return None
+        normalized = normalize_query(user_input)
+        if not normalized:
+            return None
+        partition = self._partition(conversation_history)
+
+        with self._lock:
+            entry_id = self._exact.get((partition, normalized))
+            similarity = 1.0
+            if entry_id is None:
+                entry_id, similarity = self._most_similar(partition, query_vector(normalized))
+            entry = self._entries.get(entry_id) if similarity >= self.threshold else None
+            if entry is not None and time.monotonic() - entry[4] > self.ttl_seconds:
+                self._remove(entry_id)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(entry_id)
+            self.hits += 1
+        print(f"✅ Semantic cache hit (similarity {similarity:.2f}): '{user_input}' ~ '{entry[1]}'")
+        return entry[3]
+
+    def store(self, user_input, conversation_history, reply):
+        if not reply or is_history_dependent(user_input):
+            return
+        normalized = normalize_query(user_input)
+        if not normalized:
+            return
+        partition = self._partition(conversation_history)
+        vector = query_vector(normalized)
+
+        with self._lock:
+            old_id = self._exact.get((partition, normalized))
+            if old_id is not None:
+                self._remove(old_id)
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (partition, normalized, vector, reply, time.monotonic())
+            self._exact[(partition, normalized)] = entry_id
+            for feature, weight in vector.items():
+                self._postings.setdefault((partition, feature), {})[entry_id] = weight
+            self.stores += 1
+            self._evict()
+
+    def _most_similar(self, partition, vector):
+        scores = {}
+        for feature, weight in vector.items():
+            for entry_id, entry_weight in self._postings.get((partition, feature), {}).items():
+                scores[entry_id] = scores.get(entry_id, 0.0) + weight * entry_weight
+        if not scores:
+            return None, 0.0
+        return max(scores.items(), key=lambda item: item[1])
+
+    def _remove(self, entry_id):
+        partition, normalized, vector, _, _ = self._entries.pop(entry_id)
+        self._exact.pop((partition, normalized), None)
+        for feature in vector:
+            postings = self._postings.get((partition, feature))
+            if postings is not None:
+                postings.pop(entry_id, None)
+                if not postings:
+                    del self._postings[(partition, feature)]
+
+    def _evict(self):
+        now = time.monotonic()
+        # Least recently used first, so expired entries sit at the front too
+        while self._entries:
+            entry_id, entry = next(iter(self._entries.items()))
+            if len(self._entries) <= self.max_entries and now - entry[4] <= self.ttl_seconds:
+                break
+            self._remove(entry_id)
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+
+semantic_cache = SemanticCache() if SEMANTIC_CACHE_ENABLED else None
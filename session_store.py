@@ -0,0 +1,220 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+# Pluggable storage for per-user session state (wake mode, customization flow, history).
+#
+# Backends (picked with SESSION_BACKEND):
+#   memory - per-process dict with TTL, LRU eviction and a cap on count and approximate size.
+#            Fast, but every gunicorn worker has its own copy: only safe with one worker.
+#   sqlite - one SQLite file (WAL mode) shared by every worker on the machine, with the same
+#            TTL and LRU count cap. Use this to run more than one worker.
+#
+# Both expose get(username) -> dict | None, save(username, state), delete(username), len() and
+# update(username, change): change(state or None) returns the state to save, or None to leave it as is.
+# update is atomic across every process sharing the store; read-modify-write with get/save is not.
+
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", str(6 * 60 * 60)))
+SESSION_MAX_COUNT = int(os.getenv("SESSION_MAX_COUNT", "10000"))
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(64 * 1024 * 1024)))
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", os.path.join(tempfile.gettempdir(), "kitty_sessions.sqlite3"))
+
+
+def _approximate_size(value):
+    """Rough size in bytes of a session state; counts string payloads, which dominate."""
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, dict):
+        return 64 + sum(len(k) + _approximate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return 64 + sum(_approximate_size(v) for v in value)
+    return 16
+
+
+class MemorySessionStore:
+    """In-process session store with TTL expiry and LRU eviction by count and approximate size."""
+
+    def __init__(self, ttl_seconds=SESSION_TTL_SECONDS, max_count=SESSION_MAX_COUNT, max_bytes=SESSION_MAX_BYTES):
+        self.ttl_seconds = ttl_seconds
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self._sessions = OrderedDict() # username -> (state, size, last_used)
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, username):
+        """Returns the live state dict (not a copy), or None if missing or expired."""
+        with self._lock:
+            entry = self._sessions.get(username)
+            if entry is None:
+                return None
+            state, size, last_used = entry
+            now = time.monotonic()
+            if now - last_used > self.ttl_seconds:
+                self._remove(username)
+                return None
+            self._sessions[username] = (state, size, now)
+            self._sessions.move_to_end(username)
+            return state
+
+    def save(self, username, state):
+        size = _approximate_size(state)
+        with self._lock:
+            if username in self._sessions:
+                self._remove(username)
+            self._sessions[username] = (state, size, time.monotonic())
+            self._total_bytes += size
+            self._evict()
+
+    def update(self, username, change):
+        """Applies change to the current state (None if missing) under the store lock. Returns the new state."""
+        with self._lock:
+            entry = self._sessions.get(username)
+            state = entry[0] if entry and time.monotonic() - entry[2] <= self.ttl_seconds else None
+            new_state = change(state)
+            if new_state is None:
+                return state
+            if entry is not None:
+                self._remove(username)
+            size = _approximate_size(new_state)
+            self._sessions[username] = (new_state, size, time.monotonic())
+            self._total_bytes += size
+            self._evict()
+            return new_state
+
+    def delete(self, username):
+        with self._lock:
+            if username in self._sessions:
+                self._remove(username)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _remove(self, username):
+        _, size, _ = self._sessions.pop(username)
+        self._total_bytes -= size
+
+    def _evict(self):
+        now = time.monotonic()
+        # Expired sessions sit at the front, since the order is least recently used first
+        while self._sessions:
+            username, (_, _, last_used) = next(iter(self._sessions.items()))
+            if now - last_used <= self.ttl_seconds and \
+               len(self._sessions) <= self.max_count and self._total_bytes <= self.max_bytes:
+                break
+            self._remove(username)
+
+
+class SQLiteSessionStore:
+    """Session store in a shared SQLite file, so every worker process sees the same sessions."""
+
+    def __init__(self, path=SESSION_DB_PATH, ttl_seconds=SESSION_TTL_SECONDS, max_count=SESSION_MAX_COUNT):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_count = max_count
+        self._local = threading.local()
+        self._saves = 0
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " username TEXT PRIMARY KEY,"
+            " state TEXT NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+        conn.commit()
+
+    def _conn(self):
+        # One connection per thread (and per process: connections must not cross a fork)
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, username):
+        """Returns a copy of the stored state, or None if missing or expired. Changes need save()."""
+        row = self._conn().execute(
+            "SELECT state FROM sessions WHERE username = ? AND updated_at > ?",
+            (username, time.time() - self.ttl_seconds)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, username, state):
+        conn = self._conn()
+        with conn:
+            self._write(conn, username, state)
+        self._saves += 1
+        if self._saves % 100 == 0:
+            self._evict()
+
+    def _write(self, conn, username, state):
+        conn.execute(
+            "INSERT INTO sessions (username, state, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(username) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+            (username, json.dumps(state, ensure_ascii=False), time.time())
+        )
+
+    def update(self, username, change):
+        """
+        Applies change to the current state (None if missing) in one write transaction, so a save
+        from another worker can't land between the read and the write. Returns the new state.
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE") # Takes the write lock before reading
+        try:
+            row = conn.execute(
+                "SELECT state FROM sessions WHERE username = ? AND updated_at > ?",
+                (username, time.time() - self.ttl_seconds)
+            ).fetchone()
+            state = json.loads(row[0]) if row else None
+            new_state = change(state)
+            if new_state is not None:
+                self._write(conn, username, new_state)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        if new_state is None:
+            return state
+        self._saves += 1
+        if self._saves % 100 == 0:
+            self._evict()
+        return new_state
+
+    def delete(self, username):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM sessions WHERE username = ?", (username,))
+
+    def __len__(self):
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM sessions WHERE updated_at > ?", (time.time() - self.ttl_seconds,)
+        ).fetchone()[0]
+
+    def _evict(self):
+        """Drops expired sessions, then the least recently saved ones beyond max_count."""
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM sessions WHERE updated_at <= ?", (time.time() - self.ttl_seconds,))
+            conn.execute(
+                "DELETE FROM sessions WHERE username IN ("
+                " SELECT username FROM sessions ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_count,)
+            )
+
+
+def create_session_store(backend=SESSION_BACKEND):
+    if backend == "sqlite":
+        return SQLiteSessionStore()
+    if backend == "memory":
+        return MemorySessionStore()
+    raise ValueError(f"Unknown SESSION_BACKEND: {backend!r} (expected 'memory' or 'sqlite')")
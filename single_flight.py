@@ -0,0 +1,220 @@
+import asyncio
+import threading
+
+# Request coalescing ("single flight"): while a call for some key is in progress, identical calls
+# don't start their own; they wait for it and get the same result (or the same exception).
+# Used for Groq completions (key: model + full prompt) and TTS (key: voice + text), so a burst of
+# identical work after a deploy or cold start costs one upstream call.
+#
+# Streams are shared too: every caller gets the whole stream from the first chunk, and whoever
+# is reading furthest ahead pulls the next chunk from upstream for everyone.
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key, for threads (do, share_stream) and asyncio (ado, ashare_stream)."""
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._streams = {}
+        self._lock = threading.Lock()
+        self.leaders = 0 # Calls that went upstream
+        self.coalesced = 0 # Calls that shared another's result
+
+    def _count(self, leader):
+        if leader:
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+
+    def do(self, key, fn):
+        """Returns fn(), or the result of an identical call already in progress."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            self._count(leader)
+
+        if not leader:
+            call.done.wait()
+        else:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    async def ado(self, key, coro_fn):
+        """Async do(): awaits coro_fn() or joins an identical call already in progress on this event loop."""
+        loop = asyncio.get_running_loop()
+        loop_key = (id(loop), key)
+        with self._lock:
+            task = self._calls.get(loop_key)
+            leader = task is None
+            if leader:
+                # Its own task, so one caller giving up doesn't cancel the call for the others
+                task = self._calls[loop_key] = loop.create_task(coro_fn())
+                task.add_done_callback(lambda _: self._forget(self._calls, loop_key, task))
+            self._count(leader)
+        return await asyncio.shield(task)
+
+    def share_stream(self, key, open_stream):
+        """Iterates open_stream() (returns an iterable), shared with an identical stream in progress."""
+        stream = self._join(self._streams, key, lambda: _SharedStream(open_stream))
+        return stream.reader(lambda: self._forget(self._streams, key, stream))
+
+    def ashare_stream(self, key, open_stream):
+        """Async share_stream(): open_stream is a coroutine function returning an async iterable."""
+        loop_key = (id(asyncio.get_running_loop()), key)
+        stream = self._join(self._streams, loop_key, lambda: _AsyncSharedStream(open_stream))
+        return stream.reader(lambda: self._forget(self._streams, loop_key, stream))
+
+    def _join(self, table, key, create):
+        with self._lock:
+            stream = table.get(key)
+            leader = stream is None or not stream.joinable()
+            if leader:
+                stream = table[key] = create()
+            stream.readers += 1
+            self._count(leader)
+            return stream
+
+    def _forget(self, table, key, value):
+        with self._lock:
+            if table.get(key) is value:
+                del table[key]
+
+    def stats(self):
+        with self._lock:
+            return {"leaders": self.leaders, "coalesced": self.coalesced, "in_flight": len(self._calls) + len(self._streams)}
+
+
+class _SharedStream:
+    """Buffers a stream's items so several readers can each iterate it from the start."""
+
+    def __init__(self, open_stream):
+        self._open_stream = open_stream
+        self._opened = None
+        self._source = None
+        self._items = []
+        self._finished = False
+        self._error = None
+        self._lock = threading.Lock()
+        self.readers = 0
+
+    def joinable(self):
+        return not self._finished
+
+    def reader(self, forget):
+        index = 0
+        try:
+            while True:
+                if index < len(self._items):
+                    yield self._items[index]
+                    index += 1
+                    continue
+                with self._lock: # The reader that gets here first pulls the next item for everyone
+                    if index < len(self._items):
+                        continue
+                    if self._finished:
+                        if self._error is not None:
+                            raise self._error
+                        return
+                    try:
+                        if self._source is None:
+                            self._opened = self._open_stream()
+                            self._source = iter(self._opened)
+                        self._items.append(next(self._source))
+                    except StopIteration:
+                        self._finish(forget)
+                    except Exception as e:
+                        self._error = e
+                        self._finish(forget)
+        finally:
+            self._leave(forget)
+
+    def _finish(self, forget):
+        self._finished = True
+        forget()
+
+    def _leave(self, forget):
+        with self._lock:
+            self.readers -= 1
+            if self.readers > 0 or self._finished:
+                return
+            # Everyone stopped reading: release the upstream stream instead of leaving it half-read
+            self._error = RuntimeError("Shared stream abandoned by all readers.")
+            self._finish(forget)
+            self._close()
+
+    def _close(self):
+        close = getattr(self._opened, "close", None)
+        if close is not None:
+            close()
+
+
+class _AsyncSharedStream(_SharedStream):
+    """
+    On asyncio the next item is pulled by a separate task that every reader awaits (shielded),
+    so a reader that is cancelled mid-pull (client went away) doesn't break the stream for the rest.
+    """
+
+    def __init__(self, open_stream):
+        super().__init__(open_stream)
+        self._pull_task = None
+
+    async def reader(self, forget):
+        index = 0
+        try:
+            while True:
+                if index < len(self._items):
+                    yield self._items[index]
+                    index += 1
+                    continue
+                if self._finished:
+                    if self._error is not None:
+                        raise self._error
+                    return
+                if self._pull_task is None:
+                    self._pull_task = asyncio.ensure_future(self._pull(forget))
+                await asyncio.shield(self._pull_task)
+        finally:
+            self._leave(forget)
+
+    async def _pull(self, forget):
+        try:
+            if self._source is None:
+                self._opened = await self._open_stream()
+                self._source = self._opened.__aiter__()
+            self._items.append(await self._source.__anext__())
+        except StopAsyncIteration:
+            self._finish(forget)
+        except Exception as e:
+            self._error = e
+            self._finish(forget)
+        finally:
+            self._pull_task = None
+
+    def _close(self):
+        if self._pull_task is not None:
+            self._pull_task.cancel()
+        close = getattr(self._opened, "aclose", None) or getattr(self._opened, "close", None)
+        if close is not None:
+            result = close()
+            if asyncio.iscoroutine(result):
+                asyncio.ensure_future(result)
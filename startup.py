@@ -0,0 +1,73 @@
+import importlib
+import os
+import threading
+import time
+
+# Worker startup: what has to happen before a worker should get traffic, and whether it has.
+#
+# Importing app.py only does cheap work. The heavy modules (openai/httpx, edge_tts,
+# speech_recognition, PyAV) are imported where they are first used, and the database schema check
+# runs once per deployment (see db_logger.ensure_schema). Right after import, warm-ups load all of
+# it in background threads, so:
+#
+#   /healthz  (liveness)   answers as soon as the worker serves HTTP; failing it means restart me
+#   /readyz   (readiness)  503 until every required warm-up has finished, then 200; point the
+#                          platform's health check here so new workers only get traffic when warm
+#
+# LAZY_STARTUP=0 runs the warm-ups inline while app.py is imported instead (slow boot, but the
+# first request never pays for an import).
+
+LAZY_STARTUP = os.getenv("LAZY_STARTUP", "1") == "1"
+
+
+class Startup:
+    """Runs warm-ups and tracks them: {name: pending / ready / failed, how long it took, whether it's required}."""
+
+    def __init__(self, lazy=LAZY_STARTUP):
+        self.lazy = lazy
+        self.started_at = time.monotonic()
+        self._checks = {}
+        self._lock = threading.Lock()
+
+    def warm_up(self, name, fn, required=True):
+        """
+        Runs fn() in a background thread (inline if not lazy). While a required warm-up is pending,
+        or if it failed, the worker is not ready. Errors are printed, never raised.
+        """
+        with self._lock:
+            self._checks[name] = {"state": "pending", "required": required, "seconds": None}
+
+        def run():
+            started_at = time.perf_counter()
+            try:
+                fn()
+                state, error = "ready", None
+            except Exception as e:
+                state, error = "failed", repr(e)
+                print(f"❌ Startup warm-up '{name}' failed: {e}")
+            with self._lock:
+                self._checks[name].update(state=state, seconds=round(time.perf_counter() - started_at, 3))
+                if error:
+                    self._checks[name]["error"] = error
+
+        if self.lazy:
+            threading.Thread(target=run, name=f"warm-up-{name}", daemon=True).start()
+        else:
+            run()
+
+    def preload(self, name, *modules, required=True):
+        """A warm-up that only imports modules."""
+        self.warm_up(name, lambda: [importlib.import_module(module) for module in modules], required)
+
+    def status(self):
+        """(ready, {name: check}) for the readiness endpoint."""
+        with self._lock:
+            checks = {name: dict(check) for name, check in self._checks.items()}
+        ready = all(check["state"] == "ready" for check in checks.values() if check["required"])
+        return ready, checks
+
+    def uptime(self):
+        return time.monotonic() - self.started_at
+
+
+startup = Startup()
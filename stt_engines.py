@@ -0,0 +1,245 @@
+import abc
+import importlib
+import json
+import os
+import threading
+
+from admission import stt_gate
+from metrics import metrics
+
+# Pluggable speech-to-text backends.
+#
+#   google - Google Web Speech API through speech_recognition (network call, rate limited).
+#   vosk   - Offline recognition on the CPU with a Vosk model. The model is loaded once per
+#            process and shared by all requests. Optional: `pip install vosk` and download a
+#            model (https://alphacephei.com/vosk/models), then point VOSK_MODEL_PATH at it.
+#
+# speech_recognition is imported on first use (warm_up_engines() does it at startup, off the import path).
+#
+# STT_BACKENDS is the fallback chain, tried in order until one returns a result,
+# e.g. "vosk,google". A request can ask for a specific backend first.
+
+STT_BACKENDS = [name.strip() for name in os.getenv("STT_BACKENDS", "google").split(",") if name.strip()]
+VOSK_MODEL_PATH = os.getenv("VOSK_MODEL_PATH", "models/vosk-model-small-en-in-0.4")
+VOSK_SAMPLE_RATE = 16000
+
+
+class STTUnavailableError(Exception):
+    """The backend could not be used (missing package/model, network or service error)."""
+
+
+class STTEngine(abc.ABC):
+    name = ""
+
+    @abc.abstractmethod
+    def transcribe(self, audio):
+        """
+        Returns the text in audio (an sr.AudioData).
+        Raises sr.UnknownValueError if no speech was recognized, STTUnavailableError if the backend failed.
+        """
+
+    def warm_up(self):
+        """Loads anything expensive ahead of the first request. No-op by default."""
+
+    def open_stream(self):
+        """
+        Returns a recognizer fed with PCM while the user is still speaking (see VoskSTTStream),
+        or None if this backend only transcribes finished recordings.
+        """
+        return None
+
+
+class GoogleSTTEngine(STTEngine):
+    name = "google"
+
+    def warm_up(self):
+        importlib.import_module("speech_recognition")
+
+    def transcribe(self, audio):
+        import speech_recognition as sr
+        recognizer = sr.Recognizer()
+        try:
+            return recognizer.recognize_google(audio)
+        except sr.RequestError as e:
+            raise STTUnavailableError(f"Google Speech Recognition request failed: {e}") from e
+
+
+class VoskSTTEngine(STTEngine):
+    name = "vosk"
+
+    def __init__(self, model_path=VOSK_MODEL_PATH):
+        self.model_path = model_path
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _get_model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    try:
+                        import vosk
+                    except ImportError as e:
+                        raise STTUnavailableError("The 'vosk' package is not installed.") from e
+                    if not os.path.isdir(self.model_path):
+                        raise STTUnavailableError(f"Vosk model not found at {self.model_path}.")
+                    vosk.SetLogLevel(-1)
+                    self._model = vosk.Model(self.model_path)
+                    print(f"✅ Vosk model loaded from {self.model_path}.")
+        return self._model
+
+    def warm_up(self):
+        try:
+            self._get_model()
+        except STTUnavailableError as e:
+            print(f"❌ Vosk warm-up skipped: {e}")
+
+    def transcribe(self, audio):
+        model = self._get_model() # Raises STTUnavailableError if vosk or the model is missing
+        import vosk
+        recognizer = vosk.KaldiRecognizer(model, VOSK_SAMPLE_RATE)
+        recognizer.AcceptWaveform(audio.get_raw_data(convert_rate=VOSK_SAMPLE_RATE, convert_width=2))
+        text = json.loads(recognizer.FinalResult()).get("text", "")
+        if not text:
+            import speech_recognition as sr
+            raise sr.UnknownValueError()
+        return text
+
+    def open_stream(self):
+        model = self._get_model()
+        import vosk
+        return VoskSTTStream(vosk.KaldiRecognizer(model, VOSK_SAMPLE_RATE))
+
+
+class VoskSTTStream:
+    """Incremental Vosk recognition over 16 kHz mono s16 PCM, fed as it arrives."""
+
+    name = VoskSTTEngine.name
+
+    def __init__(self, recognizer):
+        self._recognizer = recognizer
+        self._final_parts = [] # Text of the segments Vosk has already closed
+
+    def accept(self, pcm):
+        """Feeds PCM and returns the best guess so far for everything heard."""
+        if self._recognizer.AcceptWaveform(bytes(pcm)):
+            self._final_parts.append(json.loads(self._recognizer.Result()).get("text", ""))
+            partial = ""
+        else:
+            partial = json.loads(self._recognizer.PartialResult()).get("partial", "")
+        return " ".join(part for part in self._final_parts + [partial] if part)
+
+    def finish(self):
+        """Returns the final text ("" if no speech was recognized)."""
+        self._final_parts.append(json.loads(self._recognizer.FinalResult()).get("text", ""))
+        return " ".join(part for part in self._final_parts if part)
+
+
+ENGINE_CLASSES = {
+    GoogleSTTEngine.name: GoogleSTTEngine,
+    VoskSTTEngine.name: VoskSTTEngine,
+}
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(name):
+    """Returns the shared engine instance for a backend name."""
+    if name not in ENGINE_CLASSES:
+        raise ValueError(f"Unknown STT backend: {name!r}")
+    engine = _engines.get(name)
+    if engine is None:
+        with _engines_lock:
+            engine = _engines.setdefault(name, ENGINE_CLASSES[name]())
+    return engine
+
+
+def backend_chain(preferred=None):
+    """The configured fallback chain, with the preferred backend (if valid) moved to the front."""
+    chain = [name for name in STT_BACKENDS if name in ENGINE_CLASSES] or [GoogleSTTEngine.name]
+    if preferred in ENGINE_CLASSES:
+        chain = [preferred] + [name for name in chain if name != preferred]
+    return chain
+
+
+@metrics.timed("stt")
+def transcribe(audio, preferred=None):
+    """
+    Runs audio through the backend chain. Falls through to the next backend only when one fails;
+    if a backend hears no speech, that's the answer. Returns "" when nothing was recognized.
+    Raises admission.Overloaded, without transcribing, when the STT gate is saturated.
+    """
+    import speech_recognition as sr
+    with stt_gate.admit():
+        for name in backend_chain(preferred):
+            try:
+                text = get_engine(name).transcribe(audio)
+                print(f"Transcribed ({name}): {text}")
+                return text
+            except sr.UnknownValueError:
+                print(f"Speech Recognition ({name}) could not understand audio.")
+                return ""
+            except STTUnavailableError as e:
+                print(f"STT backend '{name}' unavailable, trying next; {e}")
+            except Exception as e:
+                print(f"Error during transcription with '{name}': {e}")
+        return ""
+
+
+class AdmittedSTTStream:
+    """
+    An incremental recognizer holding an STT gate slot: it works on the CPU for the whole utterance,
+    so it counts as one call in flight until finish() or close() gives the slot back.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+        self.name = stream.name
+        self._released = False
+        self._lock = threading.Lock()
+
+    def accept(self, pcm):
+        return self._stream.accept(pcm)
+
+    def finish(self):
+        try:
+            return self._stream.finish()
+        finally:
+            self.close()
+
+    def close(self):
+        """Gives the gate slot back; safe to call more than once, and while accept() runs."""
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        stt_gate.release()
+
+
+def open_stream(preferred=None):
+    """
+    Opens an incremental recognizer on the first usable backend of the chain, or returns None
+    if that backend only handles finished recordings (then transcribe() runs at the end).
+    The recognizer is admitted through the STT gate like transcribe() (see AdmittedSTTStream);
+    raises admission.Overloaded when the gate is saturated.
+    """
+    stt_gate.acquire()
+    for name in backend_chain(preferred):
+        try:
+            stream = get_engine(name).open_stream()
+        except STTUnavailableError as e:
+            print(f"STT backend '{name}' unavailable for streaming, trying next; {e}")
+            continue
+        except Exception as e:
+            print(f"Error opening a streaming recognizer with '{name}': {e}")
+            continue
+        if stream is not None:
+            return AdmittedSTTStream(stream)
+        break
+    stt_gate.release()
+    return None
+
+
+def warm_up_engines():
+    """Loads local models for every configured backend, so the first voice turn doesn't pay for it."""
+    for name in backend_chain():
+        get_engine(name).warm_up()
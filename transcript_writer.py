@@ -0,0 +1,112 @@
+import atexit
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+# Buffered, rotating chat transcript (replaces appending to chat_history.txt on every turn).
+#
+# Entries are kept in memory and written out in batches: when TRANSCRIPT_BATCH_SIZE entries
+# are waiting, every TRANSCRIPT_FLUSH_SECONDS from a background thread, and at exit.
+# Each process writes its own JSON Lines file, so gunicorn workers never interleave writes:
+#     transcripts/chat_history-<YYYY-MM-DD>-<pid>.jsonl
+# A new file is started every day, and when a file grows past TRANSCRIPT_MAX_BYTES it
+# rolls over to chat_history-<date>-<pid>.1.jsonl, .2.jsonl, ...
+
+TRANSCRIPT_DIR = os.getenv("TRANSCRIPT_DIR", "transcripts")
+TRANSCRIPT_BATCH_SIZE = int(os.getenv("TRANSCRIPT_BATCH_SIZE", "20"))
+TRANSCRIPT_FLUSH_SECONDS = float(os.getenv("TRANSCRIPT_FLUSH_SECONDS", "2.0"))
+TRANSCRIPT_MAX_BYTES = int(os.getenv("TRANSCRIPT_MAX_BYTES", str(10 * 1024 * 1024)))
+
+
+class TranscriptWriter:
+    """Per-process, batched JSONL transcript with daily and size-based rotation."""
+
+    def __init__(self, directory=TRANSCRIPT_DIR, batch_size=TRANSCRIPT_BATCH_SIZE,
+                 flush_seconds=TRANSCRIPT_FLUSH_SECONDS, max_bytes=TRANSCRIPT_MAX_BYTES):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_bytes = max_bytes
+        self._buffer = []
+        self._lock = threading.Lock() # Guards _buffer
+        self._write_lock = threading.Lock() # Serializes file writes and rotation
+        self._flusher = None
+        self._flusher_pid = None
+        self._base = None
+        self._path = None
+        self._part = 0
+
+    def write(self, username, query, reply):
+        """Buffers one turn; flushes in the calling thread once a full batch is waiting."""
+        self._ensure_flusher()
+        entry = {
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "username": username,
+            "query": query,
+            "reply": reply
+        }
+        with self._lock:
+            self._buffer.append(entry)
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            self.flush()
+
+    def pending(self):
+        with self._lock:
+            return len(self._buffer)
+
+    def flush(self):
+        with self._lock:
+            entries, self._buffer = self._buffer, []
+        if not entries:
+            return
+        data = "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries).encode("utf-8")
+        with self._write_lock:
+            try:
+                path = self._current_path(len(data))
+                with open(path, "ab") as f:
+                    f.write(data) # One write per batch
+            except OSError as e:
+                print(f"❌ Transcript write error: {e}")
+
+    def _current_path(self, incoming_bytes):
+        date = datetime.now().strftime("%Y-%m-%d")
+        base = os.path.join(self.directory, f"chat_history-{date}-{os.getpid()}")
+        if base != self._base: # First write, new day, or new process after a fork
+            os.makedirs(self.directory, exist_ok=True)
+            self._base = base
+            self._part = 0
+            self._path = base + ".jsonl"
+        try:
+            size = os.path.getsize(self._path)
+        except FileNotFoundError:
+            size = 0
+        while size and size + incoming_bytes > self.max_bytes:
+            self._part += 1
+            self._path = f"{base}.{self._part}.jsonl"
+            try:
+                size = os.path.getsize(self._path)
+            except FileNotFoundError:
+                size = 0
+        return self._path
+
+    def _ensure_flusher(self):
+        if self._flusher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher = threading.Thread(target=self._flush_periodically, name="transcript-flusher", daemon=True)
+            self._flusher.start()
+            self._flusher_pid = os.getpid()
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            self.flush()
+
+
+transcript_writer = TranscriptWriter()
+atexit.register(transcript_writer.flush)
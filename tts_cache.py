@@ -0,0 +1,153 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+# Content-addressed cache for synthesized speech, keyed by (voice, emoji-stripped text).
+# A lot of what Kitty says is fixed text (wake reply, goodbye, custom replies), so a hit
+# skips the edge_tts round trip entirely.
+#
+# Two tiers:
+#   - memory: per-process LRU, bounded by total audio bytes
+#   - disk:   one file per entry in a directory shared by all workers, bounded by total size;
+#             the least recently used files (by mtime, refreshed on every hit) are evicted first
+
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "kitty_tts_cache"))
+TTS_CACHE_MEMORY_MAX_BYTES = int(os.getenv("TTS_CACHE_MEMORY_MAX_BYTES", str(32 * 1024 * 1024)))
+TTS_CACHE_DISK_MAX_BYTES = int(os.getenv("TTS_CACHE_DISK_MAX_BYTES", str(256 * 1024 * 1024)))
+
+
+def tts_cache_key(voice, text):
+    return hashlib.sha256(f"{voice}\0{text}".encode("utf-8")).hexdigest()
+
+
+class TTSCache:
+    """Two-tier (memory LRU + shared disk) cache of synthesized audio chunks."""
+
+    def __init__(self, directory=TTS_CACHE_DIR, memory_max_bytes=TTS_CACHE_MEMORY_MAX_BYTES,
+                 disk_max_bytes=TTS_CACHE_DISK_MAX_BYTES):
+        self.directory = directory
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self._memory = OrderedDict() # key -> tuple of audio chunks
+        self._memory_bytes = 0
+        self._disk_bytes_estimate = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if self.disk_max_bytes > 0:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def _disk_path(self, key):
+        return os.path.join(self.directory, key + ".mp3")
+
+    def get(self, voice, text, count=True):
+        """
+        Returns the cached audio chunks for (voice, text), or None on a miss.
+        count=False leaves the hit/miss counters alone, for a second look within the same lookup.
+        """
+        key = tts_cache_key(voice, text)
+        with self._lock:
+            chunks = self._memory.get(key)
+            if chunks is not None:
+                self._memory.move_to_end(key)
+                self.hits += count
+                return list(chunks)
+
+        chunks = self._read_disk(key)
+        with self._lock:
+            if chunks is None:
+                self.misses += count
+                return None
+            self.hits += count
+        self._remember(key, chunks)
+        return list(chunks)
+
+    def put(self, voice, text, chunks):
+        """Stores freshly synthesized audio chunks in both tiers."""
+        key = tts_cache_key(voice, text)
+        chunks = tuple(chunks)
+        self._remember(key, chunks)
+        self._write_disk(key, chunks)
+
+    def _remember(self, key, chunks):
+        size = sum(len(chunk) for chunk in chunks)
+        if size > self.memory_max_bytes:
+            return
+        with self._lock:
+            previous = self._memory.pop(key, None)
+            if previous is not None:
+                self._memory_bytes -= sum(len(chunk) for chunk in previous)
+            self._memory[key] = chunks
+            self._memory_bytes += size
+            while self._memory_bytes > self.memory_max_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= sum(len(chunk) for chunk in evicted)
+
+    def _read_disk(self, key):
+        if self.disk_max_bytes <= 0:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path) # Mark as recently used for eviction
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            print(f"❌ TTS cache read error: {e}")
+            return None
+        return (data,)
+
+    def _write_disk(self, key, chunks):
+        if self.disk_max_bytes <= 0:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.part"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.writelines(chunks)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"❌ TTS cache write error: {e}")
+            return
+
+        size = sum(len(chunk) for chunk in chunks)
+        with self._lock:
+            if self._disk_bytes_estimate is not None:
+                self._disk_bytes_estimate += size
+            needs_eviction = self._disk_bytes_estimate is None or self._disk_bytes_estimate > self.disk_max_bytes
+        if needs_eviction:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        """Deletes least recently used files until the directory fits in disk_max_bytes."""
+        try:
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".mp3"):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        except OSError as e:
+            print(f"❌ TTS cache eviction error: {e}")
+            return
+
+        total = sum(size for _, size, _ in entries)
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass # Another worker evicted it first
+            total -= size
+        with self._lock:
+            self._disk_bytes_estimate = total
+
+
+tts_cache = TTSCache()
@@ -0,0 +1,91 @@
+import contextvars
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# The stages of one conversation turn, run as a small dependency graph on a shared worker pool.
+#
+# A voice turn used to be one straight line: transcribe, state machine, log, synthesize. Only some
+# of those depend on each other:
+#
+#   stt ──────┐
+#             ├── reply ──┬── tts         (needed for the response)
+#   session ──┘           └── log         (background: finishes after the response is sent)
+#
+# A stage starts as soon as the stages it depends on have finished, and gets their results as
+# arguments. Background stages are fire-and-forget: nothing waits for them and their errors are
+# printed, not raised. Stages run in a copy of the caller's context, so their metrics spans still
+# land in the request's trace.
+
+TURN_WORKERS = int(os.getenv("TURN_WORKERS", "16"))
+
+turn_executor = ThreadPoolExecutor(max_workers=TURN_WORKERS, thread_name_prefix="turn")
+
+
+def _report_background_error(name):
+    def report(future):
+        if future.exception() is not None:
+            print(f"❌ Background stage '{name}' failed: {future.exception()}")
+    return report
+
+
+def run_in_background(name, fn, *args):
+    """Runs fn(*args) on the turn pool without waiting for it; for side effects like logging."""
+    context = contextvars.copy_context()
+    future = turn_executor.submit(context.run, fn, *args)
+    future.add_done_callback(_report_background_error(name))
+    return future
+
+
+class TurnGraph:
+    """The stages of one turn. stage() schedules a stage; result() waits for one."""
+
+    def __init__(self, executor=turn_executor):
+        self._executor = executor
+        self._stages = {}
+
+    def stage(self, name, fn, after=(), background=False):
+        """
+        Schedules fn(*results of the stages named in after) once those have finished, and returns
+        its Future. If one of them failed, this stage fails with the same error without running.
+        """
+        future = Future()
+        self._stages[name] = future
+        dependencies = [self._stages[dependency] for dependency in after]
+        context = contextvars.copy_context()
+        if background:
+            future.add_done_callback(_report_background_error(name))
+
+        def run(args):
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(context.run(fn, *args))
+                except BaseException as e:
+                    future.set_exception(e)
+
+        def start():
+            failed = next((d for d in dependencies if d.exception() is not None), None)
+            if failed is not None:
+                future.set_exception(failed.exception())
+            else:
+                self._executor.submit(run, [d.result() for d in dependencies])
+
+        # The last dependency to finish starts the stage
+        waiting = [len(dependencies)]
+        lock = threading.Lock()
+
+        def dependency_done(_):
+            with lock:
+                waiting[0] -= 1
+                ready = waiting[0] == 0
+            if ready:
+                start()
+
+        if not dependencies:
+            start()
+        for dependency in dependencies:
+            dependency.add_done_callback(dependency_done)
+        return future
+
+    def result(self, name, timeout=None):
+        return self._stages[name].result(timeout)
@@ -0,0 +1,278 @@
+import io
+import json
+import math
+import os
+import queue
+import threading
+import time
+from array import array
+
+import stt_engines
+from admission import Overloaded
+from audio_decode import STT_SAMPLE_RATE, STT_SAMPLE_WIDTH, AudioDecodeError, audio_data_from_bytes
+from metrics import metrics
+
+# Live voice input over a WebSocket (/ws/voice).
+#
+# The browser sends MediaRecorder chunks (webm/opus or ogg/opus) while the user is speaking.
+# A decoder thread per utterance demuxes them as they arrive with PyAV, and each decoded
+# block of 16 kHz mono PCM goes to:
+#   - an energy-based voice activity detector, which calls the end of the utterance after
+#     VOICE_ENDPOINT_SILENCE_MS of silence following speech;
+#   - an incremental recognizer when the STT backend has one (Vosk), for partial transcripts.
+#     It holds an STT gate slot for the utterance (see stt_engines.open_stream); when the gate is
+#     saturated the utterance is decoded without one and transcribed at the end, through the gate.
+# When the utterance ends, the text is ready at once (incremental) or the PCM decoded so far
+# goes through the regular STT chain; either way nothing is left to upload.
+#
+# The socket handlers also end the utterance when the client goes quiet: no frame for
+# VOICE_IDLE_TIMEOUT_SECONDS, or VOICE_MAX_SESSION_SECONDS after it started (see check_deadline),
+# so a client that never sends audio or "stop" can't hold a worker thread.
+
+VOICE_VAD_RMS_THRESHOLD = int(os.getenv("VOICE_VAD_RMS_THRESHOLD", "500")) # s16 RMS that counts as speech
+VOICE_ENDPOINT_SILENCE_MS = int(os.getenv("VOICE_ENDPOINT_SILENCE_MS", "700"))
+VOICE_NO_SPEECH_TIMEOUT_SECONDS = float(os.getenv("VOICE_NO_SPEECH_TIMEOUT_SECONDS", "8"))
+VOICE_MAX_UTTERANCE_SECONDS = float(os.getenv("VOICE_MAX_UTTERANCE_SECONDS", "30"))
+VOICE_IDLE_TIMEOUT_SECONDS = float(os.getenv("VOICE_IDLE_TIMEOUT_SECONDS", "5"))
+VOICE_MAX_SESSION_SECONDS = float(os.getenv("VOICE_MAX_SESSION_SECONDS", "45"))
+VAD_FRAME_MS = 30
+VAD_MIN_SPEECH_MS = 90 # Speech must last this long before silence can end the utterance
+
+
+def parse_control_message(message):
+    """Parses a JSON text frame from the voice socket; anything else (or garbage) gives {}."""
+    if not isinstance(message, str):
+        return {}
+    try:
+        control = json.loads(message)
+    except ValueError:
+        return {}
+    return control if isinstance(control, dict) else {}
+
+
+class _ChunkPipe(io.RawIOBase):
+    """A read-only stream fed chunk by chunk; reads block until data arrives or end() is called."""
+
+    def __init__(self):
+        self._chunks = queue.Queue()
+        self._current = b""
+        self._ended = False
+
+    def readable(self):
+        return True
+
+    def feed(self, data):
+        self._chunks.put(bytes(data))
+
+    def end(self):
+        self._chunks.put(None)
+
+    def readinto(self, buffer):
+        while not self._current:
+            if self._ended:
+                return 0
+            chunk = self._chunks.get()
+            if chunk is None:
+                self._ended = True
+                return 0
+            self._current = chunk
+        size = min(len(buffer), len(self._current))
+        buffer[:size] = self._current[:size]
+        self._current = self._current[size:]
+        return size
+
+
+class EnergyVAD:
+    """
+    Frame-energy voice activity detector for s16 mono PCM.
+    A frame is speech when its RMS is above the threshold and well above the running noise floor.
+    """
+
+    def __init__(self, threshold=VOICE_VAD_RMS_THRESHOLD, silence_ms=VOICE_ENDPOINT_SILENCE_MS,
+                 sample_rate=STT_SAMPLE_RATE, frame_ms=VAD_FRAME_MS, min_speech_ms=VAD_MIN_SPEECH_MS):
+        self.threshold = threshold
+        self.frame_bytes = sample_rate * frame_ms // 1000 * STT_SAMPLE_WIDTH
+        self.frame_ms = frame_ms
+        self.silence_ms = silence_ms
+        self.min_speech_ms = min_speech_ms
+        self.noise_floor = 0.0
+        self.speech_ms = 0
+        self.trailing_silence_ms = 0
+        self._remainder = b""
+
+    @property
+    def speech_started(self):
+        return self.speech_ms >= self.min_speech_ms
+
+    def feed(self, pcm):
+        """Consumes PCM; returns True once speech has been followed by enough silence."""
+        data = self._remainder + bytes(pcm)
+        usable = len(data) - len(data) % self.frame_bytes
+        self._remainder = data[usable:]
+        for start in range(0, usable, self.frame_bytes):
+            samples = array("h", data[start:start + self.frame_bytes])
+            rms = math.sqrt(sum(s * s for s in samples) / len(samples))
+            if rms > self.threshold and rms > 3 * self.noise_floor:
+                self.speech_ms += self.frame_ms
+                self.trailing_silence_ms = 0
+            else:
+                # The floor follows background noise, so a noisy room doesn't read as speech
+                self.noise_floor = rms if not self.noise_floor else 0.95 * self.noise_floor + 0.05 * rms
+                if self.speech_started:
+                    self.trailing_silence_ms += self.frame_ms
+            if self.speech_started and self.trailing_silence_ms >= self.silence_ms:
+                return True
+        return False
+
+
+class VoiceStreamSession:
+    """
+    One utterance arriving as encoded chunks. Call feed() per chunk and watch for events,
+    then finish() for the text. Events are dicts:
+        {"type": "partial", "text": ...}  - running transcript (incremental backends only)
+        {"type": "endpoint", "reason": "silence" | "no_speech" | "max_length" | "decode_error" | "idle" | "max_session"}
+    on_event is called from the decoder thread; without it, events are queued on self.events.
+    """
+
+    def __init__(self, stt_backend=None, on_event=None):
+        self.stt_backend = stt_backend
+        self.events = queue.Queue()
+        self._on_event = on_event or self.events.put
+        self._pipe = _ChunkPipe()
+        self._encoded = bytearray() # Kept for the whole-clip fallback if streaming decode fails
+        self._pcm = bytearray()
+        self._vad = EnergyVAD()
+        self._stt_stream = None # Opened by the decoder thread: admission may wait for a slot
+        self._last_partial = ""
+        self._decode_failed = False
+        self._abandoned = False # Cancelled, or given up on by finish(): the stream's slot is freed
+        self.end_reason = None
+        self.started_at = time.monotonic()
+        self._last_frame_at = self.started_at
+        self._stop = threading.Event()
+        self._decoder = threading.Thread(target=self._decode_loop, name="voice-decoder", daemon=True)
+        self._decoder.start()
+
+    @property
+    def ended(self):
+        return self._stop.is_set()
+
+    def feed(self, chunk):
+        if self._stop.is_set():
+            return
+        self._last_frame_at = time.monotonic()
+        self._encoded += chunk
+        self._pipe.feed(chunk)
+
+    def check_deadline(self):
+        """
+        Ends the utterance if no frame arrived for VOICE_IDLE_TIMEOUT_SECONDS, or the session is
+        older than VOICE_MAX_SESSION_SECONDS. Call it from the receive loop; returns self.ended.
+        """
+        now = time.monotonic()
+        if now - self._last_frame_at >= VOICE_IDLE_TIMEOUT_SECONDS:
+            self._end("idle")
+        elif now - self.started_at >= VOICE_MAX_SESSION_SECONDS:
+            self._end("max_session")
+        return self.ended
+
+    def _end(self, reason):
+        if not self._stop.is_set():
+            self.end_reason = reason
+            self._stop.set()
+            self._on_event({"type": "endpoint", "reason": reason})
+
+    def _decode_loop(self):
+        try:
+            import av
+        except ImportError:
+            print("❌ The 'av' package is required to decode streamed voice input.")
+            self._decode_failed = True
+            return
+
+        self._open_stt_stream()
+        resampler = av.AudioResampler(format="s16", layout="mono", rate=STT_SAMPLE_RATE)
+        try:
+            with av.open(self._pipe, mode="r") as container:
+                for frame in container.decode(audio=0):
+                    for out in resampler.resample(frame):
+                        self._on_pcm(memoryview(out.planes[0])[:out.samples * STT_SAMPLE_WIDTH])
+                    if self._stop.is_set():
+                        return
+            for out in resampler.resample(None): # Flush samples still held by the resampler
+                self._on_pcm(memoryview(out.planes[0])[:out.samples * STT_SAMPLE_WIDTH])
+        except Exception as e:
+            if not self._stop.is_set():
+                print(f"Error decoding streamed voice input: {e}")
+                self._decode_failed = True
+                self._end("decode_error")
+
+    def _open_stt_stream(self):
+        try:
+            self._stt_stream = stt_engines.open_stream(self.stt_backend)
+        except Overloaded as e:
+            print(f"Streaming recognition turned away, transcribing at the end instead: {e}")
+            return
+        if self._abandoned and self._stt_stream is not None:
+            self._stt_stream.close()
+
+    def _release_stt_stream(self):
+        self._abandoned = True
+        if self._stt_stream is not None:
+            self._stt_stream.close()
+
+    def _on_pcm(self, pcm):
+        if self._stop.is_set():
+            return
+        self._pcm += pcm
+        if self._stt_stream is not None:
+            text = self._stt_stream.accept(pcm)
+            if text != self._last_partial:
+                self._last_partial = text
+                self._on_event({"type": "partial", "text": text})
+
+        heard_seconds = len(self._pcm) / (STT_SAMPLE_RATE * STT_SAMPLE_WIDTH)
+        if self._vad.feed(pcm):
+            self._end("silence")
+        elif not self._vad.speech_started and heard_seconds >= VOICE_NO_SPEECH_TIMEOUT_SECONDS:
+            self._end("no_speech")
+        elif heard_seconds >= VOICE_MAX_UTTERANCE_SECONDS:
+            self._end("max_length")
+
+    def cancel(self):
+        """Drops the utterance (e.g. the client disconnected) and lets the decoder thread exit."""
+        self._stop.set()
+        self._pipe.end()
+        self._release_stt_stream()
+
+    def finish(self, timeout=5.0):
+        """Ends the utterance (if the VAD hasn't already) and returns the recognized text, or ""."""
+        with metrics.span("voice_decode_drain"): # Decoding what arrived after the last chunk was read
+            self._pipe.end()
+            self._decoder.join(timeout)
+        self._stop.set()
+        if self._decoder.is_alive():
+            # Still appending to the PCM and the recognizer: don't read them, give up on the utterance
+            print(f"Streamed voice input still decoding after {timeout:g}s; treating it as unrecognized.")
+            self._release_stt_stream()
+            return ""
+
+        if self._decode_failed:
+            # Same path as a whole-clip upload to /api/chat/audio
+            self._release_stt_stream()
+            try:
+                audio = audio_data_from_bytes(bytes(self._encoded))
+            except (AudioDecodeError, ValueError) as e:
+                print(f"Could not decode streamed voice input: {e}")
+                return ""
+            return stt_engines.transcribe(audio, self.stt_backend)
+
+        if self._stt_stream is not None:
+            with metrics.span("stt"):
+                text = self._stt_stream.finish()
+            print(f"Transcribed ({self._stt_stream.name}, streaming): {text}")
+            return text
+        if not self._pcm or self.end_reason == "no_speech":
+            return ""
+        import speech_recognition as sr
+        return stt_engines.transcribe(sr.AudioData(bytes(self._pcm), STT_SAMPLE_RATE, STT_SAMPLE_WIDTH), self.stt_backend)